@@ -1,4 +1,6 @@
 import logging
+import os
+from typing import Optional
 
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
 
@@ -6,41 +8,112 @@ from app.api.routers.models import (
     ChatData,
 )
 from app.api.routers.vercel_response import VercelStreamResponse
+from app.deadline import Deadline, deadline_context
 from app.engine.query_filter import generate_filters
+from app.llms.scheduler import is_llm_overloaded
 from app.workflows import create_workflow
+from app.workflows.checkpoints import WorkflowRun, get_run_store
 
 chat_router = r = APIRouter()
 
 logger = logging.getLogger("uvicorn")
 
 
+def create_stream_response(
+    request: Optional[Request], data: ChatData, run: Optional[WorkflowRun] = None
+) -> VercelStreamResponse:
+    """
+    Run the workflow for the chat request and stream its response.
+    The workflow, its LLM calls and tools stop at the request deadline or when the stream stops.
+    """
+    deadline = Deadline.from_env()
+    last_message_content = data.get_last_message_content()
+    messages = data.get_history_messages(include_agent_messages=True)
+
+    doc_ids = data.get_chat_document_ids()
+    filters = generate_filters(doc_ids)
+    params = data.data or {}
+
+    workflow = create_workflow(
+        chat_history=messages,
+        params=params,
+        filters=filters,
+        timeout=deadline.remaining(),
+    )
+
+    # The workflow tasks are created with the current context, they all get the deadline
+    with deadline_context(deadline):
+        if run is not None:
+            event_handler = run.run(
+                workflow, input=last_message_content, streaming=True
+            )
+        else:
+            event_handler = workflow.run(input=last_message_content, streaming=True)
+    deadline.start_timer()
+    return VercelStreamResponse(
+        request=request,
+        chat_data=data,
+        event_handler=event_handler,
+        events=event_handler.stream_events(),
+        run=run,
+        deadline=deadline,
+    )
+
+
 @r.post("")
 async def chat(
     request: Request,
     data: ChatData,
     background_tasks: BackgroundTasks,
 ):
+    # Shed new chats when the LLM calls are queuing, so the running ones finish in time
+    if is_llm_overloaded():
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The server is overloaded, please try again later",
+            headers={"Retry-After": os.getenv("LLM_OVERLOAD_RETRY_AFTER", "10")},
+        )
     try:
-        last_message_content = data.get_last_message_content()
-        messages = data.get_history_messages(include_agent_messages=True)
+        run = None
+        # Checkpoint the run, so the client can resume it after a disconnection.
+        # Opt-in (RESUMABLE_RUNS=true): it serializes the context after each step.
+        if os.getenv("RESUMABLE_RUNS", "false").lower() == "true":
+            run = get_run_store().create(data)
+        return create_stream_response(request, data, run)
+    except Exception as e:
+        logger.exception("Error in chat engine", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error in chat engine: {e}",
+        ) from e
 
-        doc_ids = data.get_chat_document_ids()
-        filters = generate_filters(doc_ids)
-        params = data.data or {}
 
-        workflow = create_workflow(
-            chat_history=messages,
-            params=params,
-            filters=filters,
+@r.post("/runs/{run_id}/resume")
+async def resume_chat(request: Request, run_id: str):
+    """
+    Resume a run: replay the events already sent and continue from its last checkpoint.
+    """
+    run = get_run_store().get(run_id)
+    if run is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Run {run_id} is not found or has expired",
         )
-
-        event_handler = workflow.run(input=last_message_content, streaming=True)
+    if run.active:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Run {run_id} is still streaming",
+        )
+    if run.completed:
         return VercelStreamResponse(
             request=request,
-            chat_data=data,
-            event_handler=event_handler,
-            events=workflow.stream_events(),
+            chat_data=run.chat_data,
+            event_handler=None,
+            events=None,
+            run=run,
         )
+    try:
+        return create_stream_response(request, run.chat_data, run)
     except Exception as e:
         logger.exception("Error in chat engine", exc_info=True)
         raise HTTPException(
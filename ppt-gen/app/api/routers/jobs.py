@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+
+from app.api.routers.models import ChatData
+from app.services.jobs import (
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_RUNNING,
+    JobQueueFullError,
+    get_job_store,
+)
+
+jobs_router = r = APIRouter()
+
+logger = logging.getLogger("uvicorn")
+
+
+@r.post("")
+async def create_job(data: ChatData):
+    """
+    Queue the chat request as a background job, its response is streamed by the events endpoint.
+    """
+    try:
+        job_id = await asyncio.to_thread(
+            get_job_store().enqueue,
+            data.model_dump_json(by_alias=True),
+            int(os.getenv("JOB_QUEUE_SIZE", "100")),
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        ) from e
+    return {"id": job_id, "status": "queued"}
+
+
+@r.get("/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} is not found"
+        )
+    return job
+
+
+@r.get("/{job_id}/events")
+async def stream_job_events(
+    request: Request,
+    job_id: str,
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Stream the frames of the job as server-sent events, the data of an event is a Vercel stream frame.
+    A client re-attaching with the Last-Event-ID header only gets the frames after this event.
+    """
+    store = get_job_store()
+    if await asyncio.to_thread(store.get, job_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} is not found"
+        )
+    after = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+    async def event_generator():
+        nonlocal after
+        while not await request.is_disconnected():
+            # Read the status first, so the events of a finished job are all read below
+            job = await asyncio.to_thread(store.get, job_id)
+            events = await asyncio.to_thread(store.get_events, job_id, after)
+            for seq, frame in events:
+                yield f"id: {seq}\ndata: {frame.rstrip()}\n\n"
+                after = seq
+            if (
+                job is not None
+                and job["status"] == JOB_RUNNING
+                and job["lease_until"] is not None
+                and job["lease_until"] < time.time()
+            ):
+                # Its worker stopped, requeue or fail it even if no worker is claiming jobs
+                await asyncio.to_thread(store.expire_leases)
+            if job is None or job["status"] in (JOB_COMPLETED, JOB_FAILED):
+                job_status = job["status"] if job else "expired"
+                yield f"event: end\ndata: {job_status}\n\n"
+                return
+            await asyncio.sleep(poll_interval)
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException
+
+from app.engine.singleflight import get_single_flights
+from app.executors import get_executors
+from app.llms.hedging import get_llm_hedgers
+from app.llms.scheduler import get_llm_schedulers
+from app.loop_monitor import get_loop_monitor
+
+metrics_router = r = APIRouter()
+
+
+@r.get("/llm")
+async def get_llm_metrics():
+    """
+    Get the queue metrics of the LLM schedulers and the hedged requests.
+    """
+    return {
+        "schedulers": [scheduler.get_metrics() for scheduler in get_llm_schedulers()],
+        "hedgers": [hedger.get_metrics() for hedger in get_llm_hedgers()],
+    }
+
+
+@r.get("/single-flight")
+async def get_single_flight_metrics():
+    """
+    Get the number of calls and coalesced calls of the single-flight groups.
+    """
+    return {"groups": [group.get_metrics() for group in get_single_flights()]}
+
+
+@r.get("/executors")
+async def get_executor_metrics():
+    """
+    Get the queue metrics of the tool executors.
+    """
+    return {"executors": [executor.get_metrics() for executor in get_executors()]}
+
+
+@r.get("/loop")
+async def get_loop_metrics(limit: int = 10):
+    """
+    Get the event loop lag and the code blocking the loop the longest (with LOOP_MONITOR=true).
+    """
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is None:
+        raise HTTPException(
+            status_code=404, detail="The event loop monitor is disabled"
+        )
+    return {
+        "lag": loop_monitor.get_metrics(),
+        "offenders": loop_monitor.get_offenders(limit),
+    }
@@ -1,25 +1,201 @@
+import asyncio
+import json
 import logging
+import os
+from typing import AsyncGenerator, List, Optional
 
 from fastapi import APIRouter
-from app.engine.index import IndexConfig, get_index
-from llama_index.core.base.base_query_engine import BaseQueryEngine
+from fastapi.responses import StreamingResponse
+from llama_index.core.base.response.schema import AsyncStreamingResponse
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.settings import Settings
+from pydantic import BaseModel, Field
 
+from app.api.routers.models import SourceNodes
+from app.api.routers.vercel_response import VercelStreamResponse
+from app.engine.index import IndexConfig, get_index
+from app.engine.singleflight import get_single_flight, is_single_flight_enabled
+from app.engine.tools.query_engine import (
+    AsyncRetrieverQueryEngine,
+    create_query_engine,
+)
 
 query_router = r = APIRouter()
 
 logger = logging.getLogger("uvicorn")
 
 
-def get_query_engine() -> BaseQueryEngine:
+def get_query_engine(**kwargs) -> AsyncRetrieverQueryEngine:
     index_config = IndexConfig(**{})
     index = get_index(index_config)
-    return index.as_query_engine()
+    return create_query_engine(index, **kwargs)
 
 
 @r.get("/")
 async def query_request(
     query: str,
 ) -> str:
+    async def answer() -> str:
+        query_engine = get_query_engine()
+        response = await query_engine.aquery(query)
+        return response.response
+
+    if is_single_flight_enabled():
+        # Concurrent requests of the same query share one answer
+        return await get_single_flight("api_query").do(query, answer)
+    return await answer()
+
+
+@r.get("/stream")
+async def query_stream_request(
+    query: str,
+) -> StreamingResponse:
+    """
+    Stream the answer of a query using the Vercel data stream format:
+    the retrieved sources are sent first, then the synthesized tokens as they are generated.
+    """
+    query_engine = get_query_engine(streaming=True)
+    return StreamingResponse(_query_stream_generator(query_engine, query))
+
+
+async def _query_stream_generator(
+    query_engine: RetrieverQueryEngine,
+    query: str,
+) -> AsyncGenerator[str, None]:
+    try:
+        query_bundle = QueryBundle(query_str=query)
+        nodes = await query_engine.aretrieve(query_bundle)
+        yield VercelStreamResponse.convert_data(
+            {
+                "type": "sources",
+                "data": {
+                    "nodes": [
+                        source.model_dump()
+                        for source in SourceNodes.from_source_nodes(nodes)
+                    ]
+                },
+            }
+        )
+
+        response = await query_engine.asynthesize(query_bundle, nodes)
+        if isinstance(response, AsyncStreamingResponse):
+            async for token in response.async_response_gen():
+                yield VercelStreamResponse.convert_text(token)
+        else:
+            # E.g. the multi-modal synthesizer doesn't support streaming
+            yield VercelStreamResponse.convert_text(str(response))
+    except Exception as e:
+        logger.error(f"Error streaming query response: {e}", exc_info=True)
+        yield VercelStreamResponse.convert_error(
+            "An unexpected error occurred while processing your query. Please try again."
+        )
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=int(os.getenv("QUERY_BATCH_MAX_QUERIES", "1000")),
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Maximum number of queries synthesized at the same time",
+    )
+
+
+@r.post("/batch")
+async def query_batch_request(request: BatchQueryRequest) -> StreamingResponse:
+    """
+    Answer many queries at once, streaming one JSON line per query as soon as it's answered.
+    The queries are embedded and retrieved in batches of QUERY_BATCH_SIZE (one vector store request per batch),
+    then their answers are synthesized concurrently.
+    """
     query_engine = get_query_engine()
-    response = await query_engine.aquery(query)
-    return response.response
+    max_concurrency = request.max_concurrency or int(
+        os.getenv("QUERY_BATCH_CONCURRENCY", "8")
+    )
+    return StreamingResponse(
+        _batch_query_generator(
+            query_engine,
+            request.queries,
+            max_concurrency,
+            batch_size=max(1, int(os.getenv("QUERY_BATCH_SIZE", "32"))),
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+async def _batch_query_generator(
+    query_engine: AsyncRetrieverQueryEngine,
+    queries: List[str],
+    max_concurrency: int,
+    batch_size: int,
+) -> AsyncGenerator[str, None]:
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def _answer(
+        index: int, query_bundle: QueryBundle, nodes: List[NodeWithScore]
+    ) -> None:
+        async with semaphore:
+            try:
+                response = await query_engine.asynthesize(query_bundle, nodes)
+                result = {
+                    "index": index,
+                    "query": query_bundle.query_str,
+                    "response": str(response),
+                    "sources": [
+                        source.model_dump()
+                        for source in SourceNodes.from_source_nodes(nodes)
+                    ],
+                }
+            except Exception as e:
+                logger.error(f"Error answering batch query {index}: {e}")
+                result = {
+                    "index": index,
+                    "query": query_bundle.query_str,
+                    "error": str(e),
+                }
+        await results.put(result)
+
+    async def _retrieve_batches() -> None:
+        embed_model = Settings.embed_model
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start : start + batch_size]
+            try:
+                # Use the query embeddings, they differ from the text embeddings for asymmetric models
+                embeddings = await asyncio.gather(
+                    *[embed_model.aget_query_embedding(query) for query in batch]
+                )
+                query_bundles = [
+                    QueryBundle(query_str=query, embedding=embedding)
+                    for query, embedding in zip(batch, embeddings)
+                ]
+                nodes_lists = await query_engine.abatch_retrieve(query_bundles)
+            except Exception as e:
+                logger.error(f"Error retrieving the batch queries: {e}", exc_info=True)
+                for index, query in enumerate(batch, start=start):
+                    await results.put(
+                        {
+                            "index": index,
+                            "query": query,
+                            "error": f"Error retrieving the query: {e}",
+                        }
+                    )
+                continue
+            for index, (query_bundle, nodes) in enumerate(
+                zip(query_bundles, nodes_lists), start=start
+            ):
+                tasks.append(asyncio.create_task(_answer(index, query_bundle, nodes)))
+
+    tasks.append(asyncio.create_task(_retrieve_batches()))
+    try:
+        for _ in range(len(queries)):
+            yield json.dumps(await results.get()) + "\n"
+    finally:
+        # Stop the remaining work if the client disconnects
+        for task in tasks:
+            task.cancel()
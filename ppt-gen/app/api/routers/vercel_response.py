@@ -1,11 +1,14 @@
 import asyncio
 import json
 import logging
-from typing import AsyncGenerator, Awaitable, List
+import os
+from typing import AsyncGenerator, AsyncIterator, Awaitable, List, Optional
 
 from aiostream import stream
 from app.api.routers.models import ChatData, Message
 from app.api.services.suggestion import NextQuestionSuggestion
+from app.deadline import Deadline
+from app.workflows.checkpoints import WorkflowRun
 from fastapi import Request
 from fastapi.responses import StreamingResponse
 
@@ -15,23 +18,52 @@ logger = logging.getLogger("uvicorn")
 class VercelStreamResponse(StreamingResponse):
     """
     Base class to convert the response from the chat engine to the streaming format expected by Vercel
+
+    The tokens received within STREAM_COALESCE_WINDOW seconds (0 to disable) are sent in one text frame
+    of at most about STREAM_FRAME_SIZE characters.
     """
 
     TEXT_PREFIX = "0:"
     DATA_PREFIX = "8:"
     ERROR_PREFIX = "3:"
 
-    def __init__(self, request: Request, chat_data: ChatData, *args, **kwargs):
+    def __init__(
+        self,
+        request: Request,
+        chat_data: ChatData,
+        *args,
+        run: Optional[WorkflowRun] = None,
+        deadline: Optional[Deadline] = None,
+        **kwargs,
+    ):
         self.request = request
         self.chat_data = chat_data
+        self.run = run
+        self.deadline = deadline
+        self.coalesce_window = float(os.getenv("STREAM_COALESCE_WINDOW", "0.05"))
+        self.frame_size = max(1, int(os.getenv("STREAM_FRAME_SIZE", "512")))
         content = self.content_generator(*args, **kwargs)
-        super().__init__(content=content)
+        headers = {"X-Run-Id": run.run_id} if run is not None else None
+        super().__init__(content=content, headers=headers)
 
     async def content_generator(self, event_handler, events):
+        is_stream_started = False
+        if self.run is not None:
+            # Send the run id and the frames of a resumed run right away
+            is_stream_started = True
+            self.run.active = True
+            yield self.convert_text("")
+            yield self.convert_data({"type": "run", "data": {"id": self.run.run_id}})
+            for frame in self.run.get_replay_frames():
+                yield frame
+            if event_handler is None:
+                # The run has already completed
+                self.run.active = False
+                return
+
         stream = self._create_stream(
             self.request, self.chat_data, event_handler, events
         )
-        is_stream_started = False
         try:
             async with stream.stream() as streamer:
                 async for output in streamer:
@@ -41,6 +73,8 @@ class VercelStreamResponse(StreamingResponse):
                         yield self.convert_text("")
 
                     yield output
+            if self.run is not None:
+                self.run.completed = True
         except asyncio.CancelledError:
             logger.warning("Workflow has been cancelled!")
         except Exception as e:
@@ -52,6 +86,11 @@ class VercelStreamResponse(StreamingResponse):
             )
         finally:
             await event_handler.cancel_run()
+            if self.deadline is not None:
+                # Stop the work still running in threads and sandboxes
+                self.deadline.cancel("The response stream has stopped")
+            if self.run is not None:
+                self.run.active = False
             logger.info("The stream has been stopped!")
 
     def _create_stream(
@@ -68,23 +107,32 @@ class VercelStreamResponse(StreamingResponse):
             final_response = ""
 
             if isinstance(result, AsyncGenerator):
-                async for token in result:
-                    final_response += str(token.delta)
-                    yield self.convert_text(token.delta)
+
+                async def deltas():
+                    nonlocal final_response
+                    async for token in result:
+                        if token.delta:
+                            final_response += token.delta
+                            yield token.delta
+
+                async for text in self._coalesce_tokens(deltas()):
+                    yield self._record(self.convert_text(text))
             else:
                 if hasattr(result, "response"):
                     content = result.response.message.content
                     if content:
-                        for token in content:
-                            final_response += str(token)
-                            yield self.convert_text(token)
+                        final_response = content
+                        for i in range(0, len(content), self.frame_size):
+                            yield self._record(
+                                self.convert_text(content[i : i + self.frame_size])
+                            )
 
             # Generate next questions if next question prompt is configured
             question_data = await self._generate_next_questions(
                 chat_data.messages, final_response
             )
             if question_data:
-                yield self.convert_data(question_data)
+                yield self._record(self.convert_data(question_data))
 
             # TODO: stream sources
 
@@ -95,11 +143,76 @@ class VercelStreamResponse(StreamingResponse):
                 if verbose:
                     logger.debug(event_response)
                 if event_response is not None:
-                    yield self.convert_data(event_response)
+                    yield self._record(self.convert_data(event_response))
 
         combine = stream.merge(_chat_response_generator(), _event_generator())
         return combine
 
+    async def _coalesce_tokens(
+        self, tokens: AsyncIterator[str]
+    ) -> AsyncGenerator[str, None]:
+        """
+        Merge the tokens into larger texts to send fewer frames.
+        The first token is sent right away, the next ones are buffered for up to `coalesce_window` seconds
+        or until the buffer reaches `frame_size` characters.
+        """
+        if self.coalesce_window <= 0:
+            async for token in tokens:
+                yield token
+            return
+
+        loop = asyncio.get_running_loop()
+        iterator = tokens.__aiter__()
+        buffer: List[str] = []
+        size = 0
+        flush_at = 0.0
+        is_first = True
+        next_token: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if next_token is None:
+                    next_token = asyncio.ensure_future(iterator.__anext__())
+                if buffer:
+                    # Send the buffer when the window ends, even if the LLM is stalled
+                    done, _ = await asyncio.wait(
+                        {next_token}, timeout=max(0.0, flush_at - loop.time())
+                    )
+                    if not done:
+                        yield "".join(buffer)
+                        buffer, size = [], 0
+                        continue
+                try:
+                    token = await next_token
+                except StopAsyncIteration:
+                    break
+                finally:
+                    next_token = None
+                if is_first:
+                    is_first = False
+                    yield token
+                    continue
+                if not buffer:
+                    flush_at = loop.time() + self.coalesce_window
+                buffer.append(token)
+                size += len(token)
+                if size >= self.frame_size:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+        finally:
+            if next_token is not None:
+                next_token.cancel()
+        if buffer:
+            yield "".join(buffer)
+
+    def _record(self, frame: str) -> str:
+        """
+        Record the frame for resuming the run, as soon as it's produced:
+        its event is no longer in the workflow context.
+        """
+        if self.run is not None:
+            self.run.add_frame(frame)
+        return frame
+
     @classmethod
     def convert_text(cls, token: str):
         # Escape newlines and double quotes to avoid breaking the stream
@@ -4,6 +4,8 @@ import re
 from typing import List, Optional
 
 from app.api.routers.models import Message
+from app.llms.roles import LLMRole, get_llm
+from app.llms.scheduler import LLMPriority, llm_priority
 from llama_index.core.prompts import PromptTemplate
 from llama_index.core.settings import Settings
 
@@ -51,8 +53,16 @@ class NextQuestionSuggestion:
 
             # Call the LLM and parse questions from the output
             prompt = prompt_template.format(conversation=conversation)
-            output = await Settings.llm.acomplete(prompt)
-            questions = cls._extract_questions(output.text)
+            # Suggestions are skipped first when the LLM is overloaded
+            llm = get_llm(LLMRole.SUGGESTER)
+            with llm_priority(LLMPriority.SUGGESTION):
+                output = await llm.acomplete(prompt)
+                questions = cls._extract_questions(output.text)
+                if not questions and llm is not Settings.llm:
+                    # The suggester model didn't follow the output format
+                    logger.info("Retrying the question suggestion with the default LLM")
+                    output = await Settings.llm.acomplete(prompt)
+                    questions = cls._extract_questions(output.text)
 
             return questions
         except Exception as e:
@@ -0,0 +1,202 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class Deadline:
+    """
+    The deadline of a request, carried by a context variable to its workflow steps, LLM calls and tools.
+
+    The deadline is cancelled when it expires or when the response stream stops (e.g. the client disconnected).
+    Long running work checks it and registers cleanup callbacks with `on_cancel`, e.g. to kill a sandbox.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def from_env(cls) -> "Deadline":
+        return cls(float(os.getenv("REQUEST_TIMEOUT", "360")))
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Get the seconds left before the deadline, None without a timeout.
+        """
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def is_expired(self) -> bool:
+        return self.cancelled or self.remaining() == 0
+
+    def check(self) -> None:
+        if self.is_expired():
+            raise DeadlineExceededError(self.reason or "The request deadline expired")
+
+    def start_timer(self) -> None:
+        """
+        Cancel the deadline when it expires, must be called in the event loop.
+        """
+        remaining = self.remaining()
+        if remaining is not None and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                remaining, self.cancel, "The request deadline expired"
+            )
+
+    def cancel(self, reason: str = "The request was cancelled") -> None:
+        """
+        Cancel the deadline and run its cleanup callbacks, once.
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if self._timer is not None:
+            self._timer.cancel()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Failed to clean up the cancelled request: {e}")
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """
+        Call the callback if the deadline is cancelled while in this context (right away if it already is).
+        The callback may run in the event loop, it must not block.
+        """
+        with self._lock:
+            cancelled = self._cancelled.is_set()
+            if not cancelled:
+                self._callbacks.append(callback)
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+@contextmanager
+def deadline_context(deadline: Optional[Deadline]) -> Iterator[None]:
+    """
+    Set the deadline of the work started in this context (and the tasks it creates).
+    """
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def detached_context() -> contextvars.Context:
+    """
+    Get a copy of the current context without a request deadline,
+    for the work shared by several requests (each one waits for it with its own deadline).
+    """
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+    return context
+
+
+def check_deadline() -> None:
+    """
+    Raise a DeadlineExceededError if the deadline of the current request has expired or is cancelled.
+    """
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def get_remaining_time() -> Optional[float]:
+    deadline = _deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+@contextmanager
+def on_cancel(callback: Callable[[], None]) -> Iterator[None]:
+    """
+    Register a cleanup callback on the deadline of the current request, if there is one.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        yield
+        return
+    with deadline.on_cancel(callback):
+        yield
+
+
+async def wait_with_deadline(aw: Awaitable[T], deadline: Optional[Deadline]) -> T:
+    """
+    Await until the deadline, the awaitable is cancelled when it expires.
+    """
+    if deadline is None:
+        return await aw
+    try:
+        deadline.check()
+    except DeadlineExceededError:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        raise
+    try:
+        return await asyncio.wait_for(aw, deadline.remaining())
+    except asyncio.TimeoutError:
+        if deadline.is_expired():
+            raise DeadlineExceededError(
+                deadline.reason or "The request deadline expired"
+            ) from None
+        raise
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    A thread pool running each call in the context of its caller,
+    so the sync tools (run with `run_in_executor`) see the deadline of their request.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+def install_context_executor() -> None:
+    """
+    Use a ContextThreadPoolExecutor as the default executor of the running event loop.
+    """
+    asyncio.get_running_loop().set_default_executor(ContextThreadPoolExecutor())
@@ -0,0 +1,360 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.schema import (
+    BaseNode,
+    MetadataMode,
+    NodeRelationship,
+    NodeWithScore,
+    QueryBundle,
+    RelatedNodeInfo,
+    TextNode,
+)
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+
+logger = logging.getLogger("uvicorn")
+
+STORAGE_DIR = os.getenv("STORAGE_DIR", "storage")
+BM25_INDEX_FILE = "bm25_index.json"
+
+# Keep tokens like "10-k", "fy2023" or "1.25" together, they are what
+# financial questions usually hinge on.
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    """
+    a an and are as at be but by for from has have in into is it its of on or
+    that the their there these this to was were what when where which who will
+    with how does did do
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token
+        for token in _TOKEN_PATTERN.findall(text.lower())
+        if token not in _STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    A local inverted index scoring nodes with Okapi BM25.
+    Entries are grouped by their source document so re-ingesting a document replaces its nodes.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        # term -> {node_id: term frequency}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        # node_id -> {"text", "metadata", "ref_doc_id", "length", "excluded_*_metadata_keys"}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ref_doc_ids(self) -> Set[str]:
+        with self._lock:
+            return {entry["ref_doc_id"] for entry in self._entries.values()}
+
+    def add_nodes(self, nodes: Sequence[BaseNode]) -> None:
+        """
+        Add nodes to the index, replacing the existing nodes of the same source documents.
+        """
+        with self._lock:
+            ref_doc_ids = {node.ref_doc_id for node in nodes if node.ref_doc_id}
+            self.delete_ref_docs(ref_doc_ids)
+            for node in nodes:
+                text = node.get_content(metadata_mode=MetadataMode.NONE)
+                self._add_entry(
+                    node.node_id,
+                    text=text,
+                    metadata=dict(node.metadata),
+                    ref_doc_id=node.ref_doc_id,
+                    excluded_embed_metadata_keys=node.excluded_embed_metadata_keys,
+                    excluded_llm_metadata_keys=node.excluded_llm_metadata_keys,
+                )
+
+    def delete_ref_docs(self, ref_doc_ids: Iterable[str]) -> None:
+        with self._lock:
+            ref_doc_ids = set(ref_doc_ids)
+            if not ref_doc_ids:
+                return
+            node_ids = [
+                node_id
+                for node_id, entry in self._entries.items()
+                if entry["ref_doc_id"] in ref_doc_ids
+            ]
+            for node_id in node_ids:
+                self._remove_entry(node_id)
+
+    def prune_public_docs(self, keep_ref_doc_ids: Iterable[str]) -> None:
+        """
+        Remove nodes of public documents that are no longer part of the data source.
+        Private (uploaded) documents are not managed by the generate script, so they are kept.
+        """
+        with self._lock:
+            keep_ref_doc_ids = set(keep_ref_doc_ids)
+            stale_ref_doc_ids = {
+                entry["ref_doc_id"]
+                for entry in self._entries.values()
+                if entry["metadata"].get("private") != "true"
+                and entry["ref_doc_id"] not in keep_ref_doc_ids
+            }
+            self.delete_ref_docs(stale_ref_doc_ids)
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[MetadataFilters] = None,
+    ) -> List[NodeWithScore]:
+        with self._lock:
+            query_terms = set(tokenize(query))
+            if not query_terms or not self._entries:
+                return []
+
+            num_docs = len(self._entries)
+            avg_length = self._total_length / num_docs
+            scores: Dict[str, float] = {}
+            for term in query_terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                doc_freq = len(postings)
+                idf = math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                for node_id, tf in postings.items():
+                    length = self._entries[node_id]["length"]
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[node_id] = (
+                        scores.get(node_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+                    )
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            results: List[NodeWithScore] = []
+            for node_id, score in ranked:
+                entry = self._entries[node_id]
+                if filters is not None and not _match_filters(
+                    _filterable_metadata(entry), filters
+                ):
+                    continue
+                results.append(
+                    NodeWithScore(node=_entry_to_node(node_id, entry), score=score)
+                )
+                if len(results) >= top_k:
+                    break
+            return results
+
+    def persist(self, persist_dir: str = STORAGE_DIR) -> None:
+        with self._lock:
+            os.makedirs(persist_dir, exist_ok=True)
+            path = os.path.join(persist_dir, BM25_INDEX_FILE)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"k1": self.k1, "b": self.b, "entries": self._entries}, f)
+            # Replace atomically so readers never see a partially written index
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str = STORAGE_DIR) -> "BM25Index":
+        path = os.path.join(persist_dir, BM25_INDEX_FILE)
+        with open(path) as f:
+            data = json.load(f)
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        for node_id, entry in data["entries"].items():
+            index._add_entry(
+                node_id,
+                text=entry["text"],
+                metadata=entry["metadata"],
+                ref_doc_id=entry["ref_doc_id"],
+                excluded_embed_metadata_keys=entry.get("excluded_embed_metadata_keys"),
+                excluded_llm_metadata_keys=entry.get("excluded_llm_metadata_keys"),
+            )
+        return index
+
+    def _add_entry(
+        self,
+        node_id: str,
+        text: str,
+        metadata: Dict[str, Any],
+        ref_doc_id: Optional[str],
+        excluded_embed_metadata_keys: Optional[List[str]] = None,
+        excluded_llm_metadata_keys: Optional[List[str]] = None,
+    ) -> None:
+        if node_id in self._entries:
+            self._remove_entry(node_id)
+        term_counts = Counter(tokenize(text))
+        length = sum(term_counts.values())
+        self._entries[node_id] = {
+            "text": text,
+            "metadata": metadata,
+            "ref_doc_id": ref_doc_id,
+            "length": length,
+            "excluded_embed_metadata_keys": list(excluded_embed_metadata_keys or []),
+            "excluded_llm_metadata_keys": list(excluded_llm_metadata_keys or []),
+        }
+        self._total_length += length
+        for term, tf in term_counts.items():
+            self._postings.setdefault(term, {})[node_id] = tf
+
+    def _remove_entry(self, node_id: str) -> None:
+        entry = self._entries.pop(node_id)
+        self._total_length -= entry["length"]
+        for term in set(tokenize(entry["text"])):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(node_id, None)
+            if not postings:
+                del self._postings[term]
+
+
+_bm25_index: Optional[BM25Index] = None
+_bm25_index_mtime: Optional[float] = None
+_bm25_index_lock = threading.Lock()
+
+
+def get_bm25_index(persist_dir: str = STORAGE_DIR) -> BM25Index:
+    """
+    Get the process-wide BM25 index.
+    The index is loaded once and only reloaded if the persisted file was changed by another process.
+    """
+    global _bm25_index, _bm25_index_mtime
+    path = os.path.join(persist_dir, BM25_INDEX_FILE)
+    with _bm25_index_lock:
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if _bm25_index is None or (mtime is not None and mtime != _bm25_index_mtime):
+            if mtime is not None:
+                logger.info(f"Loading BM25 index from {path}")
+                _bm25_index = BM25Index.from_persist_dir(persist_dir)
+            else:
+                _bm25_index = BM25Index()
+            _bm25_index_mtime = mtime
+        return _bm25_index
+
+
+def update_bm25_index(
+    nodes: Sequence[BaseNode],
+    keep_ref_doc_ids: Optional[Iterable[str]] = None,
+    persist_dir: str = STORAGE_DIR,
+) -> None:
+    """
+    Add the nodes to the BM25 index and persist it.
+    If `keep_ref_doc_ids` is set, public documents not in the list are removed.
+    """
+    global _bm25_index_mtime
+    index = get_bm25_index(persist_dir)
+    index.add_nodes(nodes)
+    if keep_ref_doc_ids is not None:
+        index.prune_public_docs(keep_ref_doc_ids)
+    index.persist(persist_dir)
+    with _bm25_index_lock:
+        # Our in-memory index is already up to date, avoid reloading it
+        _bm25_index_mtime = os.path.getmtime(
+            os.path.join(persist_dir, BM25_INDEX_FILE)
+        )
+    logger.info(f"Updated BM25 index, it contains {len(index)} nodes")
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    Retrieve nodes from the local BM25 index.
+    """
+
+    def __init__(
+        self,
+        index: BM25Index,
+        similarity_top_k: int = 2,
+        filters: Optional[MetadataFilters] = None,
+        callback_manager: Optional[CallbackManager] = None,
+    ):
+        super().__init__(callback_manager=callback_manager)
+        self._index = index
+        self._similarity_top_k = similarity_top_k
+        self._filters = filters
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._index.search(
+            query_bundle.query_str,
+            top_k=self._similarity_top_k,
+            filters=self._filters,
+        )
+
+
+def _entry_to_node(node_id: str, entry: Dict[str, Any]) -> TextNode:
+    relationships = {}
+    if entry["ref_doc_id"]:
+        relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(
+            node_id=entry["ref_doc_id"]
+        )
+    return TextNode(
+        id_=node_id,
+        text=entry["text"],
+        metadata=dict(entry["metadata"]),
+        excluded_embed_metadata_keys=list(
+            entry.get("excluded_embed_metadata_keys", [])
+        ),
+        excluded_llm_metadata_keys=list(entry.get("excluded_llm_metadata_keys", [])),
+        relationships=relationships,
+    )
+
+
+def _filterable_metadata(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # The vector store exposes the source document id as `doc_id`, mirror it for filtering
+    return {**entry["metadata"], "doc_id": entry["ref_doc_id"]}
+
+
+def _match_filters(metadata: Dict[str, Any], filters: MetadataFilters) -> bool:
+    results = []
+    for metadata_filter in filters.filters:
+        if isinstance(metadata_filter, MetadataFilters):
+            results.append(_match_filters(metadata, metadata_filter))
+        else:
+            results.append(_match_filter(metadata, metadata_filter))
+    if not results:
+        return True
+    if filters.condition == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+
+def _match_filter(metadata: Dict[str, Any], metadata_filter: MetadataFilter) -> bool:
+    value = metadata.get(metadata_filter.key)
+    match metadata_filter.operator:
+        case FilterOperator.EQ:
+            return value == metadata_filter.value
+        case FilterOperator.NE:
+            return value != metadata_filter.value
+        case FilterOperator.IN:
+            return value in _filter_values(metadata_filter)
+        case FilterOperator.NIN:
+            return value not in _filter_values(metadata_filter)
+        case _:
+            raise ValueError(
+                f"Filter operator {metadata_filter.operator} is not supported by the BM25 index"
+            )
+
+
+def _filter_values(metadata_filter: MetadataFilter) -> List[Any]:
+    values = metadata_filter.value
+    if values is None:
+        return []
+    if isinstance(values, list):
+        return values
+    return [values]
@@ -0,0 +1,76 @@
+import re
+from typing import Callable, List, Optional, Set
+
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+
+from app.engine.bm25 import tokenize
+
+_SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [
+        sentence.strip()
+        for sentence in _SENTENCE_SPLIT_PATTERN.split(text)
+        if sentence.strip()
+    ]
+
+
+def deduplicate_nodes(nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+    """
+    Remove nodes returned more than once or with the same text, keeping the first (best ranked) one.
+    """
+    seen_ids: Set[str] = set()
+    seen_texts: Set[str] = set()
+    unique_nodes = []
+    for node in nodes:
+        text = " ".join(node.node.get_content(metadata_mode=MetadataMode.NONE).split())
+        if node.node.node_id in seen_ids or text in seen_texts:
+            continue
+        seen_ids.add(node.node.node_id)
+        seen_texts.add(text)
+        unique_nodes.append(node)
+    return unique_nodes
+
+
+def compress_nodes(
+    query: str,
+    nodes: List[NodeWithScore],
+    token_budget: int,
+    tokenizer: Optional[Callable[[str], List]] = None,
+) -> List[str]:
+    """
+    Extractive compression of the retrieved nodes to fit a token budget.
+
+    Sentences are ranked by their overlap with the query terms (ties are broken by node rank),
+    the best ones are kept until the budget is used up and then put back in their original order.
+    Returns the compressed text of each node, empty if none of its sentences were kept.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    query_terms = set(tokenize(query))
+
+    candidates = []
+    for node_rank, node in enumerate(nodes):
+        text = node.node.get_content(metadata_mode=MetadataMode.NONE)
+        for position, sentence in enumerate(split_sentences(text)):
+            overlap = len(query_terms.intersection(tokenize(sentence)))
+            candidates.append((overlap, node_rank, position, sentence))
+
+    # The best sentences first: highest overlap, then the best ranked node, then the earliest sentence
+    candidates.sort(key=lambda item: (-item[0], item[1], item[2]))
+    selected = []
+    used_tokens = 0
+    for candidate in candidates:
+        num_tokens = len(tokenizer(candidate[3]))
+        if used_tokens + num_tokens > token_budget:
+            continue
+        selected.append(candidate)
+        used_tokens += num_tokens
+
+    passages: List[List[str]] = [[] for _ in nodes]
+    for _, node_rank, _, sentence in sorted(
+        selected, key=lambda item: (item[1], item[2])
+    ):
+        passages[node_rank].append(sentence)
+    return [" ".join(sentences) for sentences in passages]
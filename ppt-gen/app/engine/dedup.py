@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, List, Optional, Sequence
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import (
+    BaseNode,
+    ImageNode,
+    MetadataMode,
+    NodeWithScore,
+    QueryBundle,
+    TextNode,
+    TransformComponent,
+)
+from llama_index.core.utils import get_tokenizer
+
+from app.engine.bm25 import tokenize
+
+logger = logging.getLogger("uvicorn")
+
+SIMHASH_METADATA_KEY = "simhash"
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+
+
+def _shingle_hash(shingle: str) -> int:
+    digest = hashlib.blake2b(shingle.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+# The signature stored by older ingestions for the nodes without text
+_EMPTY_SIMHASH = _shingle_hash("")
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    Compute the 64-bit SimHash of a text from its word shingles, None if it has no words.
+    Texts that only differ by a few words get signatures with a small Hamming distance.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [
+            " ".join(tokens[i : i + SHINGLE_SIZE])
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)
+        ]
+
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles:
+        value = _shingle_hash(shingle)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _is_text_node(node: BaseNode) -> bool:
+    return isinstance(node, TextNode) and not isinstance(node, ImageNode)
+
+
+def get_node_simhash(node: BaseNode) -> Optional[int]:
+    """
+    Get the signature stored at ingestion.
+    Returns None for the nodes without text (e.g. images) and the nodes ingested without a signature,
+    they aren't hashed at query time.
+    """
+    if not _is_text_node(node):
+        return None
+    value = node.metadata.get(SIMHASH_METADATA_KEY)
+    if value is None or int(value, 16) == _EMPTY_SIMHASH:
+        return None
+    return int(value, 16)
+
+
+class SimHashExtractor(TransformComponent):
+    """
+    Ingestion transformation storing the SimHash signature of each node in its metadata.
+    The signature is stored as a hex string (vector stores don't all support unsigned 64-bit integers)
+    and is hidden from the embedding model and the LLM.
+    """
+
+    def __call__(self, nodes: Sequence[BaseNode], **kwargs: Any) -> Sequence[BaseNode]:
+        for node in nodes:
+            if not _is_text_node(node):
+                continue
+            signature = simhash(node.get_content(metadata_mode=MetadataMode.NONE))
+            if signature is None:
+                continue
+            node.metadata[SIMHASH_METADATA_KEY] = f"{signature:016x}"
+            for excluded_keys in (
+                node.excluded_embed_metadata_keys,
+                node.excluded_llm_metadata_keys,
+            ):
+                if SIMHASH_METADATA_KEY not in excluded_keys:
+                    excluded_keys.append(SIMHASH_METADATA_KEY)
+        return nodes
+
+
+class NearDuplicatePostprocessor(BaseNodePostprocessor):
+    """
+    Collapse near-duplicate retrieved nodes (e.g. boilerplate repeated across quarterly filings)
+    so they don't inflate the synthesis prompt. The best ranked node of each group is kept.
+    """
+
+    max_distance: int = Field(
+        default=6,
+        description="Maximum Hamming distance between two SimHash signatures to be near-duplicates",
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NearDuplicatePostprocessor"
+
+    @classmethod
+    def from_env(cls) -> Optional["NearDuplicatePostprocessor"]:
+        """
+        Create the postprocessor from the DEDUP_HAMMING_DISTANCE environment variable.
+        Returns None if it's disabled (negative distance).
+        """
+        max_distance = int(os.getenv("DEDUP_HAMMING_DISTANCE", "6"))
+        if max_distance < 0:
+            return None
+        return cls(max_distance=max_distance)
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        kept_nodes: List[NodeWithScore] = []
+        kept_signatures: List[int] = []
+        removed_nodes: List[NodeWithScore] = []
+        for node in nodes:
+            signature = get_node_simhash(node.node)
+            if signature is None:
+                kept_nodes.append(node)
+                continue
+            if any(
+                hamming_distance(signature, kept) <= self.max_distance
+                for kept in kept_signatures
+            ):
+                removed_nodes.append(node)
+                continue
+            kept_nodes.append(node)
+            kept_signatures.append(signature)
+
+        if removed_nodes:
+            tokenizer = get_tokenizer()
+            saved_tokens = sum(
+                len(tokenizer(node.node.get_content(metadata_mode=MetadataMode.LLM)))
+                for node in removed_nodes
+            )
+            logger.info(
+                f"Removed {len(removed_nodes)}/{len(nodes)} near-duplicate nodes, saving ~{saved_tokens} prompt tokens"
+            )
+        return kept_nodes
+
+    async def apostprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        # Counting the saved tokens is CPU bound, don't block the event loop while it runs
+        return await asyncio.to_thread(
+            self.postprocess_nodes, nodes, query_bundle=query_bundle
+        )
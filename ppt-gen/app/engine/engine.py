@@ -7,7 +7,7 @@ from llama_index.core.settings import Settings
 from llama_index.core.tools import BaseTool
 
 from app.engine.index import IndexConfig, get_index
-from app.engine.tools import ToolFactory
+from app.engine.tools import get_tool_registry
 from app.engine.tools.query_engine import get_query_engine_tool
 
 
@@ -24,7 +24,7 @@ def get_chat_engine(params=None, event_handlers=None, **kwargs):
         tools.append(query_engine_tool)
 
     # Add additional tools
-    configured_tools: List[BaseTool] = ToolFactory.from_env()
+    configured_tools: List[BaseTool] = get_tool_registry().get_tools()  # type: ignore
     tools.extend(configured_tools)
 
     return AgentRunner.from_llm(
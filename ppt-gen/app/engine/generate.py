@@ -12,7 +12,10 @@ from llama_index.core.settings import Settings
 from llama_index.core.storage import StorageContext
 from llama_index.core.storage.docstore import SimpleDocumentStore
 
+from app.engine.bm25 import get_bm25_index, update_bm25_index
+from app.engine.dedup import SimHashExtractor
 from app.engine.loaders import get_documents
+from app.engine.retrievers import HybridSearchMode, get_hybrid_search_mode
 from app.engine.vectordb import get_vector_store
 from app.settings import init_settings
 
@@ -38,6 +41,7 @@ def run_pipeline(docstore, vector_store, documents):
                 chunk_size=Settings.chunk_size,
                 chunk_overlap=Settings.chunk_overlap,
             ),
+            SimHashExtractor(),
             Settings.embed_model,
         ],
         docstore=docstore,
@@ -59,6 +63,19 @@ def persist_storage(docstore, vector_store):
     storage_context.persist(STORAGE_DIR)
 
 
+def update_sparse_index(nodes, documents):
+    # The pipeline only returns nodes of new or changed documents,
+    # the nodes of unchanged documents are already in the persisted BM25 index
+    doc_ids = {doc.doc_id for doc in documents}
+    update_bm25_index(nodes, keep_ref_doc_ids=doc_ids, persist_dir=STORAGE_DIR)
+    missing_doc_ids = doc_ids - get_bm25_index(STORAGE_DIR).ref_doc_ids()
+    if missing_doc_ids:
+        logger.warning(
+            f"{len(missing_doc_ids)} unchanged documents are not in the BM25 index. "
+            f"Delete the '{STORAGE_DIR}' directory and re-run the generation to index them."
+        )
+
+
 def generate_datasource():
     init_settings()
     logger.info("Generate index for the provided data")
@@ -72,11 +89,14 @@ def generate_datasource():
     vector_store = get_vector_store()
 
     # Run the ingestion pipeline
-    _ = run_pipeline(docstore, vector_store, documents)
+    nodes = run_pipeline(docstore, vector_store, documents)
 
     # Build the index and persist storage
     persist_storage(docstore, vector_store)
 
+    if get_hybrid_search_mode() == HybridSearchMode.LOCAL:
+        update_sparse_index(nodes, documents)
+
     logger.info("Finished generating the index")
 
 
@@ -1,19 +1,19 @@
+import copy
 import logging
 from typing import Any, Dict, List
 
-import yaml  # type: ignore
 from app.engine.loaders.db import DBLoaderConfig, get_db_documents
 from app.engine.loaders.file import FileLoaderConfig, get_file_documents
 from app.engine.loaders.web import WebLoaderConfig, get_web_documents
+from app.services.config import get_config_service
 from llama_index.core import Document
 
 logger = logging.getLogger(__name__)
 
 
 def load_configs() -> Dict[str, Any]:
-    with open("config/loaders.yaml") as f:
-        configs = yaml.safe_load(f)
-    return configs
+    # Copy to keep the shared config immutable
+    return copy.deepcopy(get_config_service().config.loaders)
 
 
 def get_documents() -> List[Document]:
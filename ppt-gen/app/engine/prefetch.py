@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.engine.bm25 import tokenize
+
+logger = logging.getLogger("uvicorn")
+
+
+def query_similarity(a: str, b: str) -> float:
+    """
+    Jaccard similarity of the query terms.
+    """
+    a_terms, b_terms = set(tokenize(a)), set(tokenize(b))
+    if not a_terms or not b_terms:
+        return 0.0
+    return len(a_terms & b_terms) / len(a_terms | b_terms)
+
+
+class RetrievalPrefetcher:
+    """
+    Start a retrieval speculatively (e.g. for the user's message while the LLM selects its tools)
+    and reuse its nodes for the next retrieval of a similar query.
+    The prefetched nodes are used at most once, the other queries (e.g. decomposed sub-queries) retrieve their own.
+    """
+
+    def __init__(self, similarity_threshold: Optional[float] = None):
+        if similarity_threshold is None:
+            similarity_threshold = float(os.getenv("PREFETCH_SIMILARITY", "0.5"))
+        self.similarity_threshold = similarity_threshold
+        self._retriever: Optional[BaseRetriever] = None
+        self._query: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def wrap(self, retriever: BaseRetriever) -> "SpeculativeRetriever":
+        """
+        Use the retriever for prefetching and get a retriever reusing the prefetched nodes.
+        """
+        self._retriever = retriever
+        return SpeculativeRetriever(retriever, self)
+
+    def prefetch(self, query: str) -> None:
+        """
+        Start retrieving the nodes of the query in the background.
+        """
+        if self._retriever is None:
+            return
+        self._query = query
+        self._task = asyncio.create_task(
+            self._retriever.aretrieve(QueryBundle(query_str=query))
+        )
+        # The prefetched nodes may never be used, don't warn about unretrieved errors
+        self._task.add_done_callback(
+            lambda task: task.cancelled() or task.exception()
+        )
+
+    async def get(self, query_bundle: QueryBundle) -> Optional[List[NodeWithScore]]:
+        """
+        Take the prefetched nodes if the query is similar enough to the prefetched one.
+        """
+        if self._task is None or self._query is None:
+            return None
+        similarity = query_similarity(self._query, query_bundle.query_str)
+        if similarity < self.similarity_threshold:
+            return None
+        task, self._task = self._task, None
+        try:
+            nodes = await task
+        except Exception as e:
+            logger.warning(f"Prefetching the retrieval failed: {e}")
+            return None
+        logger.info(
+            f"Reusing {len(nodes)} prefetched nodes for '{query_bundle.query_str}' (similarity {similarity:.2f})"
+        )
+        return nodes
+
+    def cancel(self) -> None:
+        """
+        Stop the prefetch and release its nodes if they haven't been used.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class SpeculativeRetriever(BaseRetriever):
+    """
+    A retriever reusing the nodes prefetched for a similar query.
+    Postprocessors (e.g. the reranker) still run with the actual query.
+    """
+
+    def __init__(self, retriever: BaseRetriever, prefetcher: RetrievalPrefetcher):
+        super().__init__(callback_manager=retriever.callback_manager)
+        self._retriever = retriever
+        self._prefetcher = prefetcher
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._retriever.retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = await self._prefetcher.get(query_bundle)
+        if nodes is not None:
+            return nodes
+        return await self._retriever.aretrieve(query_bundle)
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_RERANK_MODEL = "Xenova/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Rerank the retrieved nodes with a small cross-encoder running on CPU (ONNX Runtime)
+    and only keep the best `top_n` nodes for the response synthesizer.
+
+    Candidates are scored in batches until the time budget is used up.
+    Nodes that couldn't be scored in time are ranked after the scored ones in their retrieval order,
+    so a slow request degrades to plain retrieval instead of failing.
+    """
+
+    model: str = Field(default=DEFAULT_RERANK_MODEL)
+    top_n: int = Field(default=5)
+    batch_size: int = Field(default=16)
+    num_threads: int = Field(
+        default=0, description="Number of CPU threads for ONNX Runtime (0: default)"
+    )
+    max_length: int = Field(default=512)
+    time_budget: Optional[float] = Field(
+        default=None, description="Time budget in seconds for reranking a request"
+    )
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    @classmethod
+    def from_env(cls) -> Optional["CrossEncoderRerank"]:
+        """
+        Create the reranker from the RERANK_* environment variables.
+        Returns None if reranking is not enabled (RERANK_MODEL is not set).
+        """
+        model = os.getenv("RERANK_MODEL")
+        if not model:
+            return None
+        time_budget_ms = os.getenv("RERANK_TIME_BUDGET_MS")
+        return cls(
+            model=model,
+            top_n=int(os.getenv("RERANK_TOP_N", "5")),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+            num_threads=int(os.getenv("RERANK_THREADS", "0")),
+            time_budget=int(time_budget_ms) / 1000 if time_budget_ms else None,
+        )
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if len(nodes) == 0:
+            return []
+
+        session, tokenizer = _load_cross_encoder(
+            self.model, self.num_threads, self.max_length
+        )
+        # The time budget is for the inference, not the first load of the model
+        started_at = time.monotonic()
+        texts = [
+            node.node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes
+        ]
+        scores: List[float] = []
+        for start in range(0, len(texts), self.batch_size):
+            if (
+                self.time_budget is not None
+                and time.monotonic() - started_at > self.time_budget
+            ):
+                logger.warning(
+                    f"Reranking exceeded its time budget, only {len(scores)}/{len(nodes)} nodes were scored"
+                )
+                break
+            batch = texts[start : start + self.batch_size]
+            scores.extend(_score(session, tokenizer, query_bundle.query_str, batch))
+
+        reranked = sorted(
+            (
+                NodeWithScore(node=node.node, score=score)
+                for node, score in zip(nodes, scores)
+            ),
+            key=lambda node: node.score,  # type: ignore
+            reverse=True,
+        )
+        # Keep the retrieval order for the nodes that couldn't be scored
+        reranked.extend(nodes[len(scores) :])
+        logger.debug(
+            f"Reranked {len(scores)} nodes in {time.monotonic() - started_at:.3f}s"
+        )
+        return reranked[: self.top_n]
+
+    async def apostprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        # The inference is CPU bound, don't block the event loop while it runs
+        return await asyncio.to_thread(
+            self.postprocess_nodes, nodes, query_bundle=query_bundle
+        )
+
+
+@lru_cache(maxsize=None)
+def _load_cross_encoder(
+    model: str, num_threads: int, max_length: int
+) -> Tuple[Any, Any]:
+    """
+    Load the ONNX session and the tokenizer of a cross-encoder once per process.
+    `model` is either a local directory or a Hugging Face repository containing an ONNX export.
+    """
+    try:
+        import onnxruntime as ort  # type: ignore
+        from tokenizers import Tokenizer  # type: ignore
+    except ImportError:
+        raise ImportError(
+            "Reranking requires ONNX Runtime. Please install it with `poetry add onnxruntime tokenizers huggingface-hub`"
+        )
+
+    model_dir = model
+    if not os.path.isdir(model_dir):
+        from huggingface_hub import snapshot_download  # type: ignore
+
+        model_dir = snapshot_download(
+            model, allow_patterns=["*.json", "model.onnx", "onnx/model.onnx"]
+        )
+    model_path = os.path.join(model_dir, "onnx", "model.onnx")
+    if not os.path.exists(model_path):
+        model_path = os.path.join(model_dir, "model.onnx")
+    logger.info(f"Loading cross-encoder from {model_path}")
+
+    options = ort.SessionOptions()
+    if num_threads > 0:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    session = ort.InferenceSession(
+        model_path, sess_options=options, providers=["CPUExecutionProvider"]
+    )
+
+    tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+    tokenizer.enable_truncation(max_length=max_length)
+    tokenizer.enable_padding()
+    return session, tokenizer
+
+
+def _score(session: Any, tokenizer: Any, query: str, texts: List[str]) -> List[float]:
+    import numpy as np
+
+    encodings = tokenizer.encode_batch([(query, text) for text in texts])
+    features = {
+        "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+        "attention_mask": np.array(
+            [e.attention_mask for e in encodings], dtype=np.int64
+        ),
+        "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+    }
+    input_names = {model_input.name for model_input in session.get_inputs()}
+    logits = session.run(
+        None, {name: value for name, value in features.items() if name in input_names}
+    )[0]
+    # Single logit models output the relevance directly, two class models output (irrelevant, relevant)
+    return logits[:, -1].astype(float).tolist()
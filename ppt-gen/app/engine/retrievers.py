@@ -0,0 +1,205 @@
+import asyncio
+import os
+from typing import Dict, List, Optional, Sequence
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import (
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.vector_stores.qdrant.base import DENSE_VECTOR_NAME
+from qdrant_client.http import models as rest
+
+DEFAULT_RRF_K = 60
+
+
+class HybridSearchMode:
+    LOCAL = "local"
+    QDRANT = "qdrant"
+
+
+def get_hybrid_search_mode() -> Optional[str]:
+    """
+    Get the configured sparse retrieval path from the HYBRID_SEARCH environment variable:
+    - local: BM25 over a local inverted index built by the generate script and on upload
+    - qdrant: sparse vectors stored in the Qdrant collection
+    Hybrid search is disabled if it's not set.
+    """
+    mode = os.getenv("HYBRID_SEARCH", "").strip().lower()
+    match mode:
+        case "" | "false" | "none":
+            return None
+        case HybridSearchMode.LOCAL | HybridSearchMode.QDRANT:
+            return mode
+        case _:
+            raise ValueError(f"Invalid hybrid search mode: {mode}")
+
+
+def get_rrf_k() -> int:
+    return int(os.getenv("HYBRID_RRF_K", DEFAULT_RRF_K))
+
+
+def reciprocal_rank_fusion(
+    ranked_lists: Sequence[Sequence[NodeWithScore]],
+    top_k: int,
+    k: int = DEFAULT_RRF_K,
+) -> List[NodeWithScore]:
+    """
+    Fuse several ranked node lists with reciprocal rank fusion: score(d) = sum(1 / (k + rank(d))).
+    Only ranks are used, so scores of different retrievers don't need to be comparable.
+    """
+    fused_scores: Dict[str, float] = {}
+    nodes_by_id: Dict[str, NodeWithScore] = {}
+    for ranked_list in ranked_lists:
+        for rank, node_with_score in enumerate(ranked_list, start=1):
+            node_id = node_with_score.node.node_id
+            fused_scores[node_id] = fused_scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            # Keep the first seen node, the dense one usually has the richer payload
+            nodes_by_id.setdefault(node_id, node_with_score)
+
+    ranked_ids = sorted(fused_scores, key=fused_scores.__getitem__, reverse=True)
+    return [
+        NodeWithScore(node=nodes_by_id[node_id].node, score=fused_scores[node_id])
+        for node_id in ranked_ids[:top_k]
+    ]
+
+
+def reciprocal_rank_fusion_result(
+    dense_result: VectorStoreQueryResult,
+    sparse_result: VectorStoreQueryResult,
+    alpha: float = 0.5,
+    top_k: int = 2,
+) -> VectorStoreQueryResult:
+    """
+    Hybrid fusion function for the Qdrant vector store (see `hybrid_fusion_fn`) using reciprocal rank fusion.
+    `alpha` is ignored as RRF doesn't weight the result lists.
+    """
+    ranked_lists = []
+    for result in (dense_result, sparse_result):
+        if not result.nodes:
+            continue
+        similarities = result.similarities or [0.0] * len(result.nodes)
+        ranked = sorted(
+            zip(similarities, result.nodes), key=lambda item: item[0], reverse=True
+        )
+        ranked_lists.append(
+            [NodeWithScore(node=node, score=score) for score, node in ranked]
+        )
+    if not ranked_lists:
+        return VectorStoreQueryResult(nodes=None, similarities=None, ids=None)
+
+    fused = reciprocal_rank_fusion(ranked_lists, top_k=top_k, k=get_rrf_k())
+    return VectorStoreQueryResult(
+        nodes=[node_with_score.node for node_with_score in fused],
+        similarities=[node_with_score.score for node_with_score in fused],
+        ids=[node_with_score.node.node_id for node_with_score in fused],
+    )
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Combine a dense and a sparse retriever with reciprocal rank fusion.
+    """
+
+    def __init__(
+        self,
+        dense_retriever: BaseRetriever,
+        sparse_retriever: BaseRetriever,
+        similarity_top_k: int = 2,
+        rrf_k: Optional[int] = None,
+        callback_manager: Optional[CallbackManager] = None,
+    ):
+        super().__init__(callback_manager=callback_manager)
+        self._dense_retriever = dense_retriever
+        self._sparse_retriever = sparse_retriever
+        self._similarity_top_k = similarity_top_k
+        self._rrf_k = rrf_k or get_rrf_k()
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        dense_nodes = self._dense_retriever.retrieve(query_bundle)
+        sparse_nodes = self._sparse_retriever.retrieve(query_bundle)
+        return reciprocal_rank_fusion(
+            [dense_nodes, sparse_nodes], top_k=self._similarity_top_k, k=self._rrf_k
+        )
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        dense_nodes, sparse_nodes = await asyncio.gather(
+            self._dense_retriever.aretrieve(query_bundle),
+            self._sparse_retriever.aretrieve(query_bundle),
+        )
+        return reciprocal_rank_fusion(
+            [dense_nodes, sparse_nodes], top_k=self._similarity_top_k, k=self._rrf_k
+        )
+
+
+async def abatch_retrieve(
+    retriever: BaseRetriever, query_bundles: List[QueryBundle]
+) -> List[List[NodeWithScore]]:
+    """
+    Retrieve the nodes of several queries.
+    The dense searches of a Qdrant collection are sent in one batched request (the queries must have their embedding),
+    the other retrievers retrieve the queries concurrently.
+    """
+    vector_retriever = _get_qdrant_vector_retriever(retriever)
+    if vector_retriever is None or any(
+        query_bundle.embedding is None for query_bundle in query_bundles
+    ):
+        return list(
+            await asyncio.gather(
+                *[retriever.aretrieve(query_bundle) for query_bundle in query_bundles]
+            )
+        )
+
+    vector_store: QdrantVectorStore = vector_retriever._vector_store
+    requests = []
+    for query_bundle in query_bundles:
+        query = vector_retriever._build_vector_store_query(query_bundle)
+        query_filter = vector_retriever._kwargs.get(
+            "qdrant_filters"
+        ) or vector_store._build_query_filter(query)
+        requests.append(
+            rest.SearchRequest(
+                # The collections with sparse vectors have named dense vectors
+                vector=(
+                    rest.NamedVector(
+                        name=DENSE_VECTOR_NAME, vector=query.query_embedding
+                    )
+                    if vector_store.enable_hybrid
+                    else query.query_embedding
+                ),
+                limit=query.similarity_top_k,
+                filter=query_filter,
+                with_payload=True,
+            )
+        )
+    responses = await vector_store._aclient.search_batch(
+        collection_name=vector_store.collection_name, requests=requests
+    )
+    return [
+        vector_retriever._build_node_list_from_query_result(
+            vector_store.parse_to_query_result(response)
+        )
+        for response in responses
+    ]
+
+
+def _get_qdrant_vector_retriever(
+    retriever: BaseRetriever,
+) -> Optional[VectorIndexRetriever]:
+    """
+    Get the dense Qdrant retriever wrapped by the retriever (e.g. coalescing its calls), if there is one.
+    """
+    while not isinstance(retriever, VectorIndexRetriever):
+        retriever = getattr(retriever, "_retriever", None)
+        if retriever is None:
+            return None
+    if (
+        isinstance(retriever._vector_store, QdrantVectorStore)
+        and retriever._vector_store_query_mode == VectorStoreQueryMode.DEFAULT
+    ):
+        return retriever
+    return None
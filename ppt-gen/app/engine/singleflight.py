@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.deadline import (
+    DeadlineExceededError,
+    detached_context,
+    get_deadline,
+    wait_with_deadline,
+)
+
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key: the first call runs, the others await its result.
+    The shared call is only cancelled when all its callers are cancelled.
+
+    The shared call runs without the deadline of the request that started it,
+    each caller waits for it until its own deadline.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        # Metrics
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+
+            async def call() -> T:
+                return await fn()
+
+            task = asyncio.get_running_loop().create_task(
+                call(), context=detached_context()
+            )
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Coalesced a {self.name} call with an in-flight one")
+        self._waiters[key] += 1
+        try:
+            return await wait_with_deadline(asyncio.shield(task), get_deadline())
+        except (asyncio.CancelledError, DeadlineExceededError):
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    task.cancel()
+            raise
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        # The result is retrieved by the callers, don't warn if they were all cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+
+_single_flights: Dict[str, SingleFlight] = {}
+_single_flights_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    with _single_flights_lock:
+        if name not in _single_flights:
+            _single_flights[name] = SingleFlight(name)
+        return _single_flights[name]
+
+
+def get_single_flights() -> List[SingleFlight]:
+    with _single_flights_lock:
+        return list(_single_flights.values())
+
+
+def is_single_flight_enabled() -> bool:
+    return os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+
+
+class SingleFlightRetriever(BaseRetriever):
+    """
+    A retriever coalescing the concurrent retrievals of the same query.
+    The query embedding is also coalesced across retrievers using the same embedding model.
+    Each caller gets its own list of nodes, so the postprocessors can rescore them.
+    """
+
+    def __init__(
+        self,
+        retriever: BaseRetriever,
+        key: str,
+        embed_model: Optional[BaseEmbedding] = None,
+    ):
+        super().__init__(callback_manager=retriever.callback_manager)
+        self._retriever = retriever
+        self._key = key
+        self._embed_model = embed_model
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._retriever.retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is not None:
+            return await self._retriever.aretrieve(query_bundle)
+
+        async def retrieve() -> List[NodeWithScore]:
+            bundle = QueryBundle(
+                query_str=query_bundle.query_str,
+                custom_embedding_strs=query_bundle.custom_embedding_strs,
+            )
+            if self._embed_model is not None and len(bundle.embedding_strs) == 1:
+                bundle.embedding = await get_single_flight("embedding").do(
+                    (self._embed_model.model_name, bundle.embedding_strs[0]),
+                    lambda: self._embed_model.aget_query_embedding(  # type: ignore
+                        bundle.embedding_strs[0]
+                    ),
+                )
+            return await self._retriever.aretrieve(bundle)
+
+        nodes = await get_single_flight("retrieval").do(
+            (self._key, query_bundle.query_str, tuple(query_bundle.embedding_strs)),
+            retrieve,
+        )
+        return [NodeWithScore(node=node.node, score=node.score) for node in nodes]
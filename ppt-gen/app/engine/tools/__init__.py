@@ -1,11 +1,13 @@
 import importlib
-import os
-from typing import Dict, List, Union
+import logging
+from types import MethodType
+from typing import Any, Dict, List, Optional, Union
 
-import yaml  # type: ignore
-from llama_index.core.tools.function_tool import FunctionTool
+from llama_index.core.tools.function_tool import FunctionTool, sync_to_async
 from llama_index.core.tools.tool_spec.base import BaseToolSpec
 
+logger = logging.getLogger("uvicorn")
+
 
 class ToolType:
     LLAMAHUB = "llamahub"
@@ -18,6 +20,18 @@ class ToolFactory:
         ToolType.LOCAL: "app.engine.tools",
     }
 
+    @staticmethod
+    def is_stateful(tool_type: str, tool_name: str) -> bool:
+        """
+        Whether the tool module keeps per-conversation state in its tool instances
+        (declared with `STATEFUL_TOOLS = True` in the module).
+        """
+        if tool_type != ToolType.LOCAL or "ToolSpec" in tool_name:
+            return False
+        source_package = ToolFactory.TOOL_SOURCE_PACKAGE_MAP[tool_type]
+        module = importlib.import_module(f"{source_package}.{tool_name}")
+        return getattr(module, "STATEFUL_TOOLS", False)
+
     @staticmethod
     def load_tools(tool_type: str, tool_name: str, config: dict) -> List[FunctionTool]:
         source_package = ToolFactory.TOOL_SOURCE_PACKAGE_MAP[tool_type]
@@ -56,23 +70,139 @@ class ToolFactory:
             A dictionary of tool names to lists of FunctionTools if map_result is True,
             otherwise a list of FunctionTools.
         """
+        from app.services.config import get_config_service
+
         tools: Union[Dict[str, FunctionTool], List[FunctionTool]] = (
             {} if map_result else []
         )
 
-        if os.path.exists("config/tools.yaml"):
-            with open("config/tools.yaml", "r") as f:
-                tool_configs = yaml.safe_load(f)
-                for tool_type, config_entries in tool_configs.items():
-                    for tool_name, config in config_entries.items():
-                        loaded_tools = ToolFactory.load_tools(
-                            tool_type, tool_name, config
-                        )
-                        if map_result:
-                            tools.update(  # type: ignore
-                                {tool.metadata.name: tool for tool in loaded_tools}
-                            )
-                        else:
-                            tools.extend(loaded_tools)  # type: ignore
+        tool_configs = get_config_service().config.tools
+        for tool_type, config_entries in tool_configs.items():
+            for tool_name, config in (config_entries or {}).items():
+                loaded_tools = ToolFactory.load_tools(tool_type, tool_name, config)
+                if map_result:
+                    tools.update(  # type: ignore
+                        {tool.metadata.name: tool for tool in loaded_tools}
+                    )
+                else:
+                    tools.extend(loaded_tools)  # type: ignore
+
+        return tools
+
+
+class ToolRegistry:
+    """
+    The configured tools, loaded once.
+
+    Stateless tools are shared by all requests.
+    Stateful tools are re-bound to a new instance of their class for each request,
+    reusing the metadata (name, description and schema) computed when loading them.
+    Sync tools run in the bounded executor of their module, instead of the default executor.
+    """
+
+    def __init__(
+        self,
+        tools: List[FunctionTool],
+        stateful_tool_configs: Dict[str, dict],
+        executor_names: Optional[Dict[str, str]] = None,
+    ):
+        self._tools = tools
+        # tool name -> config to create a new instance of the tool's class
+        self._stateful_tool_configs = stateful_tool_configs
+        # tool name -> name of the executor of its sync calls
+        self._executor_names = executor_names or {}
+
+    @classmethod
+    def from_config(cls, tool_configs: Dict[str, Dict[str, dict]]) -> "ToolRegistry":
+        tools: List[FunctionTool] = []
+        stateful_tool_configs: Dict[str, dict] = {}
+        executor_names: Dict[str, str] = {}
+        for tool_type, config_entries in tool_configs.items():
+            for tool_name, config in (config_entries or {}).items():
+                loaded_tools = ToolFactory.load_tools(tool_type, tool_name, config)
+                if ToolFactory.is_stateful(tool_type, tool_name):
+                    for tool in loaded_tools:
+                        stateful_tool_configs[tool.metadata.name] = config
+                # The tools of a module (or a tool spec package) share an executor
+                executor_name = tool_name.split(".")[0]
+                for tool in loaded_tools:
+                    if _is_sync_tool(tool):
+                        executor_names[tool.metadata.name] = executor_name
+                tools.extend(loaded_tools)
+        logger.info(f"Loaded {len(tools)} tools")
+        return cls(tools, stateful_tool_configs, executor_names)
+
+    def get_tools(
+        self,
+        map_result: bool = False,
+    ) -> Union[Dict[str, FunctionTool], List[FunctionTool]]:
+        """
+        Get the tools for a request.
 
+        Args:
+            map_result: If True, return a map of tool names to their corresponding tools.
+        """
+        # Tools of the same instance (e.g. several methods of a tool class) share the new instance
+        instances: Dict[int, Any] = {}
+        tools = []
+        for tool in self._tools:
+            config = self._stateful_tool_configs.get(tool.metadata.name)
+            if config is not None:
+                tool = _bind_to_new_instance(tool, config, instances)
+            executor_name = self._executor_names.get(tool.metadata.name)
+            if executor_name is not None:
+                tool = _run_in_executor(tool, executor_name)
+            tools.append(tool)
+        if map_result:
+            return {tool.metadata.name: tool for tool in tools}  # type: ignore
         return tools
+
+
+def _bind_to_new_instance(
+    tool: FunctionTool, config: dict, instances: Dict[int, Any]
+) -> FunctionTool:
+    fn = tool.fn if isinstance(tool.fn, MethodType) else None
+    async_fn = tool.async_fn if isinstance(tool.async_fn, MethodType) else None
+    bound_method = fn or async_fn
+    if bound_method is None:
+        raise ValueError(
+            f"Stateful tool {tool.metadata.name} must be a method of a tool class"
+        )
+    owner = bound_method.__self__
+    instance = instances.get(id(owner))
+    if instance is None:
+        instance = instances[id(owner)] = type(owner)(**config)
+    return FunctionTool(
+        fn=fn.__func__.__get__(instance) if fn else None,
+        async_fn=async_fn.__func__.__get__(instance) if async_fn else None,
+        metadata=tool.metadata,
+    )
+
+
+def _is_sync_tool(tool: FunctionTool) -> bool:
+    """
+    Whether the tool has no async implementation, its async calls run the sync function in a thread.
+    """
+    return getattr(tool.async_fn, "__qualname__", "").startswith(
+        f"{sync_to_async.__qualname__}.<locals>"
+    )
+
+
+def _run_in_executor(tool: FunctionTool, executor_name: str) -> FunctionTool:
+    from app.executors import get_executor
+
+    fn = tool.fn
+
+    async def async_fn(*args: Any, **kwargs: Any) -> Any:
+        return await get_executor(executor_name).run(fn, *args, **kwargs)
+
+    return FunctionTool(fn=fn, async_fn=async_fn, metadata=tool.metadata)
+
+
+def get_tool_registry() -> ToolRegistry:
+    """
+    Get the registry of the configured tools, it's rebuilt when the config changes.
+    """
+    from app.services.config import get_config_service
+
+    return get_config_service().get_tool_registry()
@@ -82,7 +82,37 @@ class CodeGeneratorTool:
         Returns:
             Dict: A dictionary containing information about the generated artifact.
         """
+        messages = self._get_messages(query, sandbox_files, old_code)
+        try:
+            sllm = Settings.llm.as_structured_llm(output_cls=CodeArtifact)  # type: ignore
+            response = sllm.chat(messages)
+            return self._to_dict(response.raw, sandbox_files)
+        except Exception as e:
+            logger.error(f"Failed to generate artifact: {str(e)}")
+            raise e
 
+    async def aartifact(
+        self,
+        query: str,
+        sandbox_files: Optional[List[str]] = None,
+        old_code: Optional[str] = None,
+    ) -> Dict:
+        """
+        Async version of `artifact`.
+        """
+        messages = self._get_messages(query, sandbox_files, old_code)
+        try:
+            sllm = Settings.llm.as_structured_llm(output_cls=CodeArtifact)  # type: ignore
+            response = await sllm.achat(messages)
+            return self._to_dict(response.raw, sandbox_files)
+        except Exception as e:
+            logger.error(f"Failed to generate artifact: {str(e)}")
+            raise e
+
+    @staticmethod
+    def _get_messages(
+        query: str, sandbox_files: Optional[List[str]], old_code: Optional[str]
+    ) -> List[ChatMessage]:
         if old_code:
             user_message = f"{query}\n\nThe existing code is: \n```\n{old_code}\n```"
         else:
@@ -90,22 +120,19 @@ class CodeGeneratorTool:
         if sandbox_files:
             user_message += f"\n\nThe provided files are: \n{str(sandbox_files)}"
 
-        messages: List[ChatMessage] = [
+        return [
             ChatMessage(role="system", content=CODE_GENERATION_PROMPT),
             ChatMessage(role="user", content=user_message),
         ]
-        try:
-            sllm = Settings.llm.as_structured_llm(output_cls=CodeArtifact)  # type: ignore
-            response = sllm.chat(messages)
-            data: CodeArtifact = response.raw
-            data_dict = data.model_dump()
-            if sandbox_files:
-                data_dict["files"] = sandbox_files
-            return data_dict
-        except Exception as e:
-            logger.error(f"Failed to generate artifact: {str(e)}")
-            raise e
+
+    @staticmethod
+    def _to_dict(data: CodeArtifact, sandbox_files: Optional[List[str]]) -> Dict:
+        data_dict = data.model_dump()
+        if sandbox_files:
+            data_dict["files"] = sandbox_files
+        return data_dict
 
 
 def get_tools(**kwargs):
-    return [FunctionTool.from_defaults(fn=CodeGeneratorTool().artifact)]
+    tool = CodeGeneratorTool()
+    return [FunctionTool.from_defaults(fn=tool.artifact, async_fn=tool.aartifact)]
@@ -4,6 +4,8 @@ import re
 from enum import Enum
 from io import BytesIO
 
+from app.deadline import check_deadline, get_remaining_time
+from app.executors import get_executor
 from llama_index.core.tools.function_tool import FunctionTool
 
 OUTPUT_DIR = "output/tools"
@@ -147,6 +149,24 @@ class DocumentGenerator:
         buffer.seek(0)
         return buffer
 
+    @classmethod
+    def _render_pdf(cls, html_content: str) -> BytesIO:
+        """
+        Render the PDF in the rendering processes (DOCUMENT_RENDER_PROCESSES, default true),
+        so the CPU heavy rendering doesn't hold the GIL of the server.
+        """
+        if os.getenv("DOCUMENT_RENDER_PROCESSES", "true").lower() != "true":
+            return cls._generate_pdf(html_content)
+        future = get_executor("document_render", processes=True, max_workers=2).submit(
+            cls._generate_pdf, html_content
+        )
+        try:
+            return future.result(timeout=get_remaining_time())
+        except TimeoutError:
+            future.cancel()
+            check_deadline()
+            raise
+
     @classmethod
     def _generate_html(cls, html_content: str) -> str:
         """
@@ -182,7 +202,9 @@ class DocumentGenerator:
 
         # Based on the type of document, generate the corresponding file
         if document_type == DocumentType.PDF:
-            content = cls._generate_pdf(html_content)
+            # Rendering a PDF is slow, don't start it for a cancelled request
+            check_deadline()
+            content = cls._render_pdf(html_content)
             file_extension = "pdf"
         elif document_type == DocumentType.HTML:
             content = BytesIO(cls._generate_html(html_content).encode("utf-8"))
@@ -193,6 +215,8 @@ class DocumentGenerator:
         file_name = cls._validate_file_name(file_name)
         file_path = os.path.join(OUTPUT_DIR, f"{file_name}.{file_extension}")
 
+        check_deadline()
+
         cls._write_to_file(content, file_path)
 
         file_url = f"{os.getenv('FILESERVER_URL_PREFIX')}/{file_path}"
@@ -5,6 +5,7 @@ from textwrap import dedent
 from typing import Optional
 
 import pandas as pd
+from app.executors import get_executor
 from app.services.file import FileService
 from llama_index.core import Settings
 from llama_index.core.prompts import PromptTemplate
@@ -104,9 +105,49 @@ class FormFillingTool:
         Returns:
             dict: A dictionary containing the missing cells and their corresponding questions.
         """
-        extract_questions_prompt = os.getenv(
+        table_content = self._get_table_content(file_path, file_content)
+        if isinstance(table_content, dict):
+            return table_content
+
+        response: MissingCells = Settings.llm.structured_predict(
+            output_cls=MissingCells,
+            prompt=PromptTemplate(self._get_extract_questions_prompt()),
+            table_content=table_content,
+        )
+        return response.model_dump()
+
+    async def aextract_questions(
+        self,
+        file_path: Optional[str] = None,
+        file_content: Optional[str] = None,
+    ) -> dict:
+        """
+        Async version of `extract_questions`, the table is read in the executor of the tool.
+        """
+        table_content = await get_executor("form_filling").run(
+            self._get_table_content, file_path, file_content
+        )
+        if isinstance(table_content, dict):
+            return table_content
+
+        response: MissingCells = await Settings.llm.astructured_predict(
+            output_cls=MissingCells,
+            prompt=PromptTemplate(self._get_extract_questions_prompt()),
+            table_content=table_content,
+        )
+        return response.model_dump()
+
+    def _get_extract_questions_prompt(self) -> str:
+        return os.getenv(
             "EXTRACT_QUESTIONS_PROMPT", self._default_extract_questions_prompt
         )
+
+    def _get_table_content(
+        self, file_path: Optional[str], file_content: Optional[str]
+    ) -> str | dict:
+        """
+        Get the table as markdown, or an error for the LLM if the file is not found.
+        """
         if file_path is None and file_content is None:
             raise ValueError("Either `file_path` or `file_content` must be provided")
 
@@ -133,13 +174,7 @@ class FormFillingTool:
 
         if table_content is None:
             raise ValueError("Table content not found")
-
-        response: MissingCells = Settings.llm.structured_predict(
-            output_cls=MissingCells,
-            prompt=PromptTemplate(extract_questions_prompt),
-            table_content=table_content,
-        )
-        return response.model_dump()
+        return table_content
 
     def fill_form(
         self,
@@ -219,6 +254,8 @@ class FormFillingTool:
 def get_tools(**kwargs):
     tool = FormFillingTool()
     return [
-        FunctionTool.from_defaults(tool.extract_questions),
+        FunctionTool.from_defaults(
+            fn=tool.extract_questions, async_fn=tool.aextract_questions
+        ),
         FunctionTool.from_defaults(tool.fill_form),
     ]
@@ -3,7 +3,9 @@ import os
 import uuid
 from typing import Optional
 
+import httpx
 import requests  # type: ignore
+from app.executors import get_executor
 from llama_index.core.tools import FunctionTool
 from pydantic import BaseModel, Field
 
@@ -59,22 +61,30 @@ class ImageGeneratorTool:
         logger.info(f"Saved image to {output_path}.\nURL: {url}")
         return url
 
-    def _call_stability_api(self, prompt: str):
-        headers = {
-            "authorization": f"Bearer {self._api_key}",
-            "accept": "image/*",
-        }
-        data = {
-            "prompt": prompt,
-            "output_format": self._IMG_OUTPUT_FORMAT,
+    def _get_request_args(self, prompt: str) -> dict:
+        return {
+            "headers": {
+                "authorization": f"Bearer {self._api_key}",
+                "accept": "image/*",
+            },
+            "files": {"none": ""},
+            "data": {
+                "prompt": prompt,
+                "output_format": self._IMG_OUTPUT_FORMAT,
+            },
         }
 
-        response = requests.post(
-            self._IMG_GEN_API,
-            headers=headers,
-            files={"none": ""},
-            data=data,
-        )
+    def _call_stability_api(self, prompt: str):
+        response = requests.post(self._IMG_GEN_API, **self._get_request_args(prompt))
+        response.raise_for_status()
+
+        return response
+
+    async def _acall_stability_api(self, prompt: str) -> httpx.Response:
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await client.post(
+                self._IMG_GEN_API, **self._get_request_args(prompt)
+            )
         response.raise_for_status()
 
         return response
@@ -104,6 +114,31 @@ class ImageGeneratorTool:
                 error_message=str(e),
             )
 
+    async def agenerate_image(self, prompt: str) -> ImageGeneratorToolOutput:
+        """
+        Async version of `generate_image`.
+        """
+        try:
+            response = await self._acall_stability_api(prompt)
+            image_url = await get_executor("img_gen").run(
+                self._save_image, response.content
+            )
+            return ImageGeneratorToolOutput(
+                is_success=True,
+                image_url=image_url,
+            )
+        except Exception as e:
+            logger.exception(e, exc_info=True)
+            return ImageGeneratorToolOutput(
+                is_success=False,
+                error_message=str(e),
+            )
+
 
 def get_tools(**kwargs):
-    return [FunctionTool.from_defaults(ImageGeneratorTool(**kwargs).generate_image)]
+    tool = ImageGeneratorTool(**kwargs)
+    return [
+        FunctionTool.from_defaults(
+            fn=tool.generate_image, async_fn=tool.agenerate_image
+        )
+    ]
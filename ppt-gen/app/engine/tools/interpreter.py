@@ -1,9 +1,11 @@
 import base64
 import logging
 import os
+import threading
 import uuid
 from typing import List, Optional
 
+from app.deadline import check_deadline, get_remaining_time, on_cancel
 from app.services.file import DocumentFile, FileService
 from e2b_code_interpreter import CodeInterpreter
 from e2b_code_interpreter.models import Logs
@@ -12,6 +14,9 @@ from pydantic import BaseModel
 
 logger = logging.getLogger("uvicorn")
 
+# Each interpreter instance owns a sandbox, so each request gets its own instance
+STATEFUL_TOOLS = True
+
 
 class InterpreterExtraResult(BaseModel):
     type: str
@@ -56,6 +61,15 @@ class E2BCodeInterpreter:
         if self.interpreter is not None:
             self.interpreter.kill()
 
+    def _kill_interpreter(self):
+        """
+        Kill the sandbox of a cancelled request, so its code stops running.
+        """
+        interpreter, self.interpreter = self.interpreter, None
+        if interpreter is not None:
+            # Don't block the caller, e.g. the event loop cancelling the request
+            threading.Thread(target=interpreter.kill, daemon=True).start()
+
     def _init_interpreter(self, sandbox_files: List[str] = []):
         """
         Lazily initialize the interpreter.
@@ -159,11 +173,19 @@ class E2BCodeInterpreter:
         if self.interpreter is None:
             self._init_interpreter(sandbox_files)
 
+        with on_cancel(self._kill_interpreter):
+            check_deadline()
+            return self._exec(code, retry_count)
+
+    def _exec(self, code: str, retry_count: int) -> E2BToolOutput:
         if self.interpreter and self.interpreter.notebook:
             logger.info(
                 f"\n{'='*50}\n> Running following AI-generated code:\n{code}\n{'='*50}"
             )
-            exec = self.interpreter.notebook.exec_cell(code)
+            exec = self.interpreter.notebook.exec_cell(
+                code, timeout=get_remaining_time()
+            )
+            check_deadline()
 
             if exec.error:
                 error_message = f"The code failed to execute successfully. Error: {exec.error}. Try to fix the code and run again."
@@ -1,34 +1,58 @@
+import asyncio
 import os
 from typing import Any, Dict, List, Optional, Sequence
 
-from llama_index.core import get_response_synthesizer
-from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core import VectorStoreIndex, get_response_synthesizer
+from llama_index.core.base.base_retriever import BaseRetriever
 from llama_index.core.base.response.schema import RESPONSE_TYPE, Response
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
 from llama_index.core.multi_modal_llms import MultiModalLLM
 from llama_index.core.prompts.base import BasePromptTemplate
 from llama_index.core.prompts.default_prompt_selectors import (
     DEFAULT_TEXT_QA_PROMPT_SEL,
 )
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.query_engine.multi_modal import _get_image_and_text_nodes
 from llama_index.core.response_synthesizers.base import BaseSynthesizer, QueryTextType
 from llama_index.core.schema import (
     ImageNode,
     NodeWithScore,
+    QueryBundle,
 )
+from llama_index.core.tools import BaseTool, FunctionTool, ToolMetadata, ToolOutput
 from llama_index.core.tools.query_engine import QueryEngineTool
 from llama_index.core.types import RESPONSE_TEXT_TYPE
 
+from app.engine.bm25 import BM25Retriever, get_bm25_index
+from app.engine.compression import compress_nodes, deduplicate_nodes
+from app.engine.dedup import NearDuplicatePostprocessor
+from app.engine.prefetch import RetrievalPrefetcher
+from app.engine.rerank import CrossEncoderRerank
+from app.engine.singleflight import (
+    SingleFlightRetriever,
+    get_single_flight,
+    is_single_flight_enabled,
+)
+from app.engine.retrievers import (
+    HybridRetriever,
+    HybridSearchMode,
+    abatch_retrieve,
+    get_hybrid_search_mode,
+)
 from app.settings import get_multi_modal_llm
 
 
-def create_query_engine(index, **kwargs) -> BaseQueryEngine:
+def create_query_engine(index, **kwargs) -> "AsyncRetrieverQueryEngine":
     """
     Create a query engine for the given index.
 
     Args:
         index: The index to create a query engine for.
+        prefetcher (optional): A RetrievalPrefetcher whose prefetched nodes are reused for similar queries.
         params (optional): Additional parameters for the query engine, e.g: similarity_top_k
     """
+    prefetcher: Optional[RetrievalPrefetcher] = kwargs.pop("prefetcher", None)
+    flight_key = get_flight_key(index, **kwargs)
 
     top_k = int(os.getenv("TOP_K", 0))
     if top_k != 0 and kwargs.get("filters") is None:
@@ -39,6 +63,23 @@ def create_query_engine(index, **kwargs) -> BaseQueryEngine:
             multimodal_model=multimodal_llm,
         )
 
+    # Collapse near-duplicate chunks first so they don't take reranking or prompt budget
+    deduplicator = NearDuplicatePostprocessor.from_env()
+    if deduplicator is not None:
+        kwargs["node_postprocessors"] = [
+            deduplicator,
+            *(kwargs.get("node_postprocessors") or []),
+        ]
+
+    # Over-retrieve and only pass the best reranked nodes to the synthesizer
+    reranker = CrossEncoderRerank.from_env()
+    if reranker is not None:
+        kwargs["similarity_top_k"] = int(os.getenv("RERANK_CANDIDATES", "50"))
+        kwargs["node_postprocessors"] = [
+            *(kwargs.get("node_postprocessors") or []),
+            reranker,
+        ]
+
     # If index is index is LlamaCloudIndex
     # use auto_routed mode for better query results
     if index.__class__.__name__ == "LlamaCloudIndex":
@@ -46,15 +87,67 @@ def create_query_engine(index, **kwargs) -> BaseQueryEngine:
             kwargs["retrieval_mode"] = "auto_routed"
         if multimodal_llm:
             kwargs["retrieve_image_nodes"] = True
-    return index.as_query_engine(**kwargs)
+        retriever = index.as_retriever(**kwargs)
+    else:
+        retriever = create_retriever(index, **kwargs)
+    if is_single_flight_enabled():
+        # Only embed the query locally if the vector store searches by embedding
+        embed_model = None
+        if (
+            isinstance(index, VectorStoreIndex)
+            and index.vector_store.is_embedding_query
+        ):
+            embed_model = index._embed_model
+        retriever = SingleFlightRetriever(retriever, flight_key, embed_model)
+    if prefetcher is not None:
+        retriever = prefetcher.wrap(retriever)
+    return AsyncRetrieverQueryEngine.from_args(retriever, **kwargs)
+
+
+def get_flight_key(index, **kwargs) -> str:
+    """
+    Get a key of the index and query engine parameters, identical queries with the same key are coalesced.
+    """
+    params = {key: repr(value) for key, value in kwargs.items() if key != "prefetcher"}
+    return (
+        f"{type(index).__name__}:{getattr(index, 'name', '')}:{sorted(params.items())}"
+    )
+
+
+def create_retriever(index, **kwargs) -> BaseRetriever:
+    """
+    Create the retriever of the query engine, fusing dense and sparse (BM25) results if hybrid search is enabled.
+    """
+    match get_hybrid_search_mode():
+        case HybridSearchMode.QDRANT:
+            # Qdrant runs both searches and fuses them with our fusion function
+            kwargs["vector_store_query_mode"] = "hybrid"
+            if kwargs.get("similarity_top_k") is not None:
+                kwargs.setdefault("sparse_top_k", kwargs["similarity_top_k"])
+            return index.as_retriever(**kwargs)
+        case HybridSearchMode.LOCAL:
+            similarity_top_k = kwargs.get("similarity_top_k", DEFAULT_SIMILARITY_TOP_K)
+            sparse_retriever = BM25Retriever(
+                get_bm25_index(),
+                similarity_top_k=similarity_top_k,
+                filters=kwargs.get("filters"),
+            )
+            return HybridRetriever(
+                dense_retriever=index.as_retriever(**kwargs),
+                sparse_retriever=sparse_retriever,
+                similarity_top_k=similarity_top_k,
+            )
+        case _:
+            return index.as_retriever(**kwargs)
 
 
 def get_query_engine_tool(
     index,
     name: Optional[str] = None,
     description: Optional[str] = None,
+    retrieval_only: Optional[bool] = None,
     **kwargs,
-) -> QueryEngineTool:
+) -> BaseTool:
     """
     Get a query engine tool for the given index.
 
@@ -62,14 +155,44 @@ def get_query_engine_tool(
         index: The index to create a query engine for.
         name (optional): The name of the tool.
         description (optional): The description of the tool.
+        retrieval_only (optional): Return the compressed source passages instead of a synthesized answer.
+            Defaults to the QUERY_TOOL_RETRIEVAL_ONLY environment variable.
     """
     if name is None:
         name = "query_index"
+    if retrieval_only is None:
+        retrieval_only = (
+            os.getenv("QUERY_TOOL_RETRIEVAL_ONLY", "false").lower() == "true"
+        )
+    flight_key = f"{name}:{get_flight_key(index, **kwargs)}"
+    if kwargs.get("prefetcher") is not None:
+        # The answers can use the nodes prefetched for a request, only coalesce its own calls
+        flight_key += f":prefetcher={id(kwargs['prefetcher'])}"
+    query_engine = create_query_engine(index, **kwargs)
+    if retrieval_only:
+        if description is None:
+            description = (
+                "Use this tool to retrieve relevant passages about the text corpus from an index. "
+                "It returns the source passages with their ids and relevance scores."
+            )
+        return get_retrieval_tool(
+            query_engine,
+            name=name,
+            description=description,
+            token_budget=int(os.getenv("QUERY_TOOL_TOKEN_BUDGET", "1500")),
+            flight_key=flight_key,
+        )
+
     if description is None:
         description = (
             "Use this tool to retrieve information about the text corpus from an index."
         )
-    query_engine = create_query_engine(index, **kwargs)
+    if is_single_flight_enabled():
+        return SingleFlightQueryEngineTool(
+            query_engine=query_engine,
+            metadata=ToolMetadata(name=name, description=description),
+            flight_key=flight_key,
+        )
     return QueryEngineTool.from_defaults(
         query_engine=query_engine,
         name=name,
@@ -77,6 +200,104 @@ def get_query_engine_tool(
     )
 
 
+class SingleFlightQueryEngineTool(QueryEngineTool):
+    """
+    A query engine tool coalescing the concurrent calls with the same input,
+    e.g. the same question asked by many users at once is answered once.
+    """
+
+    def __init__(self, *args: Any, flight_key: str, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._flight_key = flight_key
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        query_str = self._get_query_str(*args, **kwargs)
+        acall = super().acall
+        return await get_single_flight("query_index").do(
+            (self._flight_key, query_str), lambda: acall(*args, **kwargs)
+        )
+
+
+def get_retrieval_tool(
+    query_engine: RetrieverQueryEngine,
+    name: str,
+    description: str,
+    token_budget: int,
+    flight_key: Optional[str] = None,
+) -> FunctionTool:
+    """
+    Get a tool that only retrieves from the query engine (no LLM synthesis) and returns
+    deduplicated source passages compressed to fit the token budget.
+    """
+
+    async def retrieve(input: str) -> str:
+        if flight_key is not None and is_single_flight_enabled():
+            return await get_single_flight("retrieval_tool").do(
+                (flight_key, input), lambda: _retrieve(input)
+            )
+        return await _retrieve(input)
+
+    async def _retrieve(input: str) -> str:
+        nodes = await query_engine.aretrieve(QueryBundle(query_str=input))
+        nodes = deduplicate_nodes(nodes)
+        passages = compress_nodes(input, nodes, token_budget=token_budget)
+        results = [
+            f"[id: {node.node.node_id}, score: {node.score or 0.0:.3f}]\n{passage}"
+            for node, passage in zip(nodes, passages)
+            if passage
+        ]
+        if not results:
+            return "No relevant information found."
+        return "\n\n".join(results)
+
+    return FunctionTool.from_defaults(
+        async_fn=retrieve,
+        name=name,
+        description=description,
+    )
+
+
+class AsyncRetrieverQueryEngine(RetrieverQueryEngine):
+    """
+    A retriever query engine that awaits node postprocessors supporting async postprocessing
+    (e.g. the CPU bound reranker) instead of running them on the event loop.
+    """
+
+    async def _aapply_node_postprocessors(
+        self, nodes: List[NodeWithScore], query_bundle: QueryBundle
+    ) -> List[NodeWithScore]:
+        for node_postprocessor in self._node_postprocessors:
+            if hasattr(node_postprocessor, "apostprocess_nodes"):
+                nodes = await node_postprocessor.apostprocess_nodes(
+                    nodes, query_bundle=query_bundle
+                )
+            else:
+                nodes = node_postprocessor.postprocess_nodes(
+                    nodes, query_bundle=query_bundle
+                )
+        return nodes
+
+    async def aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        nodes = await self._retriever.aretrieve(query_bundle)
+        return await self._aapply_node_postprocessors(nodes, query_bundle=query_bundle)
+
+    async def abatch_retrieve(
+        self, query_bundles: List[QueryBundle]
+    ) -> List[List[NodeWithScore]]:
+        """
+        Retrieve the nodes of several queries, searching the vector store in one batched request if it can.
+        """
+        nodes_lists = await abatch_retrieve(self._retriever, query_bundles)
+        return list(
+            await asyncio.gather(
+                *[
+                    self._aapply_node_postprocessors(nodes, query_bundle=query_bundle)
+                    for nodes, query_bundle in zip(nodes_lists, query_bundles)
+                ]
+            )
+        )
+
+
 class MultiModalSynthesizer(BaseSynthesizer):
     """
     A synthesizer that summarizes text nodes and uses a multi-modal LLM to generate a response.
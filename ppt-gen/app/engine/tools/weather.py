@@ -2,6 +2,7 @@
 
 import logging
 
+import httpx
 import pytz  # type: ignore
 import requests  # type: ignore
 from llama_index.core.tools import FunctionTool
@@ -16,8 +17,24 @@ class OpenMeteoWeather:
     @classmethod
     def _get_geo_location(cls, location: str) -> dict:
         """Get geo location from location name."""
-        params = {"name": location, "count": 10, "language": "en", "format": "json"}
-        response = requests.get(f"{cls.geo_api}/search", params=params)
+        response = requests.get(
+            f"{cls.geo_api}/search", params=cls._get_geo_params(location)
+        )
+        return cls._parse_geo_location(response)
+
+    @classmethod
+    async def _aget_geo_location(cls, client: httpx.AsyncClient, location: str) -> dict:
+        response = await client.get(
+            f"{cls.geo_api}/search", params=cls._get_geo_params(location)
+        )
+        return cls._parse_geo_location(response)
+
+    @staticmethod
+    def _get_geo_params(location: str) -> dict:
+        return {"name": location, "count": 10, "language": "en", "format": "json"}
+
+    @staticmethod
+    def _parse_geo_location(response: requests.Response | httpx.Response) -> dict:
         if response.status_code != 200:
             raise Exception(f"Failed to fetch geo location: {response.status_code}")
         else:
@@ -31,6 +48,18 @@ class OpenMeteoWeather:
             }
             return geo_location
 
+    @staticmethod
+    def _get_weather_params(geo_location: dict) -> dict:
+        timezone = pytz.timezone("UTC").zone
+        return {
+            "latitude": geo_location["latitude"],
+            "longitude": geo_location["longitude"],
+            "current": "temperature_2m,weather_code",
+            "hourly": "temperature_2m,weather_code",
+            "daily": "weather_code",
+            "timezone": timezone,
+        }
+
     @classmethod
     def get_weather_information(cls, location: str) -> dict:
         """Use this function to get the weather of any given location.
@@ -53,16 +82,27 @@ class OpenMeteoWeather:
             f"Calling open-meteo api to get weather information of location: {location}"
         )
         geo_location = cls._get_geo_location(location)
-        timezone = pytz.timezone("UTC").zone
-        params = {
-            "latitude": geo_location["latitude"],
-            "longitude": geo_location["longitude"],
-            "current": "temperature_2m,weather_code",
-            "hourly": "temperature_2m,weather_code",
-            "daily": "weather_code",
-            "timezone": timezone,
-        }
-        response = requests.get(f"{cls.weather_api}/forecast", params=params)
+        response = requests.get(
+            f"{cls.weather_api}/forecast", params=cls._get_weather_params(geo_location)
+        )
+        if response.status_code != 200:
+            raise Exception(
+                f"Failed to fetch weather information: {response.status_code}"
+            )
+        return response.json()
+
+    @classmethod
+    async def aget_weather_information(cls, location: str) -> dict:
+        """Async version of `get_weather_information`."""
+        logger.info(
+            f"Calling open-meteo api to get weather information of location: {location}"
+        )
+        async with httpx.AsyncClient() as client:
+            geo_location = await cls._aget_geo_location(client, location)
+            response = await client.get(
+                f"{cls.weather_api}/forecast",
+                params=cls._get_weather_params(geo_location),
+            )
         if response.status_code != 200:
             raise Exception(
                 f"Failed to fetch weather information: {response.status_code}"
@@ -71,4 +111,9 @@ class OpenMeteoWeather:
 
 
 def get_tools(**kwargs):
-    return [FunctionTool.from_defaults(OpenMeteoWeather.get_weather_information)]
+    return [
+        FunctionTool.from_defaults(
+            fn=OpenMeteoWeather.get_weather_information,
+            async_fn=OpenMeteoWeather.aget_weather_information,
+        )
+    ]
@@ -1,6 +1,15 @@
 import os
+from typing import Any, Dict
+
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 
+from app.engine.retrievers import (
+    HybridSearchMode,
+    get_hybrid_search_mode,
+    reciprocal_rank_fusion_result,
+)
+
+
 def get_vector_store():
     collection_name = os.getenv("QDRANT_COLLECTION")
     url = os.getenv("QDRANT_URL")
@@ -10,9 +19,18 @@ def get_vector_store():
             "Please set QDRANT_COLLECTION, QDRANT_URL"
             " to your environment variables or config them in the .env file"
         )
+    hybrid_kwargs: Dict[str, Any] = {}
+    if get_hybrid_search_mode() == HybridSearchMode.QDRANT:
+        # Store sparse vectors next to the dense ones (the collection must be created with them)
+        hybrid_kwargs = {
+            "enable_hybrid": True,
+            "fastembed_sparse_model": os.getenv("QDRANT_SPARSE_MODEL", "Qdrant/bm25"),
+            "hybrid_fusion_fn": reciprocal_rank_fusion_result,
+        }
     store = QdrantVectorStore(
         collection_name=collection_name,
         url=url,
         api_key=api_key,
+        **hybrid_kwargs,
     )
     return store
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from app.deadline import ContextThreadPoolExecutor, check_deadline
+
+logger = logging.getLogger("uvicorn")
+
+T = TypeVar("T")
+
+
+class ExecutorQueueFullError(Exception):
+    pass
+
+
+class BoundedExecutor:
+    """
+    A pool of `max_workers` threads (or processes) for the blocking calls of a class of tools,
+    so a slow tool doesn't starve the other tools and requests.
+    At most `max_queue` calls wait for a worker, the next ones are rejected.
+
+    The threads run the calls in the context of their caller, e.g. with the request deadline.
+    The calls run in processes must be picklable functions, e.g. for CPU heavy rendering.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = 4,
+        max_queue: int = 32,
+        processes: bool = False,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.processes = processes
+        self._executor: Executor
+        if processes:
+            # Forking a process with running threads isn't safe
+            self._executor = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._executor = ContextThreadPoolExecutor(
+                max_workers, thread_name_prefix=f"executor-{name}"
+            )
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Metrics
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._latencies: deque = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._pending - self.max_workers)
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "Future[T]":
+        with self._lock:
+            if self.queue_depth >= self.max_queue:
+                self._rejected += 1
+                raise ExecutorQueueFullError(
+                    f"Too many calls are waiting for the {self.name} executor"
+                )
+            self._pending += 1
+        submitted_at = time.monotonic()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+        def on_done(future: Future) -> None:
+            with self._lock:
+                self._pending -= 1
+                if future.cancelled() or future.exception() is not None:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+                self._latencies.append(time.monotonic() - submitted_at)
+
+        future.add_done_callback(on_done)
+        return future
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run the call in the executor without blocking the event loop.
+        """
+        check_deadline()
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "name": self.name,
+            "processes": self.processes,
+            "max_workers": self.max_workers,
+            "active": min(self._pending, self.max_workers),
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0,
+        }
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(
+    name: str, processes: bool = False, max_workers: Optional[int] = None
+) -> BoundedExecutor:
+    """
+    Get the executor of a class of tools, configured by TOOL_EXECUTOR_WORKERS_<NAME> and TOOL_EXECUTOR_QUEUE_<NAME>,
+    then TOOL_EXECUTOR_WORKERS and TOOL_EXECUTOR_QUEUE for all executors.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            env_name = name.upper()
+            workers = os.getenv(f"TOOL_EXECUTOR_WORKERS_{env_name}") or (
+                max_workers or os.getenv("TOOL_EXECUTOR_WORKERS", "4")
+            )
+            queue = os.getenv(f"TOOL_EXECUTOR_QUEUE_{env_name}") or os.getenv(
+                "TOOL_EXECUTOR_QUEUE", "32"
+            )
+            _executors[name] = BoundedExecutor(
+                name,
+                max_workers=max(1, int(workers)),
+                max_queue=int(queue),
+                processes=processes,
+            )
+            logger.info(
+                f"Created the {name} executor with {_executors[name].max_workers} "
+                + ("processes" if processes else "threads")
+            )
+        return _executors[name]
+
+
+def get_executors() -> List[BoundedExecutor]:
+    with _executors_lock:
+        return list(_executors.values())
+
+
+def shutdown_executors() -> None:
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
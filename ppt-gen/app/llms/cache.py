@@ -0,0 +1,380 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence, Union
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.llm import LLM
+from pydantic import BaseModel
+
+from app.llms.proxy import DelegatingLLM
+
+logger = logging.getLogger("uvicorn")
+
+LLMResponse = Union[ChatResponse, CompletionResponse]
+
+
+class CachedResponse(BaseModel):
+    """
+    A cached LLM response. `deltas` are the chunks of a streamed response, so it can be replayed as a stream.
+    """
+
+    response: Any
+    deltas: Optional[List[str]] = None
+
+
+class LLMResponseCache:
+    """
+    A SQLite store of LLM responses.
+    Entries expire `ttl` seconds after they were stored (no expiry if None)
+    and the least recently used entries are evicted above `max_entries`.
+    The async methods run the queries and the (un)pickling in a thread, off the event loop.
+    """
+
+    def __init__(
+        self, path: str, ttl: Optional[float] = None, max_entries: int = 10000
+    ):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at "
+                "ON responses (created_at)"
+            )
+            # An estimate of the number of entries (other processes can share the file),
+            # counted again before evicting
+            self._entries = self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._entries -= 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET used_at = ? WHERE key = ?", (now, key)
+            )
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logger.warning(f"Ignoring an unreadable LLM cache entry: {e}")
+            return None
+
+    def put(self, key: str, value: CachedResponse) -> None:
+        now = time.time()
+        data = pickle.dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, data, now, now),
+            )
+            self._entries += 1
+            if self.ttl is not None:
+                self._entries -= self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+                ).rowcount
+            if self._entries <= self.max_entries:
+                return
+            self._entries = self._count()
+            if self._entries > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY used_at LIMIT ?)",
+                    (self._entries - self.max_entries,),
+                )
+                self._entries = self.max_entries
+
+    async def aget(self, key: str) -> Optional[CachedResponse]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, value: CachedResponse) -> None:
+        await asyncio.to_thread(self.put, key, value)
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    return str(value)
+
+
+def _without_raw(response: LLMResponse) -> LLMResponse:
+    # The raw provider response isn't needed to replay it and may not be picklable
+    return response.model_copy(update={"raw": None, "delta": None})
+
+
+class CachedLLM(DelegatingLLM):
+    """
+    An LLM caching the responses of the wrapped LLM on disk.
+    The cache key is a hash of the model, its temperature, the messages (or prompt) and the call arguments,
+    which include the tool schemas of tool calls. A streamed response is replayed as a stream.
+    Only the deterministic calls (temperature 0) are cached, the other calls go to the wrapped LLM.
+    """
+
+    _cache: LLMResponseCache = PrivateAttr()
+
+    def __init__(self, llm: LLM, cache: LLMResponseCache, **kwargs: Any) -> None:
+        super().__init__(llm, **kwargs)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedLLM"
+
+    def _cache_key(self, method: str, input: Any, kwargs: dict) -> Optional[str]:
+        """
+        Get the cache key of a call, None if the call isn't deterministic.
+        """
+        # The provider's LLM holds the settings, under the other proxies
+        llm = self.base_llm
+        temperature = kwargs.get("temperature", getattr(llm, "temperature", None))
+        if temperature is None or temperature > 0:
+            return None
+        data = {
+            "llm": llm.class_name(),
+            "model": llm.metadata.model_name,
+            "temperature": temperature,
+            "max_tokens": getattr(llm, "max_tokens", None),
+            "method": method,
+            "input": input,
+            "kwargs": kwargs,
+        }
+        serialized = json.dumps(data, sort_keys=True, default=_to_json)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def _get(self, key: str) -> Optional[CachedResponse]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit {key[:12]}")
+        return cached
+
+    def _put(self, key: str, response: LLMResponse, deltas: Optional[List[str]] = None):
+        try:
+            self._cache.put(
+                key, CachedResponse(response=_without_raw(response), deltas=deltas)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to cache the LLM response: {e}")
+
+    async def _aget(self, key: str) -> Optional[CachedResponse]:
+        cached = await self._cache.aget(key)
+        if cached is not None:
+            logger.debug(f"LLM cache hit {key[:12]}")
+        return cached
+
+    async def _aput(
+        self, key: str, response: LLMResponse, deltas: Optional[List[str]] = None
+    ) -> None:
+        try:
+            await self._cache.aput(
+                key, CachedResponse(response=_without_raw(response), deltas=deltas)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to cache the LLM response: {e}")
+
+    @staticmethod
+    def _replay(cached: CachedResponse) -> List[LLMResponse]:
+        """
+        Rebuild the chunks of a cached response, a response that wasn't streamed is a single chunk.
+        """
+        response = cached.response
+        is_chat = isinstance(response, ChatResponse)
+        full_text = response.message.content if is_chat else response.text
+        deltas = cached.deltas if cached.deltas is not None else [full_text or ""]
+        chunks: List[LLMResponse] = []
+        text = ""
+        for delta in deltas:
+            text += delta
+            if is_chat:
+                # `content` is a property of the message blocks, it can't be updated with `model_copy`
+                message = ChatMessage(
+                    role=response.message.role,
+                    content=text,
+                    additional_kwargs=response.message.additional_kwargs,
+                )
+                chunks.append(
+                    response.model_copy(update={"message": message, "delta": delta})
+                )
+            else:
+                chunks.append(
+                    response.model_copy(update={"text": text, "delta": delta})
+                )
+        return chunks or [response]
+
+    def _cached_call(
+        self, key: Optional[str], call: Callable[[], LLMResponse]
+    ) -> LLMResponse:
+        if key is None:
+            return call()
+        cached = self._get(key)
+        if cached is not None:
+            return cached.response
+        response = call()
+        self._put(key, response)
+        return response
+
+    def _cached_stream(self, key: Optional[str], stream: Callable[[], Any]) -> Any:
+        if key is None:
+            yield from stream()
+            return
+        cached = self._get(key)
+        if cached is not None:
+            yield from self._replay(cached)
+            return
+        deltas: List[str] = []
+        last = None
+        for chunk in stream():
+            deltas.append(chunk.delta or "")
+            last = chunk
+            yield chunk
+        # Only a fully consumed stream is cached
+        if last is not None:
+            self._put(key, last, deltas)
+
+    async def _acached_stream(self, key: str, stream: Any) -> Any:
+        deltas: List[str] = []
+        last = None
+        async for chunk in stream:
+            deltas.append(chunk.delta or "")
+            last = chunk
+            yield chunk
+        if last is not None:
+            await self._aput(key, last, deltas)
+
+    @staticmethod
+    async def _areplay(chunks: List[LLMResponse]) -> Any:
+        for chunk in chunks:
+            yield chunk
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        key = self._cache_key("chat", messages, kwargs)
+        return self._cached_call(key, lambda: self._llm.chat(messages, **kwargs))
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        key = self._cache_key("chat", messages, kwargs)
+        if key is None:
+            return await self._llm.achat(messages, **kwargs)
+        cached = await self._aget(key)
+        if cached is not None:
+            return cached.response
+        response = await self._llm.achat(messages, **kwargs)
+        await self._aput(key, response)
+        return response
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        key = self._cache_key("chat", messages, kwargs)
+        return self._cached_stream(
+            key, lambda: self._llm.stream_chat(messages, **kwargs)
+        )
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        key = self._cache_key("chat", messages, kwargs)
+        if key is None:
+            return await self._llm.astream_chat(messages, **kwargs)
+        cached = await self._aget(key)
+        if cached is not None:
+            return self._areplay(self._replay(cached))
+        stream = await self._llm.astream_chat(messages, **kwargs)
+        return self._acached_stream(key, stream)
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        return self._cached_call(
+            key, lambda: self._llm.complete(prompt, formatted=formatted, **kwargs)
+        )
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        if key is None:
+            return await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+        cached = await self._aget(key)
+        if cached is not None:
+            return cached.response
+        response = await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+        await self._aput(key, response)
+        return response
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        return self._cached_stream(
+            key,
+            lambda: self._llm.stream_complete(prompt, formatted=formatted, **kwargs),
+        )
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        key = self._cache_key("complete", [prompt, formatted], kwargs)
+        if key is None:
+            return await self._llm.astream_complete(
+                prompt, formatted=formatted, **kwargs
+            )
+        cached = await self._aget(key)
+        if cached is not None:
+            return self._areplay(self._replay(cached))
+        stream = await self._llm.astream_complete(prompt, formatted=formatted, **kwargs)
+        return self._acached_stream(key, stream)
+
+
+def get_cached_llm(llm: LLM) -> LLM:
+    """
+    Wrap the LLM with a disk cache of its deterministic calls if LLM_CACHE_DIR is set.
+    LLM_CACHE_TTL (seconds) and LLM_CACHE_MAX_ENTRIES limit the cached responses.
+    """
+    cache_dir = os.getenv("LLM_CACHE_DIR")
+    if not cache_dir:
+        return llm
+    ttl = os.getenv("LLM_CACHE_TTL")
+    cache = LLMResponseCache(
+        path=os.path.join(cache_dir, "llm_cache.sqlite"),
+        ttl=float(ttl) if ttl else None,
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000")),
+    )
+    logger.info(f"Caching the LLM responses in {cache_dir}")
+    return CachedLLM(llm, cache)
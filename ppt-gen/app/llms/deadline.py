@@ -0,0 +1,85 @@
+from typing import Any, AsyncGenerator, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+)
+
+from app.deadline import Deadline, check_deadline, get_deadline, wait_with_deadline
+from app.llms.proxy import DelegatingLLM
+
+
+class DeadlineLLM(DelegatingLLM):
+    """
+    An LLM bounding its calls by the deadline of the request, including the wait for a scheduler slot.
+    A stream keeps the deadline of the call that started it, wherever it's consumed.
+    """
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DeadlineLLM"
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        check_deadline()
+        return self._llm.chat(messages, **kwargs)
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        check_deadline()
+        return self._llm.complete(prompt, formatted=formatted, **kwargs)
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        return await wait_with_deadline(
+            self._llm.achat(messages, **kwargs), get_deadline()
+        )
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return await wait_with_deadline(
+            self._llm.acomplete(prompt, formatted=formatted, **kwargs), get_deadline()
+        )
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        deadline = get_deadline()
+        stream = await wait_with_deadline(
+            self._llm.astream_chat(messages, **kwargs), deadline
+        )
+        return self._stream_with_deadline(stream, deadline)
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        deadline = get_deadline()
+        stream = await wait_with_deadline(
+            self._llm.astream_complete(prompt, formatted=formatted, **kwargs), deadline
+        )
+        return self._stream_with_deadline(stream, deadline)
+
+    @staticmethod
+    def _stream_with_deadline(
+        stream: AsyncGenerator, deadline: Optional[Deadline]
+    ) -> Any:
+        if deadline is None:
+            return stream
+
+        async def gen():
+            try:
+                while True:
+                    try:
+                        chunk = await wait_with_deadline(stream.__anext__(), deadline)
+                    except StopAsyncIteration:
+                        return
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+        return gen()
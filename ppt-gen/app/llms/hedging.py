@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponseAsyncGen,
+    CompletionResponseAsyncGen,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.llm import LLM
+
+from app.llms.proxy import DelegatingLLM
+
+logger = logging.getLogger("uvicorn")
+
+
+class LLMHedger:
+    """
+    Decide when to send a backup request for a slow stream.
+
+    The backup is sent when the first token takes longer than the `percentile` of the recent
+    time-to-first-token (at least `min_delay` seconds, `initial_delay` until enough samples).
+    At most a `budget` fraction of the recent requests are hedged.
+    """
+
+    _min_samples = 20
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 95,
+        budget: float = 0.05,
+        min_delay: float = 0.5,
+        initial_delay: float = 2.0,
+        window: int = 1000,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self._ttfts: deque = deque(maxlen=window)
+        # Whether each of the recent requests was hedged
+        self._hedged: deque = deque(maxlen=window)
+        # Metrics
+        self.requests = 0
+        self.hedges = 0
+        self.backup_wins = 0
+
+    def get_delay(self) -> float:
+        """
+        Get the seconds to wait for the first token before hedging.
+        """
+        if len(self._ttfts) < self._min_samples:
+            return self.initial_delay
+        ttfts = sorted(self._ttfts)
+        index = min(len(ttfts) - 1, int(len(ttfts) * self.percentile / 100))
+        return max(self.min_delay, ttfts[index])
+
+    def try_hedge(self) -> bool:
+        """
+        Take a hedge from the budget, the request must have been added with `add_request`.
+        """
+        if sum(self._hedged) + 1 > self.budget * len(self._hedged):
+            return False
+        self._hedged[-1] = True
+        self.hedges += 1
+        return True
+
+    def add_request(self) -> None:
+        self.requests += 1
+        self._hedged.append(False)
+
+    def add_ttft(self, ttft: float) -> None:
+        self._ttfts.append(ttft)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "backup_wins": self.backup_wins,
+            "delay": self.get_delay(),
+        }
+
+
+_hedgers: Dict[str, LLMHedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_llm_hedger(name: str) -> LLMHedger:
+    """
+    Get the hedger of a provider/model, configured by the LLM_HEDGE_PERCENTILE, LLM_HEDGE_BUDGET,
+    LLM_HEDGE_MIN_DELAY and LLM_HEDGE_INITIAL_DELAY environment variables.
+    """
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = LLMHedger(
+                name,
+                percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+                budget=float(os.getenv("LLM_HEDGE_BUDGET", "0.05")),
+                min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5")),
+                initial_delay=float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "2")),
+            )
+        return _hedgers[name]
+
+
+def get_llm_hedgers() -> List[LLMHedger]:
+    with _hedgers_lock:
+        return list(_hedgers.values())
+
+
+class HedgedLLM(DelegatingLLM):
+    """
+    An LLM sending a backup request when an async stream is slow to start.
+    The stream starting first is used, the other one is cancelled.
+
+    A backup LLM of another provider only hedges the streams without provider specific arguments
+    (e.g. not the tool calls, prepared for the primary provider).
+    The backup request uses the scheduler slot of the primary request.
+    """
+
+    _backup_llm: LLM = PrivateAttr()
+    _hedger: LLMHedger = PrivateAttr()
+
+    def __init__(
+        self, llm: LLM, backup_llm: LLM, hedger: LLMHedger, **kwargs: Any
+    ) -> None:
+        super().__init__(llm, **kwargs)
+        self._backup_llm = backup_llm
+        self._hedger = hedger
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HedgedLLM"
+
+    @property
+    def hedger(self) -> LLMHedger:
+        return self._hedger
+
+    def _can_hedge(self, kwargs: Dict[str, Any]) -> bool:
+        return not kwargs or type(self._backup_llm) is type(self._llm)
+
+    def _hedged_stream(
+        self,
+        start_stream: Callable[[LLM], Awaitable[Any]],
+        can_hedge: bool,
+    ) -> Any:
+        """
+        Start the stream on the first iteration, hedging it if the first token is late.
+        """
+
+        async def first_chunk(llm: LLM) -> Tuple[Any, Any]:
+            stream = await start_stream(llm)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+
+        async def close(task: asyncio.Task) -> None:
+            if not task.done():
+                task.cancel()
+            try:
+                stream, _ = await task
+                await stream.aclose()
+            except BaseException:
+                pass
+
+        async def gen():
+            hedger = self._hedger
+            hedger.add_request()
+            started_at = time.monotonic()
+            primary = asyncio.ensure_future(first_chunk(self._llm))
+            tasks = {primary}
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=hedger.get_delay())
+                if not done and can_hedge and hedger.try_hedge():
+                    logger.info(f"Hedging a slow stream of {hedger.name}")
+                    tasks.add(asyncio.ensure_future(first_chunk(self._backup_llm)))
+                winner = None
+                while tasks:
+                    done, _ = await asyncio.wait(
+                        tasks, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    task = done.pop()
+                    tasks.discard(task)
+                    # Use the other stream if this one failed
+                    if task.exception() is None or not tasks:
+                        winner = task
+                        break
+                stream, chunk = winner.result()  # type: ignore
+                # Without a backup, it's the time to first token of the primary request.
+                # Otherwise a lower bound of it, still above the hedging delay.
+                hedger.add_ttft(time.monotonic() - started_at)
+                if winner is not primary:
+                    hedger.backup_wins += 1
+            finally:
+                for task in tasks:
+                    await close(task)
+            if chunk is None:
+                return
+            try:
+                yield chunk
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+
+        return gen()
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        return self._hedged_stream(
+            lambda llm: llm.astream_chat(messages, **kwargs), self._can_hedge(kwargs)
+        )
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        return self._hedged_stream(
+            lambda llm: llm.astream_complete(prompt, formatted=formatted, **kwargs),
+            self._can_hedge(kwargs),
+        )
+
+
+def get_hedged_llm(llm: LLM, backup_llm: Optional[LLM]) -> LLM:
+    """
+    Hedge the async streams of the LLM with the backup LLM, if there is one.
+    """
+    if backup_llm is None:
+        return llm
+    name = f"{llm.class_name()}/{llm.metadata.model_name}"
+    return HedgedLLM(llm, backup_llm, get_llm_hedger(name))
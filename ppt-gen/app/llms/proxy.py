@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+from llama_index.core.llms.llm import LLM, ToolSelection
+from llama_index.core.tools import BaseTool
+
+
+class DelegatingLLM(FunctionCallingLLM):
+    """
+    An LLM forwarding every call to a wrapped LLM.
+    Subclasses override the calls they want to intercept (e.g. to cache the responses).
+
+    The tool calling helpers of the base class run on the proxy,
+    so the tool calls also go through the intercepted `chat` methods.
+    """
+
+    _llm: LLM = PrivateAttr()
+
+    def __init__(self, llm: LLM, **kwargs: Any) -> None:
+        super().__init__(
+            callback_manager=llm.callback_manager,
+            system_prompt=llm.system_prompt,
+            pydantic_program_mode=llm.pydantic_program_mode,
+            **kwargs,
+        )
+        self._llm = llm
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DelegatingLLM"
+
+    @property
+    def llm(self) -> LLM:
+        return self._llm
+
+    @property
+    def base_llm(self) -> LLM:
+        """
+        The LLM of the provider, under all the proxies.
+        """
+        llm = self._llm
+        while isinstance(llm, DelegatingLLM):
+            llm = llm.llm
+        return llm
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._llm.chat(messages, **kwargs)
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        return await self._llm.achat(messages, **kwargs)
+
+    def stream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseGen:
+        return self._llm.stream_chat(messages, **kwargs)
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        return await self._llm.astream_chat(messages, **kwargs)
+
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return self._llm.complete(prompt, formatted=formatted, **kwargs)
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        return await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        return self._llm.stream_complete(prompt, formatted=formatted, **kwargs)
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        return await self._llm.astream_complete(prompt, formatted=formatted, **kwargs)
+
+    def _function_calling_llm(self) -> FunctionCallingLLM:
+        if not isinstance(self._llm, FunctionCallingLLM):
+            raise ValueError(f"{self._llm.class_name()} does not support tool calls")
+        return self._llm
+
+    def _prepare_chat_with_tools(
+        self,
+        tools: Sequence[BaseTool],
+        user_msg: Optional[Union[str, ChatMessage]] = None,
+        chat_history: Optional[List[ChatMessage]] = None,
+        verbose: bool = False,
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        return self._function_calling_llm()._prepare_chat_with_tools(
+            tools,
+            user_msg=user_msg,
+            chat_history=chat_history,
+            verbose=verbose,
+            allow_parallel_tool_calls=allow_parallel_tool_calls,
+            **kwargs,
+        )
+
+    def _validate_chat_with_tools_response(
+        self,
+        response: ChatResponse,
+        tools: Sequence[BaseTool],
+        allow_parallel_tool_calls: bool = False,
+        **kwargs: Any,
+    ) -> ChatResponse:
+        return self._function_calling_llm()._validate_chat_with_tools_response(
+            response,
+            tools,
+            allow_parallel_tool_calls=allow_parallel_tool_calls,
+            **kwargs,
+        )
+
+    def get_tool_calls_from_response(
+        self,
+        response: ChatResponse,
+        error_on_no_tool_call: bool = True,
+        **kwargs: Any,
+    ) -> List[ToolSelection]:
+        return self._function_calling_llm().get_tool_calls_from_response(
+            response, error_on_no_tool_call=error_on_no_tool_call, **kwargs
+        )
+
+    def _structured_llm_kwargs(
+        self, llm_kwargs: Optional[Dict[str, Any]], kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        OpenAI LLMs require a tool call for structured predictions,
+        their override of `structured_predict` doesn't apply to the proxy.
+        """
+        llm_kwargs = dict(llm_kwargs or {})
+        try:
+            from llama_index.llms.openai import OpenAI
+        except ImportError:
+            return llm_kwargs
+        if isinstance(self.base_llm, OpenAI) and "tool_choice" not in {
+            **kwargs,
+            **llm_kwargs,
+        }:
+            llm_kwargs["tool_choice"] = "required"
+        return llm_kwargs
+
+    def structured_predict(
+        self, *args: Any, llm_kwargs: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> Any:
+        return super().structured_predict(
+            *args, llm_kwargs=self._structured_llm_kwargs(llm_kwargs, kwargs), **kwargs
+        )
+
+    async def astructured_predict(
+        self, *args: Any, llm_kwargs: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> Any:
+        return await super().astructured_predict(
+            *args, llm_kwargs=self._structured_llm_kwargs(llm_kwargs, kwargs), **kwargs
+        )
+
+    def stream_structured_predict(
+        self, *args: Any, llm_kwargs: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> Any:
+        return super().stream_structured_predict(
+            *args, llm_kwargs=self._structured_llm_kwargs(llm_kwargs, kwargs), **kwargs
+        )
+
+    async def astream_structured_predict(
+        self, *args: Any, llm_kwargs: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> Any:
+        return await super().astream_structured_predict(
+            *args, llm_kwargs=self._structured_llm_kwargs(llm_kwargs, kwargs), **kwargs
+        )
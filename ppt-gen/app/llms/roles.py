@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+from enum import Enum
+from typing import Dict, Optional
+
+from llama_index.core.llms.llm import LLM
+from llama_index.core.settings import Settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class LLMRole(str, Enum):
+    """
+    The roles of the LLM calls, each role can use its own model.
+    """
+
+    # Decides which tools to call
+    ROUTER = "router"
+    # Writes the code of the analyses
+    ANALYST = "analyst"
+    # Writes the answers and reports
+    SYNTHESIZER = "synthesizer"
+    # Suggests the next questions
+    SUGGESTER = "suggester"
+
+
+_role_llms: Dict[str, LLM] = {}
+_role_llms_lock = threading.Lock()
+
+
+def _create_llm(model: str) -> LLM:
+    """
+    Create an LLM of the configured provider with another model.
+    """
+    from app.settings import get_base_llm, with_model, wrap_llm
+
+    base_llm = get_base_llm()
+    if base_llm is None:
+        raise ValueError("The LLM provider is not initialized")
+    return wrap_llm(with_model(base_llm, model))
+
+
+def get_llm(role: LLMRole, default: Optional[LLM] = None) -> LLM:
+    """
+    Get the LLM of a role, configured by the LLM_<ROLE>_MODEL environment variable (e.g. LLM_ROUTER_MODEL).
+    Defaults to the given LLM or `Settings.llm`.
+    """
+    default = default or Settings.llm
+    model = os.getenv(f"LLM_{role.value.upper()}_MODEL")
+    if not model or model == default.metadata.model_name:
+        return default
+    with _role_llms_lock:
+        if model not in _role_llms:
+            try:
+                _role_llms[model] = _create_llm(model)
+            except ValueError as e:
+                logger.warning(f"Using the default LLM for the {role.value} role: {e}")
+                return default
+            logger.info(f"Using the model {model} for the {role.value} role")
+        return _role_llms[model]
+
+
+def is_escalation_enabled() -> bool:
+    """
+    Whether a call failing validation with a role model is retried with the default model.
+    """
+    return os.getenv("LLM_ESCALATION", "true").lower() == "true"
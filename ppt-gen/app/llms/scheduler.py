@@ -0,0 +1,322 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+)
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.llm import LLM
+
+from app.llms.proxy import DelegatingLLM
+
+logger = logging.getLogger("uvicorn")
+
+
+class LLMPriority(IntEnum):
+    """
+    Priority classes of the LLM calls, lower values are scheduled first.
+    """
+
+    FINAL_ANSWER = 0
+    TOOL_SELECTION = 1
+    SUGGESTION = 2
+
+
+_priority: contextvars.ContextVar[LLMPriority] = contextvars.ContextVar(
+    "llm_priority", default=LLMPriority.TOOL_SELECTION
+)
+
+
+@contextmanager
+def llm_priority(priority: LLMPriority) -> Iterator[None]:
+    """
+    Set the priority of the LLM calls made in this context (and the tasks it creates).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMOverloadedError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    A token bucket refilled with `rate` tokens per second, holding at most `capacity` tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def try_take(self) -> float:
+        """
+        Take a token, returns 0 if it's taken, otherwise the seconds to wait for the next token.
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class LLMScheduler:
+    """
+    Admission control of the LLM calls to a model.
+
+    At most `max_concurrency` calls run at a time, started at most at `rate_limit` calls per second.
+    Waiting calls are started by priority, then in arrival order.
+    With `max_queue_depth` calls waiting, the scheduler is overloaded: suggestion calls are rejected
+    and the chat endpoint sheds new requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 16,
+        rate_limit: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_queue_depth: int = 64,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self._bucket = (
+            TokenBucket(rate_limit, burst or max(1, int(rate_limit)))
+            if rate_limit
+            else None
+        )
+        self._waiters: List[Any] = []
+        self._counter = itertools.count()
+        self._active = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        # Metrics
+        self._admitted = 0
+        self._shed = 0
+        self._wait_times: deque = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter[2].done())
+
+    def is_overloaded(self) -> bool:
+        return self.queue_depth >= self.max_queue_depth
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[LLMPriority] = None) -> AsyncIterator[None]:
+        """
+        Wait for a slot to call the LLM.
+        """
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: Optional[LLMPriority] = None) -> None:
+        if priority is None:
+            priority = _priority.get()
+        if priority >= LLMPriority.SUGGESTION and self.is_overloaded():
+            self._shed += 1
+            raise LLMOverloadedError(f"The LLM {self.name} is overloaded")
+
+        started_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been granted while cancelling
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self._admitted += 1
+        self._wait_times.append(time.monotonic() - started_at)
+
+    def release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """
+        Start the waiting calls while there are free slots and rate limit tokens.
+        """
+        while self._waiters and self._active < self.max_concurrency:
+            future = self._waiters[0][2]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self._bucket is not None:
+                wait = self._bucket.try_take()
+                if wait > 0:
+                    self._schedule_dispatch(wait)
+                    return
+            heapq.heappop(self._waiters)
+            self._active += 1
+            future.set_result(None)
+
+    def _schedule_dispatch(self, delay: float) -> None:
+        if self._wakeup is not None and not self._wakeup.cancelled():
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        wait_times = sorted(self._wait_times)
+        queued_by_priority = {priority.name.lower(): 0 for priority in LLMPriority}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                queued_by_priority[LLMPriority(priority).name.lower()] += 1
+        return {
+            "name": self.name,
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": sum(queued_by_priority.values()),
+            "queued_by_priority": queued_by_priority,
+            "max_queue_depth": self.max_queue_depth,
+            "overloaded": self.is_overloaded(),
+            "admitted": self._admitted,
+            "shed": self._shed,
+            "wait_p50": wait_times[len(wait_times) // 2] if wait_times else 0,
+            "wait_p95": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0,
+        }
+
+
+_schedulers: Dict[str, LLMScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_llm_scheduler(name: str) -> LLMScheduler:
+    """
+    Get the scheduler of a provider/model, configured by the LLM_MAX_CONCURRENCY, LLM_RATE_LIMIT (calls per second),
+    LLM_RATE_LIMIT_BURST and LLM_MAX_QUEUE_DEPTH environment variables.
+    """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            rate_limit = os.getenv("LLM_RATE_LIMIT")
+            burst = os.getenv("LLM_RATE_LIMIT_BURST")
+            _schedulers[name] = LLMScheduler(
+                name,
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+                rate_limit=float(rate_limit) if rate_limit else None,
+                burst=int(burst) if burst else None,
+                max_queue_depth=int(os.getenv("LLM_MAX_QUEUE_DEPTH", "64")),
+            )
+        return _schedulers[name]
+
+
+def get_llm_schedulers() -> List[LLMScheduler]:
+    with _schedulers_lock:
+        return list(_schedulers.values())
+
+
+def is_llm_overloaded() -> bool:
+    return any(scheduler.is_overloaded() for scheduler in get_llm_schedulers())
+
+
+class ScheduledLLM(DelegatingLLM):
+    """
+    An LLM waiting for a slot of its scheduler before each async call.
+    A streamed call waits for its slot on the first iteration and keeps it until the stream is consumed.
+    The sync calls are not scheduled, they don't run in the event loop.
+    """
+
+    _scheduler: LLMScheduler = PrivateAttr()
+
+    def __init__(self, llm: LLM, scheduler: LLMScheduler, **kwargs: Any) -> None:
+        super().__init__(llm, **kwargs)
+        self._scheduler = scheduler
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledLLM"
+
+    @property
+    def scheduler(self) -> LLMScheduler:
+        return self._scheduler
+
+    async def achat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponse:
+        async with self._scheduler.slot():
+            return await self._llm.achat(messages, **kwargs)
+
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        async with self._scheduler.slot():
+            return await self._llm.acomplete(prompt, formatted=formatted, **kwargs)
+
+    def _scheduled_stream(self, start_stream: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Start the stream once a slot is granted, on the first iteration.
+        A stream that is never iterated doesn't call the LLM nor hold a slot.
+        """
+        # The stream may be consumed in another context (e.g. the response streaming task)
+        priority = _priority.get()
+
+        async def gen():
+            async with self._scheduler.slot(priority):
+                stream = await start_stream()
+                async for chunk in stream:
+                    yield chunk
+
+        return gen()
+
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        return self._scheduled_stream(
+            lambda: self._llm.astream_chat(messages, **kwargs)
+        )
+
+    async def astream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseAsyncGen:
+        return self._scheduled_stream(
+            lambda: self._llm.astream_complete(prompt, formatted=formatted, **kwargs)
+        )
+
+
+def get_scheduled_llm(llm: LLM) -> LLM:
+    """
+    Schedule the async calls of the LLM, unless LLM_SCHEDULER is false.
+    """
+    if os.getenv("LLM_SCHEDULER", "true").lower() != "true":
+        return llm
+    name = f"{llm.class_name()}/{llm.metadata.model_name}"
+    return ScheduledLLM(llm, get_llm_scheduler(name))
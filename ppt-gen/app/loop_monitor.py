@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("uvicorn")
+
+
+class LoopMonitor:
+    """
+    Measure the lag of the event loop and find the code blocking it.
+
+    A heartbeat task sleeps `interval` seconds, its delay is the loop lag.
+    When a heartbeat is late by more than `threshold` seconds, a watchdog thread captures the stack
+    of the loop thread, i.e. of the callback blocking the loop while it's still running.
+    The blocking stacks are grouped, the `max_offenders` with the longest total blocking time are kept.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.1,
+        max_offenders: int = 50,
+        stack_depth: int = 12,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_offenders = max_offenders
+        self.stack_depth = stack_depth
+        self._lags: deque = deque(maxlen=1000)
+        self._offenders: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._beat = 0
+        self._beat_at = time.monotonic()
+        # The stack captured during a late heartbeat, by heartbeat number
+        self._captured: Dict[int, str] = {}
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """
+        Monitor the running event loop.
+        """
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat_at = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat(), name="loop-monitor")
+        threading.Thread(
+            target=self._watch, name="loop-monitor-watchdog", daemon=True
+        ).start()
+        logger.info(
+            f"Monitoring the event loop lag, reporting the callbacks blocking it for more than {self.threshold}s"
+        )
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected_at = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected_at)
+            with self._lock:
+                beat = self._beat
+                self._beat += 1
+                self._beat_at = now
+                stack = self._captured.pop(beat, None)
+            self._lags.append(lag)
+            if lag > self.threshold:
+                self._add_offender(lag, stack)
+
+    def _watch(self) -> None:
+        """
+        Capture the stack of the loop thread when the heartbeat is late.
+        """
+        while not self._stopped.wait(self.threshold / 2):
+            with self._lock:
+                beat = self._beat
+                late = time.monotonic() - self._beat_at - self.interval
+                if late <= self.threshold or beat in self._captured:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread_id)  # type: ignore
+            if frame is None:
+                continue
+            stack = "".join(
+                traceback.format_list(
+                    traceback.extract_stack(frame)[-self.stack_depth :]
+                )
+            )
+            with self._lock:
+                # Only keep it if the loop is still blocked in the same heartbeat
+                if self._beat == beat:
+                    self._captured[beat] = stack
+
+    def _add_offender(self, lag: float, stack: Optional[str]) -> None:
+        # Without a stack, the loop was blocked for less than a watchdog period after the threshold
+        stack = stack or "<stack not captured>"
+        logger.warning(f"The event loop was blocked for {lag:.3f}s in:\n{stack}")
+        with self._lock:
+            offender = self._offenders.get(stack)
+            if offender is None:
+                if len(self._offenders) >= self.max_offenders:
+                    least = min(
+                        self._offenders,
+                        key=lambda key: self._offenders[key]["total_blocked"],
+                    )
+                    del self._offenders[least]
+                offender = self._offenders[stack] = {
+                    "stack": stack,
+                    "count": 0,
+                    "total_blocked": 0.0,
+                    "max_blocked": 0.0,
+                }
+            offender["count"] += 1
+            offender["total_blocked"] += lag
+            offender["max_blocked"] = max(offender["max_blocked"], lag)
+            offender["last_seen"] = time.time()
+
+    def get_offenders(self, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            offenders = [dict(offender) for offender in self._offenders.values()]
+        offenders.sort(key=lambda offender: offender["total_blocked"], reverse=True)
+        return offenders[:limit]
+
+    def get_metrics(self) -> Dict[str, Any]:
+        lags = sorted(self._lags)
+        return {
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag_p50": lags[len(lags) // 2] if lags else 0,
+            "lag_p95": lags[int(len(lags) * 0.95)] if lags else 0,
+            "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0,
+            "lag_max": lags[-1] if lags else 0,
+            "blocked": sum(1 for lag in lags if lag > self.threshold),
+        }
+
+
+_loop_monitor: Optional[LoopMonitor] = None
+_loop_monitor_lock = threading.Lock()
+
+
+def get_loop_monitor() -> Optional[LoopMonitor]:
+    """
+    Get the event loop monitor if LOOP_MONITOR is true,
+    configured by LOOP_MONITOR_INTERVAL and LOOP_MONITOR_THRESHOLD (seconds).
+    """
+    global _loop_monitor
+    if os.getenv("LOOP_MONITOR", "false").lower() != "true":
+        return None
+    with _loop_monitor_lock:
+        if _loop_monitor is None:
+            _loop_monitor = LoopMonitor(
+                interval=float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1")),
+                threshold=float(os.getenv("LOOP_MONITOR_THRESHOLD", "0.1")),
+            )
+        return _loop_monitor
@@ -0,0 +1,186 @@
+import glob
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import yaml  # type: ignore
+from pydantic import BaseModel, ConfigDict
+
+logger = logging.getLogger("uvicorn")
+
+CONFIG_DIR = "config"
+
+
+class RuntimeConfig(BaseModel):
+    """
+    An immutable snapshot of the parsed and validated config files.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    version: int
+    # config file name (without extension) -> parsed content
+    files: Dict[str, Any]
+
+    @property
+    def loaders(self) -> Dict[str, Any]:
+        return self.files.get("loaders") or {}
+
+    @property
+    def tools(self) -> Dict[str, Dict[str, dict]]:
+        return self.files.get("tools") or {}
+
+
+def _validate_loaders(config: Dict[str, Any]) -> None:
+    from app.engine.loaders.db import DBLoaderConfig
+    from app.engine.loaders.file import FileLoaderConfig
+    from app.engine.loaders.web import WebLoaderConfig
+
+    for loader_type, loader_config in config.items():
+        match loader_type:
+            case "file":
+                FileLoaderConfig(**loader_config)
+            case "web":
+                WebLoaderConfig(**loader_config)
+            case "db":
+                [DBLoaderConfig(**cfg) for cfg in loader_config]
+            case _:
+                raise ValueError(f"Invalid loader type: {loader_type}")
+
+
+def _validate_tools(config: Dict[str, Any]) -> None:
+    from app.engine.tools import ToolFactory
+
+    for tool_type, config_entries in config.items():
+        if tool_type not in ToolFactory.TOOL_SOURCE_PACKAGE_MAP:
+            raise ValueError(f"Invalid tool type: {tool_type}")
+        for tool_name, tool_config in (config_entries or {}).items():
+            if not isinstance(tool_config, dict):
+                raise ValueError(f"Config of tool {tool_name} must be a mapping")
+
+
+class ConfigService:
+    """
+    Parse the config files once and hand out instances built from them
+    (LlamaParse parser, tool registry, vector store client).
+
+    The files can be watched for changes: a new config is validated before it atomically replaces
+    the current one, and the cached instances are rebuilt on their next use.
+    An invalid config is logged and ignored, the current one stays in use.
+    """
+
+    def __init__(self, config_dir: str = CONFIG_DIR):
+        self._config_dir = config_dir
+        self._lock = threading.RLock()
+        self._mtimes = self._get_mtimes()
+        self._config = self._load(version=0)
+        # Instances built from the current config, cleared on reload
+        self._instances: Dict[str, Any] = {}
+        self._watcher: Optional[threading.Thread] = None
+
+    @property
+    def config(self) -> RuntimeConfig:
+        return self._config
+
+    def _get_mtimes(self) -> Dict[str, float]:
+        return {
+            path: os.path.getmtime(path)
+            for path in glob.glob(os.path.join(self._config_dir, "*.yaml"))
+        }
+
+    def _load(self, version: int) -> RuntimeConfig:
+        files: Dict[str, Any] = {}
+        for path in sorted(self._mtimes):
+            with open(path) as f:
+                name = os.path.splitext(os.path.basename(path))[0]
+                files[name] = yaml.safe_load(f)
+        config = RuntimeConfig(version=version, files=files)
+        _validate_loaders(config.loaders)
+        _validate_tools(config.tools)
+        return config
+
+    def reload(self) -> bool:
+        """
+        Reload the config if a file changed. Returns True if a new config is in use.
+        """
+        with self._lock:
+            mtimes = self._get_mtimes()
+            if mtimes == self._mtimes:
+                return False
+            self._mtimes = mtimes
+            try:
+                config = self._load(version=self._config.version + 1)
+            except Exception as e:
+                logger.error(f"Invalid config, keeping the current one: {e}")
+                return False
+            self._config = config
+            self._instances = {}
+        logger.info(f"Reloaded the config files (version {config.version})")
+        return True
+
+    def start_watching(self, interval: float) -> None:
+        """
+        Check the config files for changes every `interval` seconds in a daemon thread.
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Error reloading the config: {e}")
+
+        self._watcher = threading.Thread(
+            target=watch, name="config-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def get_instance(self, key: str, factory: Callable[[], Any]) -> Any:
+        """
+        Get the instance built by `factory` from the current config, building it on first use.
+        """
+        with self._lock:
+            if key not in self._instances:
+                self._instances[key] = factory()
+            return self._instances[key]
+
+    def get_llamaparse_parser(self):
+        """
+        Get the shared LlamaParse parser, None if LlamaParse is not enabled.
+        """
+        from app.engine.loaders.file import FileLoaderConfig, llama_parse_parser
+
+        file_loader_config = FileLoaderConfig(**self.config.loaders.get("file", {}))
+        if not file_loader_config.use_llama_parse:
+            return None
+        return self.get_instance("llamaparse_parser", llama_parse_parser)
+
+    def get_tool_registry(self):
+        from app.engine.tools import ToolRegistry
+
+        # The factory runs under the lock, so it can't see a config being replaced
+        return self.get_instance(
+            "tool_registry", lambda: ToolRegistry.from_config(self.config.tools)
+        )
+
+    def get_vector_store(self):
+        from app.engine.vectordb import get_vector_store
+
+        return self.get_instance("vector_store", get_vector_store)
+
+
+_config_service: Optional[ConfigService] = None
+_config_service_lock = threading.Lock()
+
+
+def get_config_service() -> ConfigService:
+    global _config_service
+    with _config_service_lock:
+        if _config_service is None:
+            _config_service = ConfigService()
+        return _config_service
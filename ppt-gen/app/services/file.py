@@ -10,10 +10,12 @@ from typing import List, Optional, Tuple
 
 from llama_index.core import VectorStoreIndex
 from llama_index.core.ingestion import IngestionPipeline
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.readers.file.base import (
     _try_loading_included_file_formats as get_file_loaders_map,
 )
 from llama_index.core.schema import Document
+from llama_index.core.settings import Settings
 from llama_index.indices.managed.llama_cloud.base import LlamaCloudIndex
 from llama_index.readers.file import FlatReader
 from pydantic import BaseModel, Field
@@ -215,7 +217,15 @@ class FileService:
         """
         Add the documents to the vector store index
         """
-        pipeline = IngestionPipeline()
+        from app.engine.dedup import SimHashExtractor
+
+        pipeline = IngestionPipeline(
+            transformations=[
+                SentenceSplitter(),
+                SimHashExtractor(),
+                Settings.embed_model,
+            ]
+        )
         nodes = pipeline.run(documents=documents)
 
         # Add the nodes to the index and persist it
@@ -227,6 +237,14 @@ class FileService:
             persist_dir=os.environ.get("STORAGE_DIR", "storage")
         )
 
+        # Keep the sparse index in sync so the uploaded file can be found by keywords
+        from app.engine.retrievers import HybridSearchMode, get_hybrid_search_mode
+
+        if get_hybrid_search_mode() == HybridSearchMode.LOCAL:
+            from app.engine.bm25 import update_bm25_index
+
+            update_bm25_index(nodes)
+
     @staticmethod
     def _add_file_to_llama_cloud_index(
         index: LlamaCloudIndex,
@@ -263,15 +281,9 @@ def _sanitize_file_name(file_name: str) -> str:
 
 
 def _get_llamaparse_parser():
-    from app.engine.loaders import load_configs
-    from app.engine.loaders.file import FileLoaderConfig, llama_parse_parser
-
-    config = load_configs()
-    file_loader_config = FileLoaderConfig(**config["file"])
-    if file_loader_config.use_llama_parse:
-        return llama_parse_parser()
-    else:
-        return None
+    from app.services.config import get_config_service
+
+    return get_config_service().get_llamaparse_parser()
 
 
 def _default_file_loaders_map():
@@ -0,0 +1,396 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("uvicorn")
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobStore:
+    """
+    A SQLite queue of chat jobs and the stream frames they produced.
+    Several processes can share the database file: API servers enqueue jobs and read their frames,
+    workers claim and run them.
+
+    A worker holds a job for `lease` seconds and renews the lease while it runs it.
+    The running jobs with an expired lease (e.g. their worker crashed) are queued again
+    if they haven't produced any frame yet and have been run less than `max_attempts` times, failed otherwise.
+    """
+
+    def __init__(self, path: str, lease: float = 60, max_attempts: int = 2):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_events ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, frame TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, seq))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            # Added to the databases created without leases
+            if "lease_until" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            if "attempts" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def enqueue(self, payload: str, max_queued: int) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (queued,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)
+                ).fetchone()
+                if queued >= max_queued:
+                    raise JobQueueFullError(f"The job queue is full ({queued} jobs)")
+                self._conn.execute(
+                    "INSERT INTO jobs (id, status, payload, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (job_id, JOB_QUEUED, payload, now, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, str]]:
+        """
+        Take the oldest queued job with a lease, returns its id and payload.
+        The jobs of the stopped workers are queued again (or failed) first.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(now)
+                row = self._conn.execute(
+                    "SELECT id, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (JOB_QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, updated_at = ?, lease_until = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (JOB_RUNNING, now, now + self.lease, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def renew(self, job_id: str) -> bool:
+        """
+        Extend the lease of a running job, returns False if the job is no longer running.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                (time.time() + self.lease, job_id, JOB_RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def expire_leases(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(time.time())
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _expire_leases(self, now: float) -> None:
+        # The running jobs of an older version without lease expire `lease` seconds after their last update
+        rows = self._conn.execute(
+            "SELECT id, attempts, EXISTS (SELECT 1 FROM job_events WHERE job_id = jobs.id) "
+            "FROM jobs WHERE status = ? AND COALESCE(lease_until, updated_at + ?) < ?",
+            (JOB_RUNNING, self.lease, now),
+        ).fetchall()
+        for job_id, attempts, has_events in rows:
+            if has_events or attempts >= self.max_attempts:
+                logger.warning(f"The worker of the job {job_id} stopped, failing it")
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (JOB_FAILED, "The worker running the job stopped", now, job_id),
+                )
+            else:
+                logger.warning(
+                    f"The worker of the job {job_id} stopped, queuing it again"
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                    (JOB_QUEUED, now, job_id),
+                )
+
+    def add_events(self, job_id: str, events: List[Tuple[int, str]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO job_events VALUES (?, ?, ?)",
+                [(job_id, seq, frame) for seq, frame in events],
+            )
+            self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+            self._conn.execute("COMMIT")
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            # Unless the job's lease expired and it was queued again or failed
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (status, error, time.time(), job_id, JOB_RUNNING),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, error, created_at, updated_at, lease_until "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            zip(
+                ["id", "status", "error", "created_at", "updated_at", "lease_until"],
+                row,
+                strict=True,
+            )
+        )
+
+    def get_events(self, job_id: str, after: int = -1) -> List[Tuple[int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, frame FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after),
+            ).fetchall()
+
+    def delete_expired(self, ttl: float) -> None:
+        """
+        Delete the finished jobs last updated more than `ttl` seconds ago.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            expired = "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?"
+            args = (JOB_COMPLETED, JOB_FAILED, time.time() - ttl)
+            self._conn.execute(
+                f"DELETE FROM job_events WHERE job_id IN ({expired})", args
+            )
+            self._conn.execute(f"DELETE FROM jobs WHERE id IN ({expired})", args)
+            self._conn.execute("COMMIT")
+
+
+_job_store: Optional[JobStore] = None
+_job_store_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    """
+    Get the job store, configured by JOB_DB_PATH, JOB_LEASE (seconds) and JOB_MAX_ATTEMPTS.
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(
+                os.getenv(
+                    "JOB_DB_PATH",
+                    os.path.join(os.getenv("STORAGE_DIR", "storage"), "jobs.sqlite"),
+                ),
+                lease=float(os.getenv("JOB_LEASE", "60")),
+                max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "2")),
+            )
+        return _job_store
+
+
+class JobWorker:
+    """
+    Run the queued chat jobs, at most `concurrency` at a time.
+    The stream frames of a job are stored in batches, every `flush_interval` seconds.
+    The store is opened on first use (not at all without workers), unless one is given.
+    """
+
+    def __init__(
+        self,
+        store: Optional[JobStore] = None,
+        concurrency: int = 2,
+        poll_interval: float = 0.5,
+        flush_interval: float = 0.2,
+        job_ttl: float = 86400,
+    ):
+        self._store = store
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.job_ttl = job_ttl
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            self._store = get_job_store()
+        return self._store
+
+    @classmethod
+    def from_env(cls) -> "JobWorker":
+        return cls(
+            concurrency=int(os.getenv("JOB_WORKERS", "2")),
+            poll_interval=float(os.getenv("JOB_POLL_INTERVAL", "0.5")),
+            job_ttl=float(os.getenv("JOB_TTL", "86400")),
+        )
+
+    def start(self) -> None:
+        """
+        Start the worker loops in the running event loop.
+        """
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f"job-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+        logger.info(f"Started {self.concurrency} job workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim)
+            except Exception as e:
+                logger.error(f"Failed to claim a job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            job_id, payload = job
+            await self._run_job(job_id, payload)
+            try:
+                await asyncio.to_thread(self.store.delete_expired, self.job_ttl)
+            except Exception as e:
+                logger.warning(f"Failed to delete the expired jobs: {e}")
+
+    async def _run_job(self, job_id: str, payload: str) -> None:
+        logger.info(f"Running the job {job_id}")
+        job = asyncio.create_task(self._stream_job(job_id, payload))
+        lease_renewal = asyncio.create_task(self._renew_lease(job_id, job))
+        try:
+            await job
+        except asyncio.CancelledError:
+            # The job is stopped if its lease is lost, the worker goes on
+            if asyncio.current_task().cancelling():  # type: ignore
+                raise
+        finally:
+            lease_renewal.cancel()
+
+    async def _renew_lease(self, job_id: str, job_task: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.store.lease / 3)
+            try:
+                if not await asyncio.to_thread(self.store.renew, job_id):
+                    # The job was queued again or failed, e.g. after the event loop was blocked too long
+                    logger.warning(f"Lost the lease of the job {job_id}, stopping it")
+                    job_task.cancel()
+                    return
+            except Exception as e:
+                logger.warning(f"Failed to renew the lease of the job {job_id}: {e}")
+
+    async def _stream_job(self, job_id: str, payload: str) -> None:
+        from app.api.routers.chat import create_stream_response
+        from app.api.routers.models import ChatData
+
+        pending: List[Tuple[int, str]] = []
+        seq = 0
+        last_flush = time.monotonic()
+
+        async def flush():
+            nonlocal pending, last_flush
+            if pending:
+                events, pending = pending, []
+                await asyncio.to_thread(self.store.add_events, job_id, events)
+            last_flush = time.monotonic()
+
+        try:
+            response = create_stream_response(
+                None, ChatData.model_validate_json(payload)
+            )
+            async for frame in response.body_iterator:
+                pending.append((seq, str(frame)))
+                seq += 1
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    await flush()
+            await flush()
+            await asyncio.to_thread(self.store.finish, job_id, JOB_COMPLETED)
+            logger.info(f"Completed the job {job_id}")
+        except asyncio.CancelledError:
+            await asyncio.to_thread(
+                self.store.finish, job_id, JOB_FAILED, "The worker was stopped"
+            )
+            raise
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            try:
+                await flush()
+            finally:
+                await asyncio.to_thread(self.store.finish, job_id, JOB_FAILED, str(e))
+
+
+def run_worker():
+    """
+    Run the job workers in their own process, e.g. with `poetry run worker`.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    from app.deadline import install_context_executor
+    from app.observability import init_observability
+    from app.settings import init_settings
+
+    init_settings()
+    init_observability()
+
+    async def main():
+        install_context_executor()
+        JobWorker.from_env().start()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
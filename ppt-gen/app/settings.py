@@ -1,20 +1,67 @@
 import os
 from typing import Dict, Optional
 
+from llama_index.core.llms import LLM
 from llama_index.core.multi_modal_llms import MultiModalLLM
 from llama_index.core.settings import Settings
 
 # `Settings` does not support setting `MultiModalLLM`
 # so we use a global variable to store it
 _multi_modal_llm: Optional[MultiModalLLM] = None
+# The LLM of the provider before wrapping it, to create the LLMs of other models
+_base_llm: Optional[LLM] = None
 
 
 def get_multi_modal_llm():
     return _multi_modal_llm
 
 
+def get_base_llm() -> Optional[LLM]:
+    return _base_llm
+
+
+def wrap_llm(llm: LLM, backup_llm: Optional[LLM] = None) -> LLM:
+    """
+    Wrap the LLM of the provider with the hedging, the scheduler, the response cache
+    and the request deadline.
+    """
+    from app.llms.cache import get_cached_llm
+    from app.llms.deadline import DeadlineLLM
+    from app.llms.hedging import get_hedged_llm
+    from app.llms.scheduler import get_scheduled_llm
+
+    # Cached responses don't wait for the scheduler
+    return DeadlineLLM(
+        llm=get_cached_llm(get_scheduled_llm(get_hedged_llm(llm, backup_llm)))
+    )
+
+
+def with_model(llm: LLM, model: str) -> LLM:
+    """
+    Copy the LLM of a provider with another model.
+    """
+    if "model" not in type(llm).model_fields:
+        raise ValueError(f"The LLM {llm.class_name()} doesn't support other models")
+    update = {"model": model}
+    # E.g. Azure OpenAI calls a deployment, the model is the deployment name
+    if "engine" in type(llm).model_fields:
+        update["engine"] = model
+    return llm.model_copy(update=update)
+
+
 def init_settings():
     model_provider = os.getenv("MODEL_PROVIDER")
+    init_provider(model_provider)
+
+    global _base_llm
+    _base_llm = Settings.llm
+    Settings.llm = wrap_llm(Settings.llm, backup_llm=init_hedge_llm())
+
+    Settings.chunk_size = int(os.getenv("CHUNK_SIZE", "1024"))
+    Settings.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "20"))
+
+
+def init_provider(model_provider: Optional[str]):
     match model_provider:
         case "openai":
             init_openai()
@@ -39,8 +86,42 @@ def init_settings():
         case _:
             raise ValueError(f"Invalid model provider: {model_provider}")
 
-    Settings.chunk_size = int(os.getenv("CHUNK_SIZE", "1024"))
-    Settings.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "20"))
+
+def init_hedge_llm() -> Optional[LLM]:
+    """
+    Create the LLM of the backup requests if LLM_HEDGING is true:
+    the LLM_HEDGE_MODEL of the LLM_HEDGE_PROVIDER, defaulting to the configured provider and model.
+    """
+    if os.getenv("LLM_HEDGING", "false").lower() != "true":
+        return None
+    model_provider = os.getenv("MODEL_PROVIDER")
+    hedge_provider = os.getenv("LLM_HEDGE_PROVIDER") or model_provider
+    hedge_model = os.getenv("LLM_HEDGE_MODEL")
+    if hedge_provider == model_provider:
+        return with_model(_base_llm, hedge_model) if hedge_model else _base_llm
+
+    # The provider init functions read the MODEL and set the global settings,
+    # keep the ones of the configured provider
+    global _multi_modal_llm
+    llm, embed_model, multi_modal_llm = (
+        Settings.llm,
+        Settings.embed_model,
+        _multi_modal_llm,
+    )
+    model = os.getenv("MODEL")
+    try:
+        if hedge_model:
+            os.environ["MODEL"] = hedge_model
+        init_provider(hedge_provider)
+        return Settings.llm
+    finally:
+        if model is not None:
+            os.environ["MODEL"] = model
+        else:
+            os.environ.pop("MODEL", None)
+        Settings.llm = llm
+        Settings.embed_model = embed_model
+        _multi_modal_llm = multi_modal_llm
 
 
 def init_ollama():
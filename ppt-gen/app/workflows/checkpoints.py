@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+from cachetools import TTLCache
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.workflow import Context, Event, StopEvent, Workflow
+from llama_index.core.workflow.checkpointer import Checkpoint
+from llama_index.core.workflow.context_serializers import JsonPickleSerializer
+from llama_index.core.workflow.handler import WorkflowHandler
+
+logger = logging.getLogger("uvicorn")
+
+
+class WorkflowRun:
+    """
+    A resumable workflow run.
+
+    The workflow context, memory and stored tool outputs are checkpointed after each step,
+    together with the number of stream frames sent to the client so far. Resuming replays these frames and runs the workflow
+    from the last checkpoint, the work of the step in progress is redone.
+    """
+
+    def __init__(self, chat_data: Any):
+        self.run_id = uuid.uuid4().hex
+        # The chat request, to create the workflow again when resuming
+        self.chat_data = chat_data
+        self.frames: List[str] = []
+        self.completed = False
+        # Whether a client is streaming the run
+        self.active = False
+        self._checkpoint: Optional[Checkpoint] = None
+        self._memory: List[ChatMessage] = []
+        self._tool_outputs: Dict[str, str] = {}
+        self._checkpoint_frames = 0
+        self._serializer = JsonPickleSerializer()
+
+    def add_frame(self, frame: str) -> None:
+        self.frames.append(frame)
+
+    def get_replay_frames(self) -> List[str]:
+        """
+        Get the frames to send again to a resuming client.
+        """
+        if self.completed:
+            return list(self.frames)
+        return self.frames[: self._checkpoint_frames]
+
+    def run(self, workflow: Workflow, **kwargs: Any) -> WorkflowHandler:
+        """
+        Run the workflow with checkpoints, from the last checkpoint if there is one.
+        """
+        checkpoint_callback = self._get_checkpoint_callback(workflow)
+        if self._checkpoint is None:
+            self.frames = []
+            return workflow.run(checkpoint_callback=checkpoint_callback, **kwargs)
+
+        logger.info(
+            f"Resuming the run {self.run_id} after the step {self._checkpoint.last_completed_step}"
+        )
+        memory = getattr(workflow, "memory", None)
+        if memory is not None:
+            memory.set(self._memory)
+        # The memory references the tool outputs offloaded before the checkpoint
+        tool_output_store = getattr(workflow, "tool_output_store", None)
+        if tool_output_store is not None:
+            tool_output_store.set(self._tool_outputs)
+        # The frames sent after the checkpoint are sent again by the resumed run
+        self.frames = self.frames[: self._checkpoint_frames]
+        return workflow.run_from(
+            self._checkpoint,
+            ctx_serializer=self._serializer,
+            checkpoint_callback=checkpoint_callback,
+            **kwargs,
+        )
+
+    def _get_checkpoint_callback(self, workflow: Workflow):
+        async def checkpoint(
+            run_id: str,
+            last_completed_step: Optional[str],
+            input_ev: Optional[Event],
+            output_ev: Event,
+            ctx: Context,
+        ) -> None:
+            # The final event holds the response generator, which can't be resumed
+            if isinstance(output_ev, StopEvent):
+                return
+            try:
+                ctx_state = ctx.to_dict(serializer=self._serializer)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to checkpoint the step {last_completed_step}: {e}"
+                )
+                return
+            self._checkpoint = Checkpoint(
+                last_completed_step=last_completed_step,
+                input_event=input_ev,
+                output_event=output_ev,
+                ctx_state=ctx_state,
+            )
+            memory = getattr(workflow, "memory", None)
+            self._memory = memory.get_all() if memory is not None else []
+            tool_output_store = getattr(workflow, "tool_output_store", None)
+            self._tool_outputs = (
+                tool_output_store.get_all() if tool_output_store is not None else {}
+            )
+            # The events of the step not streamed yet are in the checkpointed context
+            self._checkpoint_frames = len(self.frames)
+
+        return checkpoint
+
+
+class RunStore:
+    """
+    The resumable runs, they expire after `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 100, ttl: float = 3600):
+        self._runs: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def create(self, chat_data: Any) -> WorkflowRun:
+        run = WorkflowRun(chat_data)
+        with self._lock:
+            self._runs[run.run_id] = run
+        return run
+
+    def get(self, run_id: str) -> Optional[WorkflowRun]:
+        with self._lock:
+            return self._runs.get(run_id)
+
+
+_run_store: Optional[RunStore] = None
+_run_store_lock = threading.Lock()
+
+
+def get_run_store() -> RunStore:
+    global _run_store
+    with _run_store_lock:
+        if _run_store is None:
+            _run_store = RunStore(
+                maxsize=int(os.getenv("RUN_STORE_SIZE", "100")),
+                ttl=float(os.getenv("RUN_STORE_TTL", "3600")),
+            )
+        return _run_store
@@ -1,18 +1,25 @@
-from typing import Any, Dict, List, Optional
+import logging
+import os
+from typing import Any, AsyncGenerator, Dict, List, Literal, Optional
 
 from app.engine.index import IndexConfig, get_index
-from app.engine.tools import ToolFactory
+from app.engine.prefetch import RetrievalPrefetcher
+from app.engine.tools import get_tool_registry
 from app.engine.tools.query_engine import get_query_engine_tool
+from app.llms.roles import LLMRole, get_llm
+from app.llms.scheduler import LLMPriority, llm_priority
 from app.workflows.events import AgentRunEvent
+from app.workflows.memory import TokenWindowMemory
+from app.workflows.tool_outputs import ToolOutputStore, offload_tool_messages
 from app.workflows.tools import (
     call_tools,
-    chat_with_tools,
+    chat_with_tools_cascade,
+    schedule_tool_calls,
 )
-from llama_index.core import Settings
-from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
 from llama_index.core.llms.function_calling import FunctionCallingLLM
-from llama_index.core.memory import ChatMemoryBuffer
-from llama_index.core.tools import FunctionTool, QueryEngineTool, ToolSelection
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.tools import BaseTool, FunctionTool, ToolSelection
 from llama_index.core.workflow import (
     Context,
     Event,
@@ -21,11 +28,15 @@ from llama_index.core.workflow import (
     Workflow,
     step,
 )
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger("uvicorn")
 
 
 def create_workflow(
     chat_history: Optional[List[ChatMessage]] = None,
     params: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = 360,
     **kwargs,
 ) -> Workflow:
     # Create query engine tool
@@ -35,9 +46,13 @@ def create_workflow(
         raise ValueError(
             "Index is not found. Try run generation script to create the index first."
         )
-    query_engine_tool = get_query_engine_tool(index=index)
+    # Retrieve for the user's message while the LLM is choosing its tools
+    prefetcher = None
+    if os.getenv("RETRIEVAL_PREFETCH", "true").lower() == "true":
+        prefetcher = RetrievalPrefetcher()
+    query_engine_tool = get_query_engine_tool(index=index, prefetcher=prefetcher)
 
-    configured_tools: Dict[str, FunctionTool] = ToolFactory.from_env(map_result=True)  # type: ignore
+    configured_tools: Dict[str, FunctionTool] = get_tool_registry().get_tools(map_result=True)  # type: ignore
     code_interpreter_tool = configured_tools.get("interpret")
     document_generator_tool = configured_tools.get("generate_document")
 
@@ -46,6 +61,9 @@ def create_workflow(
         code_interpreter_tool=code_interpreter_tool,
         document_generator_tool=document_generator_tool,
         chat_history=chat_history,
+        plan_mode=os.getenv("REPORT_PLAN_MODE", "false").lower() == "true",
+        retrieval_prefetcher=prefetcher,
+        timeout=timeout,
     )
 
 
@@ -66,6 +84,48 @@ class ReportEvent(Event):
     input: list[ToolSelection]
 
 
+class MultipleToolsEvent(Event):
+    input: list[ToolSelection]
+
+
+class ReadToolOutputEvent(Event):
+    input: list[ToolSelection]
+
+
+class ReportPlan(BaseModel):
+    """
+    A plan to answer the user's request in one pass.
+    """
+
+    queries: List[str] = Field(
+        description="Independent queries to search the indexed documents for the information needed",
+    )
+    analysis: Optional[str] = Field(
+        default=None,
+        description="Calculations or visualizations to do with the code interpreter on the research result, null if not needed",
+    )
+    document_type: Optional[Literal["pdf", "html"]] = Field(
+        default=None,
+        description="Type of the document file to generate, null if the user didn't ask for a file",
+    )
+    file_name: Optional[str] = Field(
+        default=None,
+        description="Name of the document file without extension, only letters, digits and underscores",
+    )
+
+
+class PlanEvent(Event):
+    error: Optional[str] = None
+
+
+class ExecutePlanEvent(Event):
+    plan: ReportPlan
+
+
+class WriteReportEvent(Event):
+    plan: ReportPlan
+
+
 class FinancialReportWorkflow(Workflow):
     """
     A workflow to generate a financial report using indexed documents.
@@ -84,6 +144,13 @@ class FinancialReportWorkflow(Workflow):
     3. Analyze: Uses a custom prompt to analyze research results and can call the code
        interpreter tool for visualization or calculation. Returns results to the LLM.
     4. Report: Uses the document generator tool to create a report. Returns results to the LLM.
+    If the LLM calls different tools at once, they are scheduled together:
+    independent calls run concurrently and the report is generated last.
+
+    In plan mode, a single planning call decides the queries, the analysis and the document output.
+    The queries run in parallel, then an optional analysis call and the final report are streamed,
+    the document is generated from the streamed report.
+    If planning or research fails, it re-plans once and then falls back to the steps above.
     """
 
     _default_system_prompt = """
@@ -92,18 +159,40 @@ class FinancialReportWorkflow(Workflow):
     For the query engine tool, you should break down the user request into a list of queries and call the tool with the queries.
     """
 
+    _plan_prompt = PromptTemplate(
+        """
+    You are a financial analyst planning how to answer the user request below with these steps:
+    1. Research: search the indexed documents with a list of independent queries (all run in parallel).
+    2. Analysis (optional): calculations or charts made with a code interpreter on the research result.
+    3. Report: a markdown answer, optionally saved as a PDF or HTML document if the user asked for a file.
+
+    Conversation:
+    {chat_history}
+    {error}
+    Make the plan for the last user request.
+    """
+    )
+
+    _max_plan_attempts = 2
+
     def __init__(
         self,
-        query_engine_tool: QueryEngineTool,
+        query_engine_tool: BaseTool,
         code_interpreter_tool: FunctionTool,
         document_generator_tool: FunctionTool,
         llm: Optional[FunctionCallingLLM] = None,
-        timeout: int = 360,
+        router_llm: Optional[FunctionCallingLLM] = None,
+        analyst_llm: Optional[FunctionCallingLLM] = None,
+        timeout: Optional[float] = 360,
         chat_history: Optional[List[ChatMessage]] = None,
         system_prompt: Optional[str] = None,
+        plan_mode: bool = False,
+        retrieval_prefetcher: Optional[RetrievalPrefetcher] = None,
     ):
         super().__init__(timeout=timeout)
         self.system_prompt = system_prompt or self._default_system_prompt
+        self.plan_mode = plan_mode
+        self.retrieval_prefetcher = retrieval_prefetcher
         self.chat_history = chat_history or []
         self.query_engine_tool = query_engine_tool
         self.code_interpreter_tool = code_interpreter_tool
@@ -115,19 +204,36 @@ class FinancialReportWorkflow(Workflow):
         assert (
             document_generator_tool is not None
         ), "Document generator tool is required"
+        # Large tool outputs of the run are stored outside of the memory, the LLM can read them with this tool
+        self.tool_output_store = ToolOutputStore.from_env()
+        self.read_tool_output_tool = self.tool_output_store.get_read_tool()
         self.tools = [
             self.query_engine_tool,
             self.code_interpreter_tool,
             self.document_generator_tool,
+            self.read_tool_output_tool,
         ]
-        self.llm: FunctionCallingLLM = llm or Settings.llm
+        # The strong LLM writes the answers, the faster router and analyst LLMs escalate to it
+        self.llm: FunctionCallingLLM = llm or get_llm(  # type: ignore
+            LLMRole.SYNTHESIZER
+        )
+        self.router_llm: FunctionCallingLLM = router_llm or get_llm(  # type: ignore
+            LLMRole.ROUTER, default=self.llm
+        )
+        self.analyst_llm: FunctionCallingLLM = analyst_llm or get_llm(  # type: ignore
+            LLMRole.ANALYST, default=self.llm
+        )
         assert isinstance(self.llm, FunctionCallingLLM)
-        self.memory = ChatMemoryBuffer.from_defaults(
+        assert isinstance(self.router_llm, FunctionCallingLLM)
+        assert isinstance(self.analyst_llm, FunctionCallingLLM)
+        self.memory = TokenWindowMemory.from_defaults(
             llm=self.llm, chat_history=self.chat_history
         )
 
     @step()
-    async def prepare_chat_history(self, ctx: Context, ev: StartEvent) -> InputEvent:
+    async def prepare_chat_history(
+        self, ctx: Context, ev: StartEvent
+    ) -> InputEvent | PlanEvent:
         ctx.data["input"] = ev.input
 
         if self.system_prompt:
@@ -139,6 +245,187 @@ class FinancialReportWorkflow(Workflow):
         # Add user input to memory
         self.memory.put(ChatMessage(role=MessageRole.USER, content=ev.input))
 
+        # Most requests start with a research, start retrieving for the user's message right away
+        if self.retrieval_prefetcher is not None:
+            self.retrieval_prefetcher.prefetch(ev.input)
+
+        if self.plan_mode:
+            return PlanEvent()
+        return InputEvent(input=self.memory.get())
+
+    @step()
+    async def plan(self, ctx: Context, ev: PlanEvent) -> ExecutePlanEvent | InputEvent:
+        """
+        Plan the research, analysis and report with a single LLM call.
+        """
+        ctx.data["plan_attempts"] = ctx.data.get("plan_attempts", 0) + 1
+        ctx.write_event_to_stream(AgentRunEvent(name="Planner", msg="Planning"))
+        chat_history = "\n".join(
+            f"{message.role.value}: {message.content}"
+            for message in self.memory.get()
+            if message.role in (MessageRole.USER, MessageRole.ASSISTANT)
+            and message.content
+        )
+        # A failed plan of the router LLM is retried with the strong LLM
+        llm = self.router_llm if ctx.data["plan_attempts"] == 1 else self.llm
+        try:
+            plan = await llm.astructured_predict(
+                ReportPlan,
+                self._plan_prompt,
+                chat_history=chat_history,
+                error=f"The previous plan failed: {ev.error}\n" if ev.error else "",
+            )
+        except Exception as e:
+            logger.warning(f"Failed to plan the report: {e}")
+            return self._replan_or_fallback(ctx, str(e))
+
+        if not plan.queries:
+            return self._replan_or_fallback(ctx, "The plan has no queries.")
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name="Planner",
+                msg=f"Planned {len(plan.queries)} queries"
+                + (", an analysis" if plan.analysis else "")
+                + (
+                    f" and a {plan.document_type} document"
+                    if plan.document_type
+                    else ""
+                ),
+            )
+        )
+        return ExecutePlanEvent(plan=plan)
+
+    @step()
+    async def execute_plan(
+        self, ctx: Context, ev: ExecutePlanEvent
+    ) -> WriteReportEvent | PlanEvent | InputEvent:
+        """
+        Run the planned queries in parallel, then the optional analysis.
+        """
+        plan = ev.plan
+        tool_name = self.query_engine_tool.metadata.get_name()
+        tool_messages = await call_tools(
+            ctx=ctx,
+            agent_name="Researcher",
+            tools=[self.query_engine_tool],
+            tool_calls=[
+                ToolSelection(
+                    tool_id=f"plan_query_{i}",
+                    tool_name=tool_name,
+                    tool_kwargs={"input": query},
+                )
+                for i, query in enumerate(plan.queries)
+            ],
+        )
+        self._stop_prefetching()
+        results = [
+            (query, str(message.content))
+            for query, message in zip(plan.queries, tool_messages)
+            if not str(message.content).startswith("Error:")
+        ]
+        if not results:
+            return self._replan_or_fallback(ctx, str(tool_messages[0].content))
+        # The research is added as a plain message as there is no tool call message for it
+        self.memory.put(
+            ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content="Research result:\n\n"
+                + "\n\n".join(f"### {query}\n{result}" for query, result in results),
+            )
+        )
+
+        if plan.analysis:
+            ctx.write_event_to_stream(
+                AgentRunEvent(name="Analyst", msg="Starting analysis")
+            )
+            chat_history = self.memory.get()
+            chat_history.append(
+                ChatMessage(
+                    role=MessageRole.USER,
+                    content=f"Use the code interpreter tool on the research result to do this analysis: {plan.analysis}",
+                )
+            )
+            response = await chat_with_tools_cascade(
+                self.analyst_llm,
+                [self.code_interpreter_tool],
+                chat_history,
+                strong_llm=self.llm,
+                allow_parallel_tool_calls=True,
+            )
+            if response.has_tool_calls():
+                self.memory.put(response.tool_call_message)
+                self.memory.put_messages(
+                    await call_tools(
+                        ctx=ctx,
+                        agent_name="Analyst",
+                        tools=[self.code_interpreter_tool],
+                        tool_calls=response.tool_calls,  # type: ignore
+                    )
+                )
+            else:
+                self.memory.put(
+                    ChatMessage(
+                        role=MessageRole.ASSISTANT,
+                        content=await response.full_response(),
+                    )
+                )
+        return WriteReportEvent(plan=plan)
+
+    @step()
+    async def write_report(self, ctx: Context, ev: WriteReportEvent) -> StopEvent:
+        """
+        Stream the final report and generate the planned document from it.
+        """
+        ctx.write_event_to_stream(
+            AgentRunEvent(name="Reporter", msg="Writing the report")
+        )
+        chat_history = self.memory.get()
+        chat_history.append(
+            ChatMessage(
+                role=MessageRole.USER,
+                content="Write the final report in markdown for my request using the research and analysis above. "
+                "Include the URLs of the generated charts as markdown images.",
+            )
+        )
+        with llm_priority(LLMPriority.FINAL_ANSWER):
+            response_stream = await self.llm.astream_chat(chat_history)
+        return StopEvent(result=self._stream_report(response_stream, ev.plan))
+
+    async def _stream_report(
+        self,
+        response_stream: AsyncGenerator[ChatResponse, None],
+        plan: ReportPlan,
+    ) -> AsyncGenerator[ChatResponse, None]:
+        response = None
+        async for response in response_stream:
+            yield response
+        if response is None or not plan.document_type:
+            return
+
+        report = response.message.content or ""
+        try:
+            tool_output = await self.document_generator_tool.acall(
+                original_content=report,
+                document_type=plan.document_type,
+                file_name=plan.file_name or "report",
+            )
+            delta = f"\n\nDownload the report: [{plan.file_name or 'report'}.{plan.document_type}]({tool_output.raw_output})"
+        except Exception as e:
+            logger.error(f"Failed to generate the report document: {e}")
+            delta = f"\n\nFailed to generate the report document: {e}"
+        yield ChatResponse(
+            message=ChatMessage(role=MessageRole.ASSISTANT, content=report + delta),
+            delta=delta,
+        )
+
+    def _stop_prefetching(self) -> None:
+        if self.retrieval_prefetcher is not None:
+            self.retrieval_prefetcher.cancel()
+
+    def _replan_or_fallback(self, ctx: Context, error: str) -> PlanEvent | InputEvent:
+        if ctx.data["plan_attempts"] < self._max_plan_attempts:
+            return PlanEvent(error=error)
+        logger.warning("Planning failed, falling back to step by step tool calling")
         return InputEvent(input=self.memory.get())
 
     @step()
@@ -146,33 +433,48 @@ class FinancialReportWorkflow(Workflow):
         self,
         ctx: Context,
         ev: InputEvent,
-    ) -> ResearchEvent | AnalyzeEvent | ReportEvent | StopEvent:
+    ) -> (
+        ResearchEvent
+        | AnalyzeEvent
+        | ReportEvent
+        | MultipleToolsEvent
+        | ReadToolOutputEvent
+        | StopEvent
+    ):
         """
         Handle an LLM input and decide the next step.
         """
         # Always use the latest chat history from the input
         chat_history: list[ChatMessage] = ev.input
 
-        # Get tool calls
-        response = await chat_with_tools(
-            self.llm,
-            self.tools,  # type: ignore
-            chat_history,
+        # After the tool calls, the LLM most likely writes the final answer
+        is_answering = bool(chat_history) and chat_history[-1].role == MessageRole.TOOL
+        priority = (
+            LLMPriority.FINAL_ANSWER if is_answering else LLMPriority.TOOL_SELECTION
         )
+        # Get tool calls
+        with llm_priority(priority):
+            response = await chat_with_tools_cascade(
+                # The answers are written by the strong LLM, don't ask the router first
+                self.llm if is_answering else self.router_llm,
+                self.tools,  # type: ignore
+                chat_history,
+                strong_llm=self.llm,
+                answer_with_strong_llm=True,
+                allow_parallel_tool_calls=True,
+            )
+        if not response.has_tool_calls() or all(
+            tool_call.tool_name != self.query_engine_tool.metadata.name
+            for tool_call in response.tool_calls
+        ):
+            # The prefetched nodes are only used by a research started by the first LLM call
+            self._stop_prefetching()
         if not response.has_tool_calls():
             # If no tool call, return the response generator
             return StopEvent(result=response.generator)
-        # calling different tools at the same time is not supported at the moment
-        # add an error message to tell the AI to process step by step
-        if response.is_calling_different_tools():
-            self.memory.put(
-                ChatMessage(
-                    role=MessageRole.ASSISTANT,
-                    content="Cannot call different tools at the same time. Try calling one tool at a time.",
-                )
-            )
-            return InputEvent(input=self.memory.get())
         self.memory.put(response.tool_call_message)
+        if response.is_calling_different_tools():
+            return MultipleToolsEvent(input=response.tool_calls)
         match response.tool_name():
             case self.code_interpreter_tool.metadata.name:
                 return AnalyzeEvent(input=response.tool_calls)
@@ -180,6 +482,8 @@ class FinancialReportWorkflow(Workflow):
                 return ReportEvent(input=response.tool_calls)
             case self.query_engine_tool.metadata.name:
                 return ResearchEvent(input=response.tool_calls)
+            case self.read_tool_output_tool.metadata.name:
+                return ReadToolOutputEvent(input=response.tool_calls)
             case _:
                 raise ValueError(f"Unknown tool: {response.tool_name()}")
 
@@ -203,7 +507,10 @@ class FinancialReportWorkflow(Workflow):
             tools=[self.query_engine_tool],
             tool_calls=tool_calls,
         )
-        self.memory.put_messages(tool_messages)
+        self._stop_prefetching()
+        self.memory.put_messages(
+            offload_tool_messages(tool_messages, self.tool_output_store)
+        )
         return AnalyzeEvent(
             input=ChatMessage(
                 role=MessageRole.ASSISTANT,
@@ -243,10 +550,12 @@ class FinancialReportWorkflow(Workflow):
             )
             chat_history.append(ev.input)  # type: ignore
             # Check if the analyst agent needs to call tools
-            response = await chat_with_tools(
-                self.llm,
-                [self.code_interpreter_tool],
+            response = await chat_with_tools_cascade(
+                self.analyst_llm,
+                [self.code_interpreter_tool, self.read_tool_output_tool],
                 chat_history,
+                strong_llm=self.llm,
+                allow_parallel_tool_calls=True,
             )
             if not response.has_tool_calls():
                 # If no tool call, fallback analyst message to the workflow
@@ -265,14 +574,63 @@ class FinancialReportWorkflow(Workflow):
         tool_messages = await call_tools(
             ctx=ctx,
             agent_name="Analyst",
-            tools=[self.code_interpreter_tool],
+            tools=[self.code_interpreter_tool, self.read_tool_output_tool],
             tool_calls=tool_calls,  # type: ignore
         )
-        self.memory.put_messages(tool_messages)
+        self.memory.put_messages(
+            offload_tool_messages(tool_messages, self.tool_output_store)
+        )
 
         # Fallback to the input with the latest chat history
         return InputEvent(input=self.memory.get())
 
+    @step()
+    async def call_multiple_tools(
+        self, ctx: Context, ev: MultipleToolsEvent
+    ) -> InputEvent:
+        """
+        Run the calls of different tools requested in one LLM turn.
+        """
+        tool_messages = await schedule_tool_calls(
+            ctx=ctx,
+            tools=self.tools,  # type: ignore
+            tool_calls=ev.input,
+            agent_names={
+                self.query_engine_tool.metadata.name: "Researcher",
+                self.code_interpreter_tool.metadata.name: "Analyst",
+                self.document_generator_tool.metadata.name: "Reporter",
+            },
+            # The document can reference files produced by the other tools, run it last
+            dependencies={
+                self.document_generator_tool.metadata.name: {
+                    self.query_engine_tool.metadata.name,
+                    self.code_interpreter_tool.metadata.name,
+                },
+            },
+        )
+        self._stop_prefetching()
+        self.memory.put_messages(
+            offload_tool_messages(tool_messages, self.tool_output_store)
+        )
+        return InputEvent(input=self.memory.get())
+
+    @step()
+    async def read_tool_output(
+        self, ctx: Context, ev: ReadToolOutputEvent
+    ) -> InputEvent:
+        """
+        Read the full output of previous tool calls from the tool output store.
+        """
+        tool_messages = await call_tools(
+            ctx=ctx,
+            agent_name="Assistant",
+            tools=[self.read_tool_output_tool],
+            tool_calls=ev.input,
+            emit_agent_events=False,
+        )
+        self.memory.put_messages(tool_messages)
+        return InputEvent(input=self.memory.get())
+
     @step()
     async def report(self, ctx: Context, ev: ReportEvent) -> InputEvent:
         """
@@ -291,7 +649,9 @@ class FinancialReportWorkflow(Workflow):
             tools=[self.document_generator_tool],
             tool_calls=tool_calls,
         )
-        self.memory.put_messages(tool_messages)
+        self.memory.put_messages(
+            offload_tool_messages(tool_messages, self.tool_output_store)
+        )
 
         # After the tool calls, fallback to the input with the latest chat history
         return InputEvent(input=self.memory.get())
@@ -1,10 +1,10 @@
 from typing import Any, List, Optional
 
 from app.workflows.events import AgentRunEvent
+from app.workflows.memory import TokenWindowMemory
 from app.workflows.tools import ToolCallResponse, call_tools, chat_with_tools
 from llama_index.core.base.llms.types import ChatMessage
 from llama_index.core.llms.function_calling import FunctionCallingLLM
-from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.settings import Settings
 from llama_index.core.tools.types import BaseTool
 from llama_index.core.workflow import (
@@ -57,7 +57,7 @@ class FunctionCallingAgent(Workflow):
 
         self.system_prompt = system_prompt
 
-        self.memory = ChatMemoryBuffer.from_defaults(
+        self.memory = TokenWindowMemory.from_defaults(
             llm=self.llm, chat_history=chat_history
         )
         self.sources = []  # type: ignore
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, List, Optional
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory.chat_memory_buffer import DEFAULT_TOKEN_LIMIT_RATIO
+from llama_index.core.memory.types import BaseMemory
+from llama_index.core.utils import get_tokenizer
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_TOKEN_LIMIT = 3000
+
+SUMMARY_PROMPT = """
+Summarize the conversation below for the assistant continuing it.
+Keep the facts, numbers, file URLs and open questions, drop the small talk.
+"""
+
+
+class TokenWindowMemory(BaseMemory):
+    """
+    A chat memory keeping the latest messages within a token limit, like `ChatMemoryBuffer`,
+    but counting the tokens of each message only once when it's added.
+
+    The window start only moves forward, so adding messages and getting the history
+    costs O(new messages) instead of re-tokenizing the whole history on every `get`.
+
+    If `summary_threshold` is set, once the window exceeds this ratio of the token limit,
+    the oldest turns are summarized in the background and replaced by their summary.
+    """
+
+    token_limit: int = Field(default=DEFAULT_TOKEN_LIMIT, gt=0)
+    summary_threshold: Optional[float] = Field(
+        default=None,
+        description="Ratio of the token limit from which the oldest turns are summarized",
+    )
+    tokenizer_fn: Callable[[str], List] = Field(
+        default_factory=get_tokenizer, exclude=True
+    )
+    llm: Optional[LLM] = Field(
+        default=None, exclude=True, description="LLM to summarize the oldest turns"
+    )
+
+    _messages: List[ChatMessage] = PrivateAttr(default_factory=list)
+    _token_counts: List[int] = PrivateAttr(default_factory=list)
+    # Index of the first message in the window and the token count of the window
+    _start: int = PrivateAttr(default=0)
+    _window_tokens: int = PrivateAttr(default=0)
+    _summary: Optional[ChatMessage] = PrivateAttr(default=None)
+    _summary_tokens: int = PrivateAttr(default=0)
+    _summary_task: Optional[asyncio.Task] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "TokenWindowMemory"
+
+    @classmethod
+    def from_defaults(
+        cls,
+        chat_history: Optional[List[ChatMessage]] = None,
+        llm: Optional[LLM] = None,
+        token_limit: Optional[int] = None,
+        tokenizer_fn: Optional[Callable[[str], List]] = None,
+        summary_threshold: Optional[float] = None,
+        **kwargs: Any,
+    ) -> "TokenWindowMemory":
+        """
+        Create the memory for an LLM, the summary threshold defaults to the MEMORY_SUMMARY_THRESHOLD environment variable.
+        """
+        if kwargs:
+            raise ValueError(f"Unexpected kwargs: {kwargs}")
+        if llm is not None:
+            token_limit = token_limit or int(
+                llm.metadata.context_window * DEFAULT_TOKEN_LIMIT_RATIO
+            )
+        if summary_threshold is None and os.getenv("MEMORY_SUMMARY_THRESHOLD"):
+            summary_threshold = float(os.environ["MEMORY_SUMMARY_THRESHOLD"])
+
+        memory = cls(
+            token_limit=token_limit or DEFAULT_TOKEN_LIMIT,
+            tokenizer_fn=tokenizer_fn or get_tokenizer(),
+            llm=llm,
+            summary_threshold=summary_threshold,
+        )
+        memory.put_messages(chat_history or [])
+        return memory
+
+    def _count_tokens(self, message: ChatMessage) -> int:
+        return len(self.tokenizer_fn(str(message.content or "")))
+
+    def get(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        """Get the chat history in the token window."""
+        window = self._messages[self._start :]
+        if self._window_tokens + self._summary_tokens > self.token_limit or (
+            self._start > 0
+            and window[0].role in (MessageRole.TOOL, MessageRole.ASSISTANT)
+        ):
+            # A single message (or tool call) is longer than the token limit
+            return []
+        if self._summary is not None:
+            return [self._summary, *window]
+        return window
+
+    def get_all(self) -> List[ChatMessage]:
+        return list(self._messages)
+
+    def put(self, message: ChatMessage) -> None:
+        token_count = self._count_tokens(message)
+        self._messages.append(message)
+        self._token_counts.append(token_count)
+        self._window_tokens += token_count
+        self._trim()
+        self._maybe_summarize()
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        self.reset()
+        self.put_messages(messages)
+
+    def reset(self) -> None:
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
+        self._messages = []
+        self._token_counts = []
+        self._start = 0
+        self._window_tokens = 0
+        self._summary = None
+        self._summary_tokens = 0
+
+    def _drop_until(self, index: int) -> None:
+        while self._start < index:
+            self._window_tokens -= self._token_counts[self._start]
+            self._start += 1
+
+    def _trim(self) -> None:
+        """
+        Drop the oldest messages until the window fits in the token limit.
+        The window can't start with an assistant or tool message (tool messages need their tool call message).
+        """
+        last = len(self._messages) - 1
+        while (
+            self._window_tokens + self._summary_tokens > self.token_limit
+            and self._start < last
+        ):
+            self._drop_until(self._start + 1)
+        # Also fixes a window left on an assistant or tool message when it was the last message
+        while (
+            self._start > 0
+            and self._start < last
+            and self._messages[self._start].role
+            in (MessageRole.TOOL, MessageRole.ASSISTANT)
+        ):
+            self._drop_until(self._start + 1)
+
+    def _maybe_summarize(self) -> None:
+        if (
+            self.llm is None
+            or self.summary_threshold is None
+            or self._summary_task is not None
+            or self._window_tokens + self._summary_tokens
+            < self.summary_threshold * self.token_limit
+        ):
+            return
+        # Summarize about the oldest half of the window, ending before a user message
+        # and without the system messages (e.g. the workflow's system prompt)
+        end = self._start
+        tokens = 0
+        for i in range(self._start, len(self._messages)):
+            if self._messages[i].role == MessageRole.SYSTEM:
+                break
+            if self._messages[i].role == MessageRole.USER and tokens > 0:
+                end = i
+                if tokens >= self._window_tokens / 2:
+                    break
+            tokens += self._token_counts[i]
+        if end <= self._start:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Only summarize in the background of a running workflow
+            return
+        self._summary_task = loop.create_task(self._summarize(self._start, end))
+
+    async def _summarize(self, start: int, end: int) -> None:
+        transcript = "\n".join(
+            f"{message.role.value}: {message.content}"
+            for message in ([self._summary] if self._summary else [])
+            + self._messages[start:end]
+        )
+        try:
+            response = await self.llm.achat(  # type: ignore
+                [
+                    ChatMessage(role=MessageRole.SYSTEM, content=SUMMARY_PROMPT),
+                    ChatMessage(role=MessageRole.USER, content=transcript),
+                ]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to summarize the chat history: {e}")
+            return
+        finally:
+            self._summary_task = None
+
+        summary = ChatMessage(
+            role=MessageRole.SYSTEM,
+            content=f"Summary of the earlier conversation:\n{response.message.content}",
+        )
+        # The window may have moved on while summarizing, the summary still covers the dropped turns
+        self._drop_until(end)
+        self._summary = summary
+        self._summary_tokens = self._count_tokens(summary)
+        self._trim()
+        logger.info(
+            f"Summarized {end - start} messages, the memory window has {self._window_tokens + self._summary_tokens} tokens"
+        )
@@ -0,0 +1,169 @@
+import os
+import threading
+import uuid
+from typing import Dict, List, Optional
+
+from cachetools import LRUCache
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.tools import FunctionTool
+from llama_index.core.utils import get_tokenizer
+
+READ_TOOL_OUTPUT_TOOL_NAME = "read_tool_output"
+
+_MAX_LINE_LENGTH = 200
+
+
+class ToolOutputStore:
+    """
+    A side store for the large tool outputs of a workflow run,
+    so the workflow memory only keeps a reference and an excerpt.
+    It holds at most `max_chars` characters, the least recently read outputs are evicted first.
+    """
+
+    def __init__(self, max_chars: int = 2_000_000):
+        self._outputs: LRUCache = LRUCache(maxsize=max_chars, getsizeof=len)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ToolOutputStore":
+        return cls(max_chars=int(os.getenv("TOOL_OUTPUT_STORE_MAX_CHARS", "2000000")))
+
+    def put(self, content: str) -> Optional[str]:
+        """
+        Store an output, returns its id or None if it's larger than the store.
+        """
+        if len(content) > self._outputs.maxsize:
+            return None
+        output_id = f"output_{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self._outputs[output_id] = content
+        return output_id
+
+    def get(self, output_id: str) -> Optional[str]:
+        with self._lock:
+            return self._outputs.get(output_id)
+
+    def get_all(self) -> Dict[str, str]:
+        """
+        Get the stored outputs, e.g. to checkpoint them with the workflow memory.
+        """
+        with self._lock:
+            return dict(self._outputs)
+
+    def set(self, outputs: Dict[str, str]) -> None:
+        with self._lock:
+            self._outputs.clear()
+            for output_id, content in outputs.items():
+                self._outputs[output_id] = content
+
+    def read_tool_output(self, output_id: str) -> str:
+        """
+        Read the full output of a previous tool call that was stored because it was too long.
+        Only use it when the excerpt of the output doesn't contain the information you need.
+
+        Parameters:
+            output_id (str): The id of the stored output, e.g. output_1234abcd5678
+        """
+        content = self.get(output_id)
+        if content is None:
+            raise ValueError(f"The tool output {output_id} is not found.")
+        return content
+
+    def get_read_tool(self) -> FunctionTool:
+        return FunctionTool.from_defaults(
+            self.read_tool_output, name=READ_TOOL_OUTPUT_TOOL_NAME
+        )
+
+
+def _excerpt(lines: List[str], token_counts: List[int], budget: int) -> str:
+    """
+    Keep the first and last lines of the output within the token budget,
+    the end of an output usually holds the result or the error.
+    """
+    head: List[str] = []
+    tail: List[str] = []
+    used_tokens = 0
+    i, j = 0, len(lines) - 1
+    while i <= j:
+        # Alternate between the head and the tail, preferring the head
+        take_head = len(head) <= len(tail) * 2
+        index = i if take_head else j
+        if used_tokens + token_counts[index] > budget:
+            break
+        used_tokens += token_counts[index]
+        if take_head:
+            head.append(lines[i])
+            i += 1
+        else:
+            tail.insert(0, lines[j])
+            j -= 1
+    omitted = j - i + 1
+    if omitted <= 0:
+        return "\n".join(head + tail)
+    return "\n".join(head + [f"[... {omitted} lines omitted ...]"] + tail)
+
+
+def offload_tool_messages(
+    messages: List[ChatMessage],
+    store: ToolOutputStore,
+    max_tokens: Optional[int] = None,
+    excerpt_tokens: Optional[int] = None,
+) -> List[ChatMessage]:
+    """
+    Replace the content of tool messages longer than `max_tokens` (TOOL_OUTPUT_OFFLOAD_TOKENS)
+    with a reference to the full output in the store and an excerpt of its first and last lines
+    of `excerpt_tokens` (TOOL_OUTPUT_EXCERPT_TOKENS).
+    The LLM can read the full output with the read_tool_output tool of the store.
+    """
+    if max_tokens is None:
+        max_tokens = int(os.getenv("TOOL_OUTPUT_OFFLOAD_TOKENS", "2000"))
+    if excerpt_tokens is None:
+        excerpt_tokens = int(os.getenv("TOOL_OUTPUT_EXCERPT_TOKENS", "300"))
+    if max_tokens <= 0:
+        return messages
+
+    tokenizer = get_tokenizer()
+    offloaded_messages = []
+    for message in messages:
+        content = str(message.content or "")
+        if (
+            message.role != MessageRole.TOOL
+            or message.additional_kwargs.get("name") == READ_TOOL_OUTPUT_TOOL_NAME
+            # Cheap check first, a token is at least one character
+            or len(content) <= max_tokens
+        ):
+            offloaded_messages.append(message)
+            continue
+        # Split long lines (e.g. serialized objects) so the excerpt can include parts of them
+        lines = [
+            line[start : start + _MAX_LINE_LENGTH]
+            for line in content.splitlines()
+            for start in range(0, max(len(line), 1), _MAX_LINE_LENGTH)
+        ]
+        token_counts = [len(tokenizer(line)) for line in lines]
+        total_tokens = sum(token_counts)
+        if total_tokens <= max_tokens:
+            offloaded_messages.append(message)
+            continue
+
+        excerpt = _excerpt(lines, token_counts, excerpt_tokens)
+        output_id = store.put(content)
+        if output_id is None:
+            content = (
+                f"The output ({total_tokens} tokens) is too long to be kept, "
+                f"here are its first and last lines:\n{excerpt}"
+            )
+        else:
+            content = (
+                f"The output ({total_tokens} tokens) is stored as {output_id}, "
+                f"here are its first and last lines:\n{excerpt}\n"
+                f"Call the {READ_TOOL_OUTPUT_TOOL_NAME} tool with output_id={output_id} if you need the full output."
+            )
+        offloaded_messages.append(
+            ChatMessage(
+                role=message.role,
+                content=content,
+                additional_kwargs=message.additional_kwargs,
+            )
+        )
+    return offloaded_messages
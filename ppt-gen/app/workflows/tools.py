@@ -1,8 +1,16 @@
+import asyncio
 import logging
+import os
 import uuid
 from abc import ABC, abstractmethod
 from typing import Any, AsyncGenerator, Callable, Optional
 
+from app.deadline import (
+    DeadlineExceededError,
+    get_deadline,
+    wait_with_deadline,
+)
+from app.llms.roles import is_escalation_enabled
 from app.workflows.events import AgentRunEvent, AgentRunEventType
 from llama_index.core.base.llms.types import ChatMessage, ChatResponse, MessageRole
 from llama_index.core.llms.function_calling import FunctionCallingLLM
@@ -13,10 +21,13 @@ from llama_index.core.tools import (
     ToolSelection,
 )
 from llama_index.core.workflow import Context
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, ValidationError
 
 logger = logging.getLogger("uvicorn")
 
+# Tools whose calls must not overlap by default
+_SEQUENTIAL_TOOLS = {"interpret"}
+
 
 class ContextAwareTool(FunctionTool, ABC):
     @abstractmethod
@@ -59,12 +70,15 @@ async def chat_with_tools(  # type: ignore
     llm: FunctionCallingLLM,
     tools: list[BaseTool],
     chat_history: list[ChatMessage],
+    allow_parallel_tool_calls: bool = False,
 ) -> ChatWithToolsResponse:
     """
     Request LLM to call tools or not.
     This function doesn't change the memory.
     """
-    generator = _tool_call_generator(llm, tools, chat_history)
+    generator = _tool_call_generator(
+        llm, tools, chat_history, allow_parallel_tool_calls
+    )
     is_tool_call = await generator.__anext__()
     if is_tool_call:
         # Last chunk is the full response
@@ -86,6 +100,75 @@ async def chat_with_tools(  # type: ignore
         )
 
 
+async def chat_with_tools_cascade(
+    llm: FunctionCallingLLM,
+    tools: list[BaseTool],
+    chat_history: list[ChatMessage],
+    strong_llm: Optional[FunctionCallingLLM] = None,
+    answer_with_strong_llm: bool = False,
+    allow_parallel_tool_calls: bool = False,
+) -> ChatWithToolsResponse:
+    """
+    Request a fast LLM to call tools, escalating to the strong LLM when the fast LLM fails
+    or its tool calls are invalid (disabled by LLM_ESCALATION=false).
+    With `answer_with_strong_llm`, a response without tool calls is written by the strong LLM instead.
+    """
+    if strong_llm is None or strong_llm is llm:
+        return await chat_with_tools(
+            llm, tools, chat_history, allow_parallel_tool_calls
+        )
+    escalate = is_escalation_enabled()
+    try:
+        response = await chat_with_tools(
+            llm, tools, chat_history, allow_parallel_tool_calls
+        )
+    except Exception as e:
+        if not escalate:
+            raise
+        logger.warning(f"Escalating the tool calling to the strong LLM: {e}")
+        return await chat_with_tools(
+            strong_llm, tools, chat_history, allow_parallel_tool_calls
+        )
+
+    if response.tool_calls is not None:
+        error = validate_tool_calls(tools, response.tool_calls)
+        if error is None or not escalate:
+            return response
+        logger.warning(f"Escalating the tool calling to the strong LLM: {error}")
+    elif answer_with_strong_llm:
+        # Only the first chunk of the fast LLM's answer was read
+        await response.generator.aclose()  # type: ignore
+    else:
+        return response
+    return await chat_with_tools(
+        strong_llm, tools, chat_history, allow_parallel_tool_calls
+    )
+
+
+def validate_tool_calls(
+    tools: list[BaseTool], tool_calls: list[ToolSelection]
+) -> Optional[str]:
+    """
+    Check that the tool calls exist and their arguments match the tool schemas.
+    Returns the error of the first invalid tool call.
+    """
+    if not tool_calls:
+        return "The response has no valid tool calls"
+    tools_by_name = {tool.metadata.get_name(): tool for tool in tools}
+    for tool_call in tool_calls:
+        tool = tools_by_name.get(tool_call.tool_name)
+        if tool is None:
+            return f"Tool {tool_call.tool_name} does not exist"
+        # The context of a context aware tool is injected, it's not in the arguments
+        if tool.metadata.fn_schema is None or isinstance(tool, ContextAwareTool):
+            continue
+        try:
+            tool.metadata.fn_schema.model_validate(tool_call.tool_kwargs)
+        except ValidationError as e:
+            return f"Invalid arguments for the tool {tool_call.tool_name}: {e}"
+    return None
+
+
 async def call_tools(
     ctx: Context,
     agent_name: str,
@@ -111,11 +194,10 @@ async def call_tools(
                 ),
             )
         ]
-    # Multiple tool calls, show progress
-    tool_msgs: list[ChatMessage] = []
-
+    # Multiple tool calls, run them concurrently and show progress
     progress_id = str(uuid.uuid4())
     total_steps = len(tool_calls)
+    completed_steps = 0
     if emit_agent_events:
         ctx.write_event_to_stream(
             AgentRunEvent(
@@ -123,35 +205,112 @@ async def call_tools(
                 msg=f"Making {total_steps} tool calls",
             )
         )
-    for i, tool_call in enumerate(tool_calls):
+
+    def emit_progress(msg: str) -> None:
+        ctx.write_event_to_stream(
+            AgentRunEvent(
+                name=agent_name,
+                msg=msg,
+                event_type=AgentRunEventType.PROGRESS,
+                data={
+                    "id": progress_id,
+                    "total": total_steps,
+                    "current": completed_steps,
+                },
+            )
+        )
+
+    semaphores = {
+        tool_name: asyncio.Semaphore(get_tool_concurrency(tool_name))
+        for tool_name in {tool_call.tool_name for tool_call in tool_calls}
+    }
+
+    async def run_tool_call(tool_call: ToolSelection) -> ChatMessage:
+        nonlocal completed_steps
         tool = tools_by_name.get(tool_call.tool_name)
         if not tool:
-            tool_msgs.append(
-                ChatMessage(
-                    role=MessageRole.ASSISTANT,
-                    content=f"Tool {tool_call.tool_name} does not exist",
-                )
+            tool_msg = ChatMessage(
+                role=MessageRole.ASSISTANT,
+                content=f"Tool {tool_call.tool_name} does not exist",
             )
-            continue
-        tool_msg = await call_tool(
-            ctx,
-            tool,
-            tool_call,
-            event_emitter=lambda msg: ctx.write_event_to_stream(
-                AgentRunEvent(
-                    name=agent_name,
-                    msg=msg,
-                    event_type=AgentRunEventType.PROGRESS,
-                    data={
-                        "id": progress_id,
-                        "total": total_steps,
-                        "current": i,
-                    },
+        else:
+            async with semaphores[tool_call.tool_name]:
+                tool_msg = await call_tool(
+                    ctx,
+                    tool,
+                    tool_call,
+                    event_emitter=emit_progress,
                 )
-            ),
+        completed_steps += 1
+        emit_progress(f"Finished tool call {tool_call.tool_name}")
+        return tool_msg
+
+    # gather keeps the results in the order of the tool calls
+    return list(
+        await asyncio.gather(*(run_tool_call(tool_call) for tool_call in tool_calls))
+    )
+
+
+async def schedule_tool_calls(
+    ctx: Context,
+    tools: list[BaseTool],
+    tool_calls: list[ToolSelection],
+    agent_names: dict[str, str],
+    dependencies: Optional[dict[str, set[str]]] = None,
+) -> list[ChatMessage]:
+    """
+    Run tool calls of different tools, returning the tool messages in the order of the calls.
+
+    A tool listed in `dependencies` waits until the calls of the tools it depends on are finished,
+    e.g. the document generator runs after the research and the analysis.
+    Calls without pending dependencies run concurrently, grouped by tool so each agent reports its progress.
+    """
+    dependencies = dependencies or {}
+    calls_by_tool: dict[str, list[int]] = {}
+    for i, tool_call in enumerate(tool_calls):
+        calls_by_tool.setdefault(tool_call.tool_name, []).append(i)
+
+    tool_msgs: list[Optional[ChatMessage]] = [None] * len(tool_calls)
+
+    async def run_tool(tool_name: str) -> None:
+        indices = calls_by_tool[tool_name]
+        messages = await call_tools(
+            ctx=ctx,
+            agent_name=agent_names.get(tool_name, tool_name),
+            tools=tools,
+            tool_calls=[tool_calls[i] for i in indices],
         )
-        tool_msgs.append(tool_msg)
-    return tool_msgs
+        for i, message in zip(indices, messages):
+            tool_msgs[i] = message
+
+    pending = set(calls_by_tool)
+    while pending:
+        # Only dependencies on tools that are called in this turn matter
+        ready = {
+            tool_name
+            for tool_name in pending
+            if not dependencies.get(tool_name, set()) & pending
+        }
+        if not ready:
+            raise ValueError(f"Circular dependency between the tools: {pending}")
+        await asyncio.gather(*(run_tool(tool_name) for tool_name in ready))
+        pending -= ready
+
+    return tool_msgs  # type: ignore
+
+
+def get_tool_concurrency(tool_name: str) -> int:
+    """
+    Get the maximum number of concurrent calls of a tool in a step.
+    Configured by TOOL_CALL_CONCURRENCY_<TOOL_NAME>, then TOOL_CALL_CONCURRENCY for all tools.
+    Tools sharing a single sandbox (e.g. the code interpreter) run one call at a time by default.
+    """
+    tool_concurrency = os.getenv(f"TOOL_CALL_CONCURRENCY_{tool_name.upper()}")
+    if tool_concurrency is not None:
+        return max(1, int(tool_concurrency))
+    if tool_name in _SEQUENTIAL_TOOLS:
+        return 1
+    return max(1, int(os.getenv("TOOL_CALL_CONCURRENCY", "5")))
 
 
 async def call_tool(
@@ -164,14 +323,19 @@ async def call_tool(
         event_emitter(
             f"Calling tool {tool_call.tool_name}, {str(tool_call.tool_kwargs)}"
         )
+    deadline = get_deadline()
     try:
         if isinstance(tool, ContextAwareTool):
             if ctx is None:
                 raise ValueError("Context is required for context aware tool")
             # inject context for calling an context aware tool
-            response = await tool.acall(ctx=ctx, **tool_call.tool_kwargs)
+            response = await wait_with_deadline(
+                tool.acall(ctx=ctx, **tool_call.tool_kwargs), deadline
+            )
         else:
-            response = await tool.acall(**tool_call.tool_kwargs)  # type: ignore
+            response = await wait_with_deadline(
+                tool.acall(**tool_call.tool_kwargs), deadline  # type: ignore
+            )
         return ChatMessage(
             role=MessageRole.TOOL,
             content=str(response.raw_output),
@@ -181,6 +345,10 @@ async def call_tool(
             },
         )
     except Exception as e:
+        # Only the expiry of the request's own deadline fails the request,
+        # other errors (e.g. a timeout of the tool itself) are reported to the LLM
+        if isinstance(e, DeadlineExceededError) and deadline and deadline.is_expired():
+            raise
         logger.error(f"Got error in tool {tool_call.tool_name}: {str(e)}")
         if event_emitter:
             event_emitter(f"Got error in tool {tool_call.tool_name}: {str(e)}")
@@ -198,11 +366,12 @@ async def _tool_call_generator(
     llm: FunctionCallingLLM,
     tools: list[BaseTool],
     chat_history: list[ChatMessage],
+    allow_parallel_tool_calls: bool = False,
 ) -> AsyncGenerator[ChatResponse | bool, None]:
     response_stream = await llm.astream_chat_with_tools(
         tools,
         chat_history=chat_history,
-        allow_parallel_tool_calls=False,
+        allow_parallel_tool_calls=allow_parallel_tool_calls,
     )
 
     full_response = None
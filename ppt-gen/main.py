@@ -9,8 +9,14 @@ import os
 
 import uvicorn
 from app.api.routers import api_router
+from app.deadline import install_context_executor
+from app.executors import shutdown_executors
+from app.loop_monitor import get_loop_monitor
+from app.engine.tools import get_tool_registry
 from app.middlewares.frontend import FrontendProxyMiddleware
 from app.observability import init_observability
+from app.services.config import get_config_service
+from app.services.jobs import JobWorker
 from app.settings import init_settings
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
@@ -20,10 +26,56 @@ app = FastAPI()
 
 init_settings()
 init_observability()
+# Load the configured tools once at startup instead of on the first request
+get_tool_registry()
+# Reload the config files when they change (0 to disable)
+config_reload_interval = float(os.getenv("CONFIG_RELOAD_INTERVAL", "5"))
+if config_reload_interval > 0:
+    get_config_service().start_watching(config_reload_interval)
 
 environment = os.getenv("ENVIRONMENT", "dev")  # Default to 'development' if not set
 logger = logging.getLogger("uvicorn")
 
+# Run the background chat jobs in this process (JOB_WORKERS=0 to only run them with `poetry run worker`)
+job_worker = JobWorker.from_env()
+
+
+@app.on_event("startup")
+async def install_executor():
+    # The sync tools run in the default executor, they need the request deadline
+    install_context_executor()
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    # Report the callbacks blocking the event loop (LOOP_MONITOR=true)
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is not None:
+        loop_monitor.start()
+
+
+@app.on_event("startup")
+async def start_job_worker():
+    if job_worker.concurrency > 0:
+        job_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_worker():
+    await job_worker.stop()
+
+
+@app.on_event("shutdown")
+async def stop_executors():
+    shutdown_executors()
+
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor = get_loop_monitor()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
 
 def mount_static_files(directory, path, html=False):
     if os.path.exists(directory):
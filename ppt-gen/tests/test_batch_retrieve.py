@@ -0,0 +1,51 @@
+import asyncio
+
+import qdrant_client
+from llama_index.core import VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import QueryBundle, TextNode
+from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+from app.engine.retrievers import abatch_retrieve
+
+
+def test_batch_retrieve_matches_single_retrievals():
+    async def main():
+        vector_store = QdrantVectorStore(
+            collection_name="test",
+            aclient=qdrant_client.AsyncQdrantClient(location=":memory:"),
+        )
+        nodes = [
+            TextNode(text=f"node {i}", embedding=[float(i), 1.0, 0.0, float(i % 3)])
+            for i in range(10)
+        ]
+        await vector_store.async_add(nodes)
+        index = VectorStoreIndex.from_vector_store(
+            vector_store, embed_model=MockEmbedding(embed_dim=4)
+        )
+        retriever = index.as_retriever(similarity_top_k=3)
+        query_bundles = [
+            QueryBundle(query_str=f"query {i}", embedding=[1.0, float(i), 0.5, 0.0])
+            for i in range(4)
+        ]
+
+        search_batch = vector_store._aclient.search_batch
+        batch_requests = []
+
+        async def spy_search_batch(collection_name, requests):
+            batch_requests.append(requests)
+            return await search_batch(
+                collection_name=collection_name, requests=requests
+            )
+
+        vector_store._aclient.search_batch = spy_search_batch
+        batched = await abatch_retrieve(retriever, query_bundles)
+        # All the queries are searched in one request
+        assert [len(requests) for requests in batch_requests] == [4]
+        single = [await retriever.aretrieve(bundle) for bundle in query_bundles]
+        assert [[node.node_id for node in nodes] for nodes in batched] == [
+            [node.node_id for node in nodes] for nodes in single
+        ]
+        assert all(len(nodes) == 3 for nodes in batched)
+
+    asyncio.run(main())
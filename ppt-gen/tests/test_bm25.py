@@ -0,0 +1,129 @@
+from llama_index.core.schema import (
+    NodeRelationship,
+    NodeWithScore,
+    QueryBundle,
+    RelatedNodeInfo,
+    TextNode,
+)
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+
+from app.engine.bm25 import BM25Index, BM25Retriever, tokenize
+from app.engine.retrievers import reciprocal_rank_fusion
+from app.engine.tools.query_engine import create_retriever
+
+
+def _node(node_id, text, doc_id, **metadata):
+    return TextNode(
+        id_=node_id,
+        text=text,
+        metadata=metadata,
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc_id)},
+    )
+
+
+def _index():
+    index = BM25Index()
+    index.add_nodes(
+        [
+            _node("revenue", "Revenue grew 12% to $4.1B in Q3", "q3", private="false"),
+            _node("margin", "Gross margin was stable this quarter", "q3"),
+            _node(
+                "outlook",
+                "The outlook for revenue in Q4 is cautious, revenue may decline",
+                "q4",
+                private="true",
+            ),
+            _node("hiring", "Headcount and hiring were reduced", "q4"),
+        ]
+    )
+    return index
+
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    assert tokenize("The Revenue of ACME grew in Q3") == [
+        "revenue",
+        "acme",
+        "grew",
+        "q3",
+    ]
+
+
+def test_search_ranks_the_matching_nodes():
+    results = _index().search("revenue outlook", top_k=3)
+    assert [result.node.node_id for result in results] == ["outlook", "revenue"]
+    assert results[0].score > results[1].score
+
+
+def test_search_without_known_terms_is_empty():
+    assert _index().search("the of and", top_k=3) == []
+    assert _index().search("dividend", top_k=3) == []
+
+
+def test_adding_a_document_again_replaces_its_nodes():
+    index = _index()
+    index.add_nodes([_node("dividend", "A dividend was announced", "q4")])
+    assert len(index) == 3
+    assert index.search("outlook", top_k=3) == []
+    assert [r.node.node_id for r in index.search("dividend", top_k=3)] == ["dividend"]
+
+
+def test_retriever_applies_the_filters():
+    filters = MetadataFilters(
+        filters=[
+            MetadataFilter(key="private", value=["true"], operator=FilterOperator.NIN)
+        ]
+    )
+    retriever = BM25Retriever(_index(), similarity_top_k=3, filters=filters)
+    results = retriever.retrieve(QueryBundle(query_str="revenue"))
+    assert [result.node.node_id for result in results] == ["revenue"]
+
+    filters = MetadataFilters(
+        filters=[MetadataFilter(key="doc_id", value="q4", operator=FilterOperator.IN)]
+    )
+    retriever = BM25Retriever(_index(), similarity_top_k=3, filters=filters)
+    results = retriever.retrieve(QueryBundle(query_str="revenue"))
+    assert [result.node.node_id for result in results] == ["outlook"]
+
+
+def test_index_is_persisted(tmp_path):
+    _index().persist(str(tmp_path))
+    index = BM25Index.from_persist_dir(str(tmp_path))
+    assert [r.node.node_id for r in index.search("hiring", top_k=3)] == ["hiring"]
+
+
+def _ranked(*node_ids):
+    return [
+        NodeWithScore(node=TextNode(id_=node_id), score=1.0) for node_id in node_ids
+    ]
+
+
+def test_reciprocal_rank_fusion_ordering():
+    fused = reciprocal_rank_fusion(
+        [_ranked("a", "b", "c"), _ranked("b", "c", "d")], top_k=3, k=60
+    )
+    # b: 1/62 + 1/61, c: 1/63 + 1/62, a: 1/61, d: 1/63
+    assert [node.node.node_id for node in fused] == ["b", "c", "a"]
+    assert fused[0].score == 1 / 62 + 1 / 61
+
+
+def test_reciprocal_rank_fusion_keeps_nodes_found_by_one_retriever():
+    fused = reciprocal_rank_fusion([_ranked("a"), []], top_k=5, k=60)
+    assert [node.node.node_id for node in fused] == ["a"]
+    assert fused[0].score == 1 / 61
+
+
+class _Index:
+    def as_retriever(self, **kwargs):
+        return kwargs
+
+
+def test_qdrant_hybrid_search_keeps_the_default_sparse_top_k(monkeypatch):
+    monkeypatch.setenv("HYBRID_SEARCH", "qdrant")
+    assert "sparse_top_k" not in create_retriever(_Index())
+    kwargs = create_retriever(_Index(), similarity_top_k=5)
+    assert kwargs["sparse_top_k"] == 5
+    assert kwargs["vector_store_query_mode"] == "hybrid"
@@ -0,0 +1,129 @@
+import asyncio
+import re
+from typing import List
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.workflow import (
+    Context,
+    Event,
+    StartEvent,
+    StopEvent,
+    Workflow,
+    step,
+)
+
+from app.workflows.checkpoints import WorkflowRun
+from app.workflows.events import AgentRunEvent
+from app.workflows.memory import TokenWindowMemory
+from app.workflows.tool_outputs import ToolOutputStore, offload_tool_messages
+
+TOOL_OUTPUT = "\n".join(f"row {i}: revenue {i * 7}" for i in range(500))
+
+
+class ReportEvent(Event):
+    pass
+
+
+class _ReportWorkflow(Workflow):
+    """
+    A research step followed by a report step, the report step of the first run never ends
+    (e.g. the client disconnected while it was running).
+    """
+
+    def __init__(self, stall_report: bool = False):
+        super().__init__(timeout=10)
+        self.stall_report = stall_report
+        self.research_calls = 0
+        self.memory = TokenWindowMemory.from_defaults(
+            token_limit=1000, tokenizer_fn=str.split
+        )
+        self.tool_output_store = ToolOutputStore()
+        self.read_outputs: List[str] = []
+
+    @step
+    async def research(self, ctx: Context, ev: StartEvent) -> ReportEvent:
+        self.research_calls += 1
+        ctx.write_event_to_stream(AgentRunEvent(name="Researcher", msg="Researching"))
+        self.memory.put(ChatMessage(role=MessageRole.USER, content=ev.input))
+        self.memory.put(
+            ChatMessage(role=MessageRole.ASSISTANT, content="Revenue grew 12%")
+        )
+        tool_message = ChatMessage(
+            role=MessageRole.TOOL,
+            content=TOOL_OUTPUT,
+            additional_kwargs={"tool_call_id": "1", "name": "interpret"},
+        )
+        self.memory.put_messages(
+            offload_tool_messages([tool_message], self.tool_output_store)
+        )
+        return ReportEvent()
+
+    @step
+    async def report(self, ctx: Context, ev: ReportEvent) -> StopEvent:
+        if self.stall_report:
+            await asyncio.sleep(10)
+        ctx.write_event_to_stream(AgentRunEvent(name="Reporter", msg="Reporting"))
+        # Read the offloaded output, like the LLM calling the read_tool_output tool
+        output_id = re.search(r"output_[0-9a-f]{12}", self.memory.get()[-1].content)
+        tool = self.tool_output_store.get_read_tool()
+        self.read_outputs.append(
+            (await tool.acall(output_id=output_id.group(0))).raw_output
+        )
+        return StopEvent(result=[message.content for message in self.memory.get()])
+
+
+async def _stream(run: WorkflowRun, handler, until: str = "") -> List[str]:
+    """
+    Stream the events of the run like the chat endpoint, returning the new frames.
+    """
+    frames = []
+    async for event in handler.stream_events():
+        if isinstance(event, AgentRunEvent):
+            run.add_frame(event.msg)
+            frames.append(event.msg)
+            if event.msg == until:
+                break
+    return frames
+
+
+def test_resumed_run_replays_the_frames_and_restores_the_memory():
+    async def main():
+        run = WorkflowRun(chat_data=None)
+        workflow = _ReportWorkflow(stall_report=True)
+        handler = run.run(workflow, input="How did revenue change?")
+        await _stream(run, handler, until="Researching")
+        # Wait for the checkpoint of the research step, then disconnect
+        while run._checkpoint is None:
+            await asyncio.sleep(0.01)
+        await handler.cancel_run()
+
+        # The workflow is created again from the chat request
+        resumed = _ReportWorkflow()
+        handler = run.run(resumed, input="How did revenue change?")
+        replayed = run.get_replay_frames()
+        frames = await _stream(run, handler)
+        result = await handler
+        assert replayed + frames == ["Researching", "Reporting"]
+        assert resumed.research_calls == 0
+        assert result[:2] == ["How did revenue change?", "Revenue grew 12%"]
+
+    asyncio.run(main())
+
+
+def test_resumed_run_reads_the_tool_outputs_offloaded_before_the_checkpoint():
+    async def main():
+        run = WorkflowRun(chat_data=None)
+        workflow = _ReportWorkflow(stall_report=True)
+        handler = run.run(workflow, input="How did revenue change?")
+        await _stream(run, handler, until="Researching")
+        while run._checkpoint is None:
+            await asyncio.sleep(0.01)
+        await handler.cancel_run()
+
+        resumed = _ReportWorkflow()
+        handler = run.run(resumed, input="How did revenue change?")
+        await _stream(run, handler)
+        await handler
+        assert resumed.read_outputs == [TOOL_OUTPUT]
+
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.engine.compression import compress_nodes, deduplicate_nodes, split_sentences
+
+
+def _nodes(*texts):
+    return [
+        NodeWithScore(node=TextNode(id_=str(i), text=text), score=1.0)
+        for i, text in enumerate(texts)
+    ]
+
+
+def test_split_sentences():
+    assert split_sentences("Revenue grew. Costs fell!\n\nOutlook:  cautious ") == [
+        "Revenue grew.",
+        "Costs fell!",
+        "Outlook:  cautious",
+    ]
+
+
+def test_deduplicate_nodes_keeps_the_first_node():
+    nodes = _nodes("Revenue grew.", "Revenue   grew.", "Costs fell.")
+    nodes.append(nodes[2])
+    assert [node.node.node_id for node in deduplicate_nodes(nodes)] == ["0", "2"]
+
+
+def test_compression_keeps_the_relevant_sentences_in_order():
+    nodes = _nodes(
+        "The company was founded in 1990. Revenue grew 12% in Q3. Offices moved.",
+        "Q3 revenue beat the estimates. The CEO spoke at a conference.",
+    )
+    passages = compress_nodes("Q3 revenue", nodes, token_budget=10, tokenizer=str.split)
+    assert passages == ["Revenue grew 12% in Q3.", "Q3 revenue beat the estimates."]
+
+
+def test_compression_within_the_budget_keeps_everything():
+    nodes = _nodes("Revenue grew. Costs fell.", "Offices moved.")
+    passages = compress_nodes("revenue", nodes, token_budget=100, tokenizer=str.split)
+    assert passages == ["Revenue grew. Costs fell.", "Offices moved."]
+
+
+def test_compression_breaks_ties_by_node_rank():
+    nodes = _nodes("Costs fell sharply.", "Offices moved.")
+    passages = compress_nodes("revenue", nodes, token_budget=3, tokenizer=str.split)
+    assert passages == ["Costs fell sharply.", ""]
@@ -0,0 +1,79 @@
+import asyncio
+
+from llama_index.core.schema import ImageNode, NodeWithScore, TextNode
+
+from app.engine.dedup import (
+    _EMPTY_SIMHASH,
+    SIMHASH_METADATA_KEY,
+    NearDuplicatePostprocessor,
+    SimHashExtractor,
+    hamming_distance,
+    simhash,
+)
+
+TEXT = (
+    "Revenue for the quarter increased twelve percent year over year, "
+    "driven by strong demand for cloud services and higher subscription renewals."
+)
+
+
+def test_hamming_distance():
+    assert hamming_distance(0, 0) == 0
+    assert hamming_distance(0b1011, 0b0001) == 2
+    assert hamming_distance(0, 2**64 - 1) == 64
+
+
+def test_simhash_of_near_duplicates_is_close():
+    near_duplicate = TEXT.replace("twelve", "eleven")
+    other = "The board approved a new share buyback program and a quarterly dividend."
+    assert simhash(TEXT) == simhash(TEXT)
+    assert hamming_distance(simhash(TEXT), simhash(near_duplicate)) <= 12
+    assert hamming_distance(simhash(TEXT), simhash(other)) > 12
+
+
+def test_simhash_without_words():
+    assert simhash("") is None
+    assert simhash("  ...  ") is None
+
+
+def _nodes(*texts):
+    nodes = [
+        NodeWithScore(node=TextNode(text=text), score=1 - i / 10)
+        for i, text in enumerate(texts)
+    ]
+    SimHashExtractor()([node.node for node in nodes])
+    return nodes
+
+
+def test_postprocessor_removes_near_duplicates():
+    nodes = _nodes(TEXT, TEXT + " ", "Operating margin was stable.")
+    kept = NearDuplicatePostprocessor(max_distance=6).postprocess_nodes(nodes)
+    assert [node.score for node in kept] == [1.0, 0.8]
+
+
+def test_async_postprocessor_removes_near_duplicates():
+    nodes = _nodes(TEXT, TEXT + " ", "Operating margin was stable.")
+    kept = asyncio.run(
+        NearDuplicatePostprocessor(max_distance=6).apostprocess_nodes(nodes)
+    )
+    assert [node.score for node in kept] == [1.0, 0.8]
+
+
+def test_postprocessor_does_not_hash_nodes_without_a_signature():
+    nodes = [NodeWithScore(node=TextNode(text=TEXT), score=0.9) for _ in range(2)]
+    kept = NearDuplicatePostprocessor(max_distance=6).postprocess_nodes(nodes)
+    assert len(kept) == 2
+
+
+def test_postprocessor_keeps_nodes_without_text():
+    nodes = [
+        NodeWithScore(node=ImageNode(image_path=f"image_{i}.png"), score=0.5)
+        for i in range(3)
+    ] + [NodeWithScore(node=TextNode(text=""), score=0.4) for _ in range(2)]
+    SimHashExtractor()([node.node for node in nodes])
+    assert all(SIMHASH_METADATA_KEY not in node.node.metadata for node in nodes)
+    # Nodes ingested with the signature formerly stored for an empty text
+    for node in nodes:
+        node.node.metadata[SIMHASH_METADATA_KEY] = f"{_EMPTY_SIMHASH:016x}"
+    kept = NearDuplicatePostprocessor(max_distance=6).postprocess_nodes(nodes)
+    assert len(kept) == 5
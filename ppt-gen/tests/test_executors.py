@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.deadline import Deadline, DeadlineExceededError, deadline_context, get_deadline
+from app.engine.tools import document_generator
+from app.engine.tools.document_generator import DocumentGenerator
+from app.executors import BoundedExecutor, ExecutorQueueFullError
+
+
+def test_calls_are_rejected_when_the_queue_is_full():
+    executor = BoundedExecutor("test", max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = executor.submit(release.wait)
+        queued = executor.submit(release.wait)
+        assert executor.queue_depth == 1
+        with pytest.raises(ExecutorQueueFullError):
+            executor.submit(release.wait)
+        metrics = executor.get_metrics()
+        assert metrics["active"] == 1
+        assert metrics["queue_depth"] == 1
+        assert metrics["rejected"] == 1
+    finally:
+        release.set()
+    running.result(timeout=1)
+    queued.result(timeout=1)
+    metrics = executor.get_metrics()
+    assert metrics["queue_depth"] == 0
+    assert metrics["completed"] == 2
+    # The queue has room again
+    assert executor.submit(time.sleep, 0).result(timeout=1) is None
+    executor.shutdown()
+
+
+def test_failed_calls_are_counted():
+    async def main():
+        executor = BoundedExecutor("test", max_workers=1)
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(divmod, 1, 0)
+        assert executor.get_metrics()["failed"] == 1
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_pooled_call_sees_the_deadline_of_its_caller():
+    async def main():
+        executor = BoundedExecutor("test", max_workers=2)
+        deadline = Deadline(10)
+        with deadline_context(deadline):
+            assert await executor.run(get_deadline) is deadline
+        assert await executor.run(get_deadline) is None
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_call_is_not_started_after_the_deadline():
+    async def main():
+        executor = BoundedExecutor("test", max_workers=1)
+        deadline = Deadline(10)
+        deadline.cancel()
+        with deadline_context(deadline):
+            with pytest.raises(DeadlineExceededError):
+                await executor.run(time.sleep, 0)
+        assert executor.get_metrics()["completed"] == 0
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_process_pool_runs_the_calls():
+    async def main():
+        executor = BoundedExecutor("test", max_workers=1, processes=True)
+        assert await executor.run(pow, 2, 10) == 1024
+        assert executor.get_metrics()["completed"] == 1
+        executor.shutdown()
+
+    asyncio.run(main())
+
+
+class _SlowRenderExecutor(BoundedExecutor):
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(time.sleep, 1)
+
+
+def test_pdf_rendering_process_is_bounded_by_the_deadline(monkeypatch):
+    executor = _SlowRenderExecutor("document_render", max_workers=1, processes=True)
+    monkeypatch.setattr(document_generator, "get_executor", lambda *_, **__: executor)
+    deadline = Deadline(0.2)
+    started_at = time.monotonic()
+    with deadline_context(deadline):
+        with pytest.raises(DeadlineExceededError):
+            DocumentGenerator._render_pdf("<p>Report</p>")
+    assert time.monotonic() - started_at < 1
+    executor.shutdown()
+
+
+def test_pdf_is_rendered_in_a_process():
+    pytest.importorskip("xhtml2pdf")
+    pdf = DocumentGenerator._render_pdf("<p>Report</p>")
+    assert pdf.read(4) == b"%PDF"
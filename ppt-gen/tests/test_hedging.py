@@ -0,0 +1,148 @@
+import asyncio
+from typing import List, Optional
+
+import pytest
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    LLMMetadata,
+)
+from llama_index.core.llms import CustomLLM
+
+from app.llms.hedging import HedgedLLM, LLMHedger
+
+
+class _FakeLLM(CustomLLM):
+    """
+    Streams its name after `delay` seconds, or fails with `error`.
+    """
+
+    name: str
+    delay: float = 0.0
+    error: Optional[str] = None
+    started: int = 0
+    closed: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.name)
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        return CompletionResponse(text=self.name)
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        yield CompletionResponse(text=self.name, delta=self.name)
+
+    async def astream_chat(self, messages, **kwargs):
+        self.started += 1
+
+        async def gen():
+            try:
+                await asyncio.sleep(self.delay)
+                if self.error:
+                    raise ValueError(self.error)
+                for delta in [self.name, " done"]:
+                    yield ChatResponse(
+                        message=ChatMessage(role="assistant", content=delta),
+                        delta=delta,
+                    )
+            finally:
+                self.closed += 1
+
+        return gen()
+
+
+class _OtherProviderLLM(_FakeLLM):
+    pass
+
+
+MESSAGES = [ChatMessage(role="user", content="Hello")]
+
+
+def _hedger(budget: float = 1.0) -> LLMHedger:
+    return LLMHedger("test", budget=budget, min_delay=0.05, initial_delay=0.05)
+
+
+async def _stream(llm: HedgedLLM, **kwargs) -> List[str]:
+    stream = await llm.astream_chat(MESSAGES, **kwargs)
+    return [chunk.delta async for chunk in stream]
+
+
+def test_backup_wins_and_the_primary_is_closed():
+    async def main():
+        primary = _FakeLLM(name="primary", delay=1)
+        backup = _FakeLLM(name="backup")
+        hedger = _hedger()
+        deltas = await _stream(HedgedLLM(primary, backup, hedger))
+        assert deltas == ["backup", " done"]
+        assert primary.started == 1
+        assert primary.closed == 1
+        assert hedger.hedges == 1
+        assert hedger.backup_wins == 1
+
+    asyncio.run(main())
+
+
+def test_fast_primary_is_not_hedged():
+    async def main():
+        primary = _FakeLLM(name="primary")
+        backup = _FakeLLM(name="backup")
+        deltas = await _stream(HedgedLLM(primary, backup, _hedger()))
+        assert deltas == ["primary", " done"]
+        assert backup.started == 0
+
+    asyncio.run(main())
+
+
+def test_budget_refuses_the_hedge():
+    async def main():
+        primary = _FakeLLM(name="primary", delay=0.1)
+        backup = _FakeLLM(name="backup")
+        hedger = _hedger(budget=0.5)
+        llm = HedgedLLM(primary, backup, hedger)
+        # Hedging the only request would use the whole budget
+        assert await _stream(llm) == ["primary", " done"]
+        assert backup.started == 0
+        # One hedged request out of two is within the budget
+        assert await _stream(llm) == ["backup", " done"]
+        # But not two out of three
+        assert await _stream(llm) == ["primary", " done"]
+        assert backup.started == 1
+        assert hedger.get_metrics()["hedges"] == 1
+
+    asyncio.run(main())
+
+
+def test_backup_is_used_when_the_primary_fails():
+    async def main():
+        primary = _FakeLLM(name="primary", delay=0.1, error="Overloaded")
+        backup = _FakeLLM(name="backup", delay=0.2)
+        deltas = await _stream(HedgedLLM(primary, backup, _hedger()))
+        assert deltas == ["backup", " done"]
+
+    asyncio.run(main())
+
+
+def test_error_is_raised_when_both_streams_fail():
+    async def main():
+        primary = _FakeLLM(name="primary", delay=0.1, error="Overloaded")
+        backup = _FakeLLM(name="backup", delay=0.2, error="Unavailable")
+        with pytest.raises(ValueError, match="Unavailable"):
+            await _stream(HedgedLLM(primary, backup, _hedger()))
+
+    asyncio.run(main())
+
+
+def test_tool_calls_are_not_hedged_to_another_provider():
+    async def main():
+        primary = _FakeLLM(name="primary", delay=0.1)
+        backup = _OtherProviderLLM(name="backup")
+        tools = [{"type": "function", "function": {"name": "query"}}]
+        llm = HedgedLLM(primary, backup, _hedger())
+        assert await _stream(llm, tools=tools) == ["primary", " done"]
+        assert backup.started == 0
+        # A stream without provider specific arguments can use it
+        assert await _stream(llm) == ["backup", " done"]
+
+    asyncio.run(main())
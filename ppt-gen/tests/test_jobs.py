@@ -0,0 +1,109 @@
+import asyncio
+import sqlite3
+import time
+
+from app.services.jobs import (
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobStore,
+    JobWorker,
+)
+
+
+def test_claim_takes_the_oldest_queued_job(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    first = store.enqueue("first", max_queued=10)
+    store.enqueue("second", max_queued=10)
+    assert store.claim() == (first, "first")
+    job = store.get(first)
+    assert job["status"] == JOB_RUNNING
+    assert job["lease_until"] > time.time()
+
+
+def test_expired_job_without_frames_is_queued_again(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease=0.05, max_attempts=2)
+    job_id = store.enqueue("payload", max_queued=10)
+    store.claim()
+    time.sleep(0.1)
+    # Claimed again by another worker
+    assert store.claim() == (job_id, "payload")
+    time.sleep(0.1)
+    # Failed after its last attempt
+    assert store.claim() is None
+    job = store.get(job_id)
+    assert job["status"] == JOB_FAILED
+    assert job["error"] == "The worker running the job stopped"
+
+
+def test_expired_job_with_frames_is_failed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease=0.05)
+    job_id = store.enqueue("payload", max_queued=10)
+    store.claim()
+    store.add_events(job_id, [(0, "frame")])
+    time.sleep(0.1)
+    store.expire_leases()
+    assert store.get(job_id)["status"] == JOB_FAILED
+
+
+def test_renewed_lease_does_not_expire(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"), lease=0.1)
+    job_id = store.enqueue("payload", max_queued=10)
+    store.claim()
+    for _ in range(3):
+        time.sleep(0.05)
+        assert store.renew(job_id)
+    store.expire_leases()
+    assert store.get(job_id)["status"] == JOB_RUNNING
+    store.finish(job_id, JOB_COMPLETED)
+    assert not store.renew(job_id)
+
+
+def test_database_without_leases_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+        "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    # A job left running by a worker without leases
+    conn.execute(
+        "INSERT INTO jobs VALUES ('old', ?, 'payload', NULL, 0, 0)", (JOB_RUNNING,)
+    )
+    conn.commit()
+    conn.close()
+
+    store = JobStore(path)
+    store.expire_leases()
+    assert store.get("old")["status"] == JOB_QUEUED
+
+
+def test_worker_stops_a_job_whose_lease_is_lost(tmp_path):
+    async def main():
+        store = JobStore(str(tmp_path / "jobs.sqlite"), lease=0.15)
+        worker = JobWorker(store, concurrency=1, poll_interval=0.01)
+        runs = []
+
+        async def stream_job(job_id, payload):
+            runs.append(payload)
+            if payload == "stuck":
+                await asyncio.sleep(10)
+            store.finish(job_id, JOB_COMPLETED)
+
+        worker._stream_job = stream_job
+        stuck = store.enqueue("stuck", max_queued=10)
+        worker.start()
+        await asyncio.sleep(0.05)
+        store.finish(stuck, JOB_FAILED, "Cancelled")
+        # The next renewal finds the job failed and stops it, the worker takes the next job
+        next_job = store.enqueue("next", max_queued=10)
+        for _ in range(100):
+            if store.get(next_job)["status"] == JOB_COMPLETED:
+                break
+            await asyncio.sleep(0.02)
+        await worker.stop()
+        assert runs == ["stuck", "next"]
+        assert store.get(stuck)["status"] == JOB_FAILED
+
+    asyncio.run(main())
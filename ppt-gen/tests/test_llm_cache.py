@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    LLMMetadata,
+)
+from llama_index.core.llms import CustomLLM
+
+from app.llms.cache import CachedLLM, CachedResponse, LLMResponseCache
+
+
+def _response(text: str) -> CachedResponse:
+    return CachedResponse(
+        response=ChatResponse(message=ChatMessage(role="assistant", content=text))
+    )
+
+
+def test_get_and_put(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.get("key") is None
+    cache.put("key", _response("hello"))
+    assert cache.get("key").response.message.content == "hello"
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    for key in ("a", "b", "c"):
+        cache.put(key, _response(key))
+        time.sleep(0.01)
+    # "a" is used again, so "b" is the least recently used entry
+    assert cache.get("a") is not None
+    time.sleep(0.01)
+    cache.put("d", _response("d"))
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ("a", "c", "d"))
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), ttl=0.05)
+    cache.put("key", _response("hello"))
+    time.sleep(0.1)
+    assert cache.get("key") is None
+
+
+def test_entries_are_counted_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    LLMResponseCache(path).put("a", _response("a"))
+    cache = LLMResponseCache(path, max_entries=1)
+    cache.put("b", _response("b"))
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+
+
+def test_async_get_and_put(tmp_path):
+    async def main():
+        cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+        await cache.aput("key", _response("hello"))
+        cached = await cache.aget("key")
+        assert cached.response.message.content == "hello"
+
+    asyncio.run(main())
+
+
+class _FakeLLM(CustomLLM):
+    temperature: float = 0.0
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake")
+
+    def complete(self, prompt, formatted=False, **kwargs):
+        self.calls += 1
+        return CompletionResponse(text=f"answer {self.calls}")
+
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        self.calls += 1
+        text = ""
+        for delta in ["answer ", str(self.calls)]:
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+
+def _cached_llm(tmp_path, **kwargs):
+    llm = _FakeLLM(**kwargs)
+    return llm, CachedLLM(llm, LLMResponseCache(str(tmp_path / "cache.sqlite")))
+
+
+MESSAGES = [ChatMessage(role="user", content="Summarize the report")]
+TOOL = {"type": "function", "function": {"name": "query", "parameters": {}}}
+
+
+def test_cache_key_includes_the_tool_schemas(tmp_path):
+    _, cached_llm = _cached_llm(tmp_path)
+    key = cached_llm._cache_key("chat", MESSAGES, {"tools": [TOOL]})
+    # The key doesn't depend on the order of the schema keys
+    reordered = {"function": TOOL["function"], "type": "function"}
+    assert cached_llm._cache_key("chat", MESSAGES, {"tools": [reordered]}) == key
+    other_tool = {"type": "function", "function": {"name": "chart", "parameters": {}}}
+    assert cached_llm._cache_key("chat", MESSAGES, {"tools": [other_tool]}) != key
+    assert cached_llm._cache_key("chat", MESSAGES, {}) != key
+
+
+def test_deterministic_calls_are_cached(tmp_path):
+    llm, cached_llm = _cached_llm(tmp_path)
+    assert cached_llm.chat(MESSAGES).message.content == "answer 1"
+    assert cached_llm.chat(MESSAGES).message.content == "answer 1"
+    assert cached_llm.chat(MESSAGES, tools=[TOOL]).message.content == "answer 2"
+    assert llm.calls == 2
+
+
+def test_calls_with_a_temperature_are_not_cached(tmp_path):
+    llm, cached_llm = _cached_llm(tmp_path, temperature=0.7)
+    cached_llm.chat(MESSAGES)
+    assert cached_llm.chat(MESSAGES).message.content == "answer 2"
+    # Unless the call sets a temperature of 0
+    cached_llm.chat(MESSAGES, temperature=0)
+    assert cached_llm.chat(MESSAGES, temperature=0).message.content == "answer 3"
+
+
+def test_streamed_response_is_replayed_as_a_stream(tmp_path):
+    async def main():
+        llm, cached_llm = _cached_llm(tmp_path)
+        for _ in range(2):
+            stream = await cached_llm.astream_chat(MESSAGES)
+            deltas = [chunk.delta async for chunk in stream]
+            assert deltas == ["answer ", "1"]
+        assert llm.calls == 1
+        # The final chunk holds the full response
+        response = await cached_llm.achat(MESSAGES)
+        assert response.message.content == "answer 1"
+
+    asyncio.run(main())
+
+
+def test_partly_consumed_stream_is_not_cached(tmp_path):
+    async def main():
+        llm, cached_llm = _cached_llm(tmp_path)
+        stream = await cached_llm.astream_chat(MESSAGES)
+        await stream.__anext__()
+        await stream.aclose()
+        stream = await cached_llm.astream_chat(MESSAGES)
+        assert [chunk.delta async for chunk in stream] == ["answer ", "2"]
+        assert llm.calls == 2
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+import asyncio
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.llms import MockLLM
+
+from app.workflows.memory import TokenWindowMemory
+
+
+def _message(role, words):
+    return ChatMessage(role=role, content=" ".join(["word"] * words))
+
+
+def _memory(token_limit, **kwargs):
+    return TokenWindowMemory.from_defaults(
+        token_limit=token_limit, tokenizer_fn=str.split, **kwargs
+    )
+
+
+def test_window_keeps_the_latest_messages():
+    memory = _memory(10)
+    for _ in range(4):
+        memory.put(_message(MessageRole.USER, 4))
+    assert len(memory.get()) == 2
+    assert len(memory.get_all()) == 4
+
+
+def test_window_does_not_start_with_a_tool_message():
+    memory = _memory(10)
+    memory.put(_message(MessageRole.USER, 4))
+    memory.put(_message(MessageRole.ASSISTANT, 2))
+    memory.put(_message(MessageRole.TOOL, 3))
+    memory.put(_message(MessageRole.USER, 3))
+    memory.put(_message(MessageRole.ASSISTANT, 1))
+    # The user message was dropped, its tool call and result are dropped with it
+    assert [message.role for message in memory.get()] == [
+        MessageRole.USER,
+        MessageRole.ASSISTANT,
+    ]
+
+
+def test_message_longer_than_the_limit_gives_an_empty_window():
+    memory = _memory(10)
+    memory.put(_message(MessageRole.USER, 2))
+    memory.put(_message(MessageRole.USER, 20))
+    assert memory.get() == []
+    memory.put(_message(MessageRole.USER, 2))
+    assert len(memory.get()) == 1
+
+
+def test_set_replaces_the_history():
+    memory = _memory(10)
+    memory.put(_message(MessageRole.USER, 8))
+    memory.set([_message(MessageRole.USER, 2), _message(MessageRole.ASSISTANT, 2)])
+    assert len(memory.get()) == 2
+
+
+def test_oldest_turns_are_summarized():
+    async def main():
+        memory = _memory(100, llm=MockLLM(max_tokens=5), summary_threshold=0.5)
+        for _ in range(3):
+            memory.put(_message(MessageRole.USER, 10))
+            memory.put(_message(MessageRole.ASSISTANT, 10))
+        assert memory._summary_task is not None
+        await memory._summary_task
+        history = memory.get()
+        assert history[0].role == MessageRole.SYSTEM
+        assert history[0].content.startswith("Summary of the earlier conversation")
+        assert history[1].role == MessageRole.USER
+        assert len(history) < 7
+        assert len(memory.get_all()) == 6
+
+    asyncio.run(main())
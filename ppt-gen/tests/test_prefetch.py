@@ -0,0 +1,77 @@
+import asyncio
+from typing import List
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.engine.prefetch import RetrievalPrefetcher, query_similarity
+
+
+class FakeRetriever(BaseRetriever):
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self.queries: List[str] = []
+        self.delay = delay
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        raise NotImplementedError
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        self.queries.append(query_bundle.query_str)
+        await asyncio.sleep(self.delay)
+        return [NodeWithScore(node=TextNode(text=query_bundle.query_str), score=1.0)]
+
+
+def test_query_similarity():
+    assert query_similarity("revenue of apple", "apple revenue") > 0.5
+    assert query_similarity("revenue of apple", "tesla margins") == 0.0
+    assert query_similarity("", "apple") == 0.0
+
+
+def test_prefetched_nodes_are_used_once():
+    async def main():
+        retriever = FakeRetriever()
+        prefetcher = RetrievalPrefetcher(similarity_threshold=0.5)
+        speculative = prefetcher.wrap(retriever)
+        prefetcher.prefetch("apple revenue 2023")
+
+        first = await speculative.aretrieve("apple revenue in 2023")
+        second = await speculative.aretrieve("apple revenue 2023")
+        assert first[0].node.get_content() == "apple revenue 2023"
+        assert second[0].node.get_content() == "apple revenue 2023"
+        # The second query retrieved its own nodes
+        assert retriever.queries == ["apple revenue 2023", "apple revenue 2023"]
+
+    asyncio.run(main())
+
+
+def test_dissimilar_query_retrieves_its_own_nodes():
+    async def main():
+        retriever = FakeRetriever()
+        prefetcher = RetrievalPrefetcher(similarity_threshold=0.5)
+        speculative = prefetcher.wrap(retriever)
+        prefetcher.prefetch("apple revenue 2023")
+
+        nodes = await speculative.aretrieve("tesla operating margin")
+        assert nodes[0].node.get_content() == "tesla operating margin"
+
+    asyncio.run(main())
+
+
+def test_cancel_stops_an_unused_prefetch():
+    async def main():
+        retriever = FakeRetriever(delay=10)
+        prefetcher = RetrievalPrefetcher(similarity_threshold=0.5)
+        speculative = prefetcher.wrap(retriever)
+        prefetcher.prefetch("apple revenue 2023")
+        task = prefetcher._task
+        await asyncio.sleep(0)
+        prefetcher.cancel()
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        retriever.delay = 0
+        nodes = await speculative.aretrieve("apple revenue 2023")
+        assert len(retriever.queries) == 2
+        assert nodes[0].score == 1.0
+
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from app.llms.scheduler import (
+    LLMOverloadedError,
+    LLMPriority,
+    LLMScheduler,
+    TokenBucket,
+)
+
+
+def test_token_bucket_starts_full_and_refills():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == 0
+    wait = bucket.try_take()
+    assert 0 < wait <= 0.1
+    time.sleep(wait)
+    assert bucket.try_take() == 0
+
+
+def test_waiting_calls_start_by_priority_then_arrival():
+    async def main():
+        scheduler = LLMScheduler("test", max_concurrency=1)
+        order = []
+
+        async def call(name, priority):
+            async with scheduler.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await scheduler.acquire()
+        tasks = [
+            asyncio.create_task(call("tool_1", LLMPriority.TOOL_SELECTION)),
+            asyncio.create_task(call("suggestion", LLMPriority.SUGGESTION)),
+            asyncio.create_task(call("tool_2", LLMPriority.TOOL_SELECTION)),
+            asyncio.create_task(call("answer", LLMPriority.FINAL_ANSWER)),
+        ]
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depth == 4
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert order == ["answer", "tool_1", "tool_2", "suggestion"]
+        assert scheduler.get_metrics()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_rate_limit_spaces_the_calls():
+    async def main():
+        scheduler = LLMScheduler("test", max_concurrency=10, rate_limit=20, burst=1)
+        started = []
+
+        async def call():
+            async with scheduler.slot():
+                started.append(time.monotonic())
+
+        await asyncio.gather(*(call() for _ in range(3)))
+        # One call right away, then one every 50ms
+        assert started[2] - started[0] >= 0.09
+
+    asyncio.run(main())
+
+
+def test_overloaded_scheduler_sheds_suggestions():
+    async def main():
+        scheduler = LLMScheduler("test", max_concurrency=1, max_queue_depth=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire(LLMPriority.TOOL_SELECTION))
+        await asyncio.sleep(0)
+        assert scheduler.is_overloaded()
+        with pytest.raises(LLMOverloadedError):
+            await scheduler.acquire(LLMPriority.SUGGESTION)
+
+        # A cancelled waiter doesn't hold a slot
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert not scheduler.is_overloaded()
+        scheduler.release()
+        await asyncio.wait_for(scheduler.acquire(), 1)
+        metrics = scheduler.get_metrics()
+        assert metrics["shed"] == 1
+        assert metrics["active"] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from app.deadline import Deadline, DeadlineExceededError, deadline_context, get_deadline
+from app.engine.singleflight import SingleFlight
+
+
+def test_coalesces_concurrent_calls():
+    async def main():
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def fn():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*[flight.do("key", fn) for _ in range(5)])
+        assert results == [1] * 5
+        assert calls == 1
+        assert flight.coalesced == 4
+        # The finished call is forgotten
+        assert await flight.do("key", fn) == 2
+
+    asyncio.run(main())
+
+
+def test_different_keys_are_not_coalesced():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fn(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(
+            flight.do("a", lambda: fn("a")), flight.do("b", lambda: fn("b"))
+        )
+        assert results == ["a", "b"]
+        assert flight.coalesced == 0
+
+    asyncio.run(main())
+
+
+def test_shared_call_is_cancelled_with_its_last_caller():
+    async def main():
+        flight = SingleFlight("test")
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def fn():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.create_task(flight.do("key", fn))
+        second = asyncio.create_task(flight.do("key", fn))
+        await started.wait()
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled.is_set()
+        assert flight.get_metrics()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_shared_call_ignores_the_deadline_of_its_first_caller():
+    async def main():
+        flight = SingleFlight("test")
+        seen_deadlines = []
+
+        async def fn():
+            seen_deadlines.append(get_deadline())
+            await asyncio.sleep(0.1)
+            return "done"
+
+        async def call(timeout):
+            with deadline_context(Deadline(timeout)):
+                return await flight.do("key", fn)
+
+        first = asyncio.create_task(call(0.02))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(call(5))
+        with pytest.raises(DeadlineExceededError):
+            await first
+        assert await second == "done"
+        assert seen_deadlines == [None]
+
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+from llama_index.core.tools import FunctionTool, ToolSelection
+
+from app.deadline import Deadline, DeadlineExceededError, deadline_context
+from app.workflows.tools import call_tool
+
+
+def _call(fn, deadline):
+    async def main():
+        tool = FunctionTool.from_defaults(async_fn=fn, name="lookup")
+        tool_call = ToolSelection(tool_id="1", tool_name="lookup", tool_kwargs={})
+        with deadline_context(deadline):
+            deadline.start_timer()
+            return await call_tool(None, tool, tool_call, None)  # type: ignore
+
+    return asyncio.run(main())
+
+
+def test_tool_error_is_returned_to_the_llm():
+    async def lookup() -> str:
+        raise ValueError("Not found")
+
+    message = _call(lookup, Deadline(10))
+    assert message.content == "Error: Not found"
+
+
+def test_deadline_error_of_the_tool_is_returned_to_the_llm():
+    async def lookup() -> str:
+        # E.g. a timeout of the tool's own calls
+        raise DeadlineExceededError("The lookup timed out")
+
+    message = _call(lookup, Deadline(10))
+    assert message.content == "Error: The lookup timed out"
+
+
+def test_tool_error_when_the_deadline_expires_is_returned_to_the_llm():
+    deadline = Deadline(10)
+
+    async def lookup() -> str:
+        deadline.cancel()
+        raise ValueError("Not found")
+
+    # The next LLM call fails the request instead
+    message = _call(lookup, deadline)
+    assert message.content == "Error: Not found"
+
+
+def test_expired_request_deadline_fails_the_request():
+    async def lookup() -> str:
+        await asyncio.sleep(10)
+        return "found"
+
+    with pytest.raises(DeadlineExceededError):
+        _call(lookup, Deadline(0.05))
@@ -0,0 +1,76 @@
+import re
+
+import pytest
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+
+from app.workflows.tool_outputs import (
+    READ_TOOL_OUTPUT_TOOL_NAME,
+    ToolOutputStore,
+    offload_tool_messages,
+)
+
+
+def _tool_message(content, name="interpret"):
+    return ChatMessage(
+        role=MessageRole.TOOL,
+        content=content,
+        additional_kwargs={"tool_call_id": "1", "name": name},
+    )
+
+
+def _long_output(lines=200):
+    return "\n".join(f"row {i}: value {i * 7}" for i in range(lines))
+
+
+def test_long_tool_output_is_replaced_by_a_reference_and_an_excerpt():
+    store = ToolOutputStore()
+    output = _long_output()
+    [message] = offload_tool_messages(
+        [_tool_message(output)], store, max_tokens=100, excerpt_tokens=40
+    )
+    content = str(message.content)
+    output_id = re.search(r"output_[0-9a-f]{12}", content).group(0)
+    assert "row 0: value 0" in content
+    assert "row 199: value 1393" in content
+    assert "lines omitted" in content
+    assert len(content) < len(output)
+    assert message.additional_kwargs["tool_call_id"] == "1"
+
+    tool = store.get_read_tool()
+    assert tool.metadata.name == READ_TOOL_OUTPUT_TOOL_NAME
+    assert tool.call(output_id=output_id).raw_output == output
+
+
+def test_short_and_non_tool_messages_are_kept():
+    store = ToolOutputStore()
+    messages = [
+        _tool_message("row 0: value 0"),
+        ChatMessage(role=MessageRole.ASSISTANT, content=_long_output()),
+        _tool_message(_long_output(), name=READ_TOOL_OUTPUT_TOOL_NAME),
+    ]
+    assert offload_tool_messages(messages, store, max_tokens=100) == messages
+
+
+def test_outputs_are_not_shared_between_stores():
+    store = ToolOutputStore()
+    output_id = store.put(_long_output())
+    with pytest.raises(ValueError):
+        ToolOutputStore().read_tool_output(output_id)
+
+
+def test_store_is_bounded():
+    store = ToolOutputStore(max_chars=100)
+    first = store.put("a" * 60)
+    second = store.put("b" * 60)
+    assert store.get(first) is None
+    assert store.get(second) == "b" * 60
+    assert store.put("c" * 101) is None
+
+
+def test_output_larger_than_the_store_only_keeps_the_excerpt():
+    store = ToolOutputStore(max_chars=100)
+    [message] = offload_tool_messages(
+        [_tool_message(_long_output())], store, max_tokens=100, excerpt_tokens=40
+    )
+    assert "too long to be kept" in str(message.content)
+    assert READ_TOOL_OUTPUT_TOOL_NAME not in str(message.content)
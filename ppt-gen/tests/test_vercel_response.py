@@ -0,0 +1,78 @@
+import asyncio
+
+from app.api.routers.vercel_response import VercelStreamResponse
+
+
+def _response(coalesce_window, frame_size=512):
+    # Only the coalescing settings are needed
+    response = VercelStreamResponse.__new__(VercelStreamResponse)
+    response.coalesce_window = coalesce_window
+    response.frame_size = frame_size
+    response.run = None
+    return response
+
+
+async def _tokens(count, delay=0.0, stall_at=None, stall=0.0):
+    for i in range(count):
+        if i == stall_at:
+            await asyncio.sleep(stall)
+        await asyncio.sleep(delay)
+        yield f"t{i} "
+
+
+def _coalesce(response, tokens):
+    async def main():
+        return [text async for text in response._coalesce_tokens(tokens)]
+
+    return asyncio.run(main())
+
+
+def test_tokens_are_sent_as_is_without_a_window():
+    assert _coalesce(_response(0), _tokens(5)) == ["t0 ", "t1 ", "t2 ", "t3 ", "t4 "]
+
+
+def test_tokens_are_merged_into_fewer_frames():
+    frames = _coalesce(_response(1), _tokens(50))
+    # The first token is sent right away
+    assert frames[0] == "t0 "
+    assert len(frames) == 2
+    assert "".join(frames) == "".join(f"t{i} " for i in range(50))
+
+
+def test_frames_are_bounded_by_the_frame_size():
+    frames = _coalesce(_response(1, frame_size=10), _tokens(20))
+    assert all(len(frame) <= 10 + 4 for frame in frames)
+    assert len(frames) > 5
+    assert "".join(frames) == "".join(f"t{i} " for i in range(20))
+
+
+def test_buffer_is_sent_when_the_llm_stalls():
+    async def main():
+        response = _response(0.05)
+        frames = []
+        async for text in response._coalesce_tokens(_tokens(10, stall_at=5, stall=0.3)):
+            frames.append((asyncio.get_running_loop().time(), text))
+        return frames
+
+    frames = asyncio.run(main())
+    texts = [text for _, text in frames]
+    assert texts == ["t0 ", "t1 t2 t3 t4 ", "t5 t6 t7 t8 t9 "]
+    # The tokens before the stall were sent within the window, not after it
+    assert frames[2][0] - frames[1][0] >= 0.2
+
+
+def test_closing_the_stream_stops_reading_the_tokens():
+    async def main():
+        read = []
+
+        async def tokens():
+            for i in range(100):
+                read.append(i)
+                yield f"t{i} "
+
+        stream = _response(1)._coalesce_tokens(tokens())
+        await stream.__anext__()
+        await stream.aclose()
+        return read
+
+    assert len(asyncio.run(main())) < 100